@@ -0,0 +1,14 @@
+"""The musicode language and its music library."""
+
+__all__ = ["compile_source", "CompileResult"]
+
+
+def __getattr__(name):
+    """Import the compile API when it is first used.
+
+    Importing musicode.music alone does not import the compiler.
+    """
+    if name in __all__:
+        import musicode.compiler
+        return getattr(musicode.compiler, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
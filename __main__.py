@@ -1,15 +1,16 @@
 
 import argparse
+import os
 
 import sys
-
-from ete3 import Tree
+import time
 
 import musicode.lexer as lexer
 
 from musicode.errors import error_collector, CompilerError
 from musicode.mcparser.parser import parse
 from musicode.il_gen import ILCode, SymbolTable, Context
+from musicode.outputs import OutputSink
 from musicode.tree.nodes import Root as nRoot
 from musicode.tree.nodes import Declaration, ExprStatement, Compound
 from musicode.tree.decl_nodes import Root, Identifier
@@ -19,13 +20,16 @@ from musicode.tree.expr_nodes import Identifier as eIdentifier
 def main():
     """Run the main compiler script."""
 
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        return commands[sys.argv[1]](sys.argv[2:])
+
     arguments = get_arguments()
 
     # arguments.files = ['test.mc']
 
     objs = []
     for file in arguments.files:
-        objs.append(process_file(file))
+        objs.append(process_file(file, arguments))
 
     error_collector.show()
     if any(not obj for obj in objs):
@@ -34,10 +38,10 @@ def main():
         return 0
 
 
-def process_file(file):
-
+def process_file(file, arguments=None, outputs=None):
+    """Compile a file, and add the names of its output files to outputs."""
     if file[-3:] == ".mc":
-        return process_mc_file(file)
+        return process_mc_file(file, arguments, outputs)
     else:
         err = f"unknown file type: '{file}'"
         error_collector.add(CompilerError(err))
@@ -102,34 +106,124 @@ def ordered(node):
     return strs
 
 
-def process_mc_file(file):
+def process_mc_file(file, arguments=None, outputs=None):
+    """Compile a file through the stages selected by the arguments.
 
-    code = read_file(file)
+    The stages are read, lex, parse, evaluate and output. Compiling stops
+    after the last stage needed by --emit or --check-only, so --emit tokens
+    only reads and lexes the file, and --emit ast or --check-only stop after
+    parsing it. Returns 1 if the file is compiled without errors, or None.
+    The names of the written output files are added to outputs if it is
+    given.
+    """
+    emit = arguments.emit if arguments is not None else "all"
+    check_only = arguments is not None and arguments.check_only
+    times = [] if arguments is not None and arguments.time_stages else None
+    try:
+        return compile_stages(file, arguments, emit, check_only, times,
+                              outputs)
+    finally:
+        if times:
+            print(f"{file}: " + ", ".join(
+                f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in times),
+                  file=sys.stderr)
+
+
+def compile_stages(file, arguments, emit, check_only, times, outputs):
+    """Run the stages of process_mc_file."""
+    code = timed(times, "read", read_file, file)
     if not error_collector.ok():
         return None
 
-    token_list = lexer.tokenize(code, file)
+    token_list = timed(times, "lex", lexer.tokenize, code, file)
     if not error_collector.ok():
         return None
+    if emit == "tokens":
+        write_text(arguments, "".join(
+            f"{token.r.start.line}:{token.r.start.col} {token}\n"
+            for token in token_list), outputs)
+        return 1
 
-    ast_root = parse(token_list)
+    ast_root = timed(times, "parse", parse, token_list)
     if not ast_root:
         return None
+    if check_only:
+        return 1
+    if emit == "ast":
+        write_text(arguments, tree_text(ast_root) + "\n", outputs)
+        return 1
 
     il_code = ILCode()
     symbol_table = SymbolTable()
-    ast_root.make_il(il_code, symbol_table, Context())
-    strs = ordered(ast_root)
-    strs += ";"
-    # print(strs)
-    t = Tree(strs, format=1)
-    print(t)
+    if arguments is None:
+        output_sink = OutputSink()
+    else:
+        output_sink = OutputSink(name=output_prefix(arguments),
+                                 render_jobs=arguments.render_jobs,
+                                 renderer=arguments.renderer,
+                                 render_timeout=arguments.render_timeout,
+                                 chunk_bars=arguments.chunk_bars,
+                                 score_format=arguments.score_format,
+                                 emit=emit)
+    timed(times, "evaluate", ast_root.make_il, il_code, symbol_table,
+          Context(output_sink))
+    names = timed(times, "output", output_sink.join)
+    if outputs is not None:
+        outputs.extend(names)
     if not error_collector.ok():
         return None
 
     return 1
 
 
+def timed(times, stage, func, *args):
+    """Return func(*args), and add its wall time to times if it is given."""
+    if times is None:
+        return func(*args)
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        times.append((stage, time.perf_counter() - start))
+
+
+def tree_text(ast_root):
+    """Return the syntax tree drawn by ete3, which is imported only here."""
+    from musicode.music.backends import get_backend
+    strs = ordered(ast_root)
+    strs += ";"
+    return str(get_backend("ete3").Tree(strs, format=1))
+
+
+def write_text(arguments, text, outputs=None):
+    """Write the text to the -o output file, or print it if there is none."""
+    if arguments is None or arguments.output is None:
+        sys.stdout.write(text)
+        return
+    try:
+        with open(arguments.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        if outputs is not None:
+            outputs.append(arguments.output)
+    except OSError as e:
+        descrip = f"could not write file: '{arguments.output}': {e}"
+        error_collector.add(CompilerError(descrip))
+
+
+def output_prefix(arguments):
+    """Return the prefix of the output file names.
+
+    The prefix is given as it is by serve and build for each file, and is
+    the -o output without its extension otherwise.
+    """
+    if arguments.prefix is not None:
+        return arguments.prefix
+    if arguments.output is None:
+        return "temp"
+    base, ext = os.path.splitext(arguments.output)
+    return base if ext else arguments.output
+
+
 def get_arguments():
     """Get the command-line arguments.
 
@@ -143,9 +237,407 @@ def get_arguments():
 
     # Files to compile
     parser.add_argument("files", metavar="files", nargs="+")
+    stages = parser.add_mutually_exclusive_group()
+    stages.add_argument("--emit", dest="emit", default="all",
+                        choices=["all", "tokens", "ast", "midi", "ly", "none"],
+                        help="what to output: all of the play() and score() "
+                        "outputs, the tokens, the syntax tree, only the MIDI "
+                        "files of play(), only the LilyPond sources of "
+                        "score(), or nothing after evaluating the program")
+    stages.add_argument("--check-only", dest="check_only",
+                        action="store_true",
+                        help="only check the syntax, nothing is evaluated")
+    parser.add_argument("-o", "--output", dest="output", default=None,
+                        help="output file of the tokens or the syntax tree, "
+                        "or the name of the output files, with a suffix such "
+                        "as _2 for the second one of each kind")
+    parser.add_argument("--time-stages", dest="time_stages",
+                        action="store_true",
+                        help="print the wall time of each compiler stage")
+    add_output_arguments(parser)
+
+    arguments = parser.parse_args()
+    if arguments.output is not None and len(arguments.files) > 1:
+        parser.error("-o can only be used with one file")
+    arguments.prefix = None
+    return arguments
+
+
+def add_output_arguments(parser):
+    """Add the arguments of the outputs of play() and score()."""
+    add_render_arguments(parser)
+    parser.add_argument("--chunk-bars", dest="chunk_bars", type=int,
+                        default=None,
+                        help="render each score as separate scores of this "
+                        "number of bars")
+    parser.add_argument("--score-format", dest="score_format",
+                        choices=["pdf", "musicxml"], default="pdf",
+                        help="output format of the scores, pdf is rendered "
+                        "by the score renderer, musicxml is written directly")
+
+
+def add_render_arguments(parser):
+    """Add the arguments of the score renderer to an argument parser."""
+    parser.add_argument("--render-jobs", dest="render_jobs", type=int,
+                        default=1,
+                        help="number of score renderer processes run at "
+                        "the same time")
+    parser.add_argument("--renderer", dest="renderer", default=None,
+                        help="score renderer command, default to lilypond")
+    parser.add_argument("--render-timeout", dest="render_timeout",
+                        type=float, default=None,
+                        help="seconds to wait for each score renderer "
+                        "process")
+
+
+def render_main(args):
+    """Run the render command.
+
+    Render LilyPond source files, or all of the source files in
+    directories, with a pool of renderer processes.
+    """
+    desc = "Render LilyPond source files with a pool of renderer processes"
+    parser = argparse.ArgumentParser(
+        description=desc, usage="musicode render [-h] [options] files...")
+    parser.add_argument("files", nargs="+",
+                        help=".ly files or directories of .ly files")
+    parser.add_argument("-f", "--format", dest="format", default="pdf",
+                        choices=["pdf", "png"])
+    parser.add_argument("-j", "--jobs", dest="render_jobs", type=int,
+                        default=None,
+                        help="number of renderer processes run at the same "
+                        "time, default to the number of CPUs")
+    parser.add_argument("--renderer", dest="renderer", default=None,
+                        help="score renderer command, default to lilypond")
+    parser.add_argument("--timeout", dest="render_timeout", type=float,
+                        default=None,
+                        help="seconds to wait for each renderer process")
+    arguments = parser.parse_args(args)
+
+    files = []
+    for each in arguments.files:
+        if os.path.isdir(each):
+            files += sorted(os.path.join(each, i) for i in os.listdir(each)
+                            if i.endswith(".ly"))
+        else:
+            files.append(each)
+
+    from musicode.music.lilypond import render_pool
+    with render_pool(arguments.render_jobs, arguments.render_timeout,
+                     arguments.renderer) as pool:
+        for each in files:
+            pool.submit_file(
+                each, os.path.splitext(each)[0] + "." + arguments.format)
+        results = pool.results()
+    failed = 0
+    for source, (name, outputs, error) in zip(files, results):
+        if error is None:
+            print(f"{source} -> {', '.join(outputs)}")
+        else:
+            failed += 1
+            error_collector.add(
+                CompilerError(f"could not render '{source}': {error}"))
+    error_collector.show()
+    return 1 if failed else 0
+
+
+def ingest_main(args):
+    """Run the ingest command.
+
+    Parse all of the MIDI files in a directory in a process pool, and write
+    the notes of each of them to a columnar store with a manifest.
+    """
+    desc = "Ingest the MIDI files in a directory into a columnar store"
+    parser = argparse.ArgumentParser(
+        description=desc, usage="musicode ingest [-h] [options] directory")
+    parser.add_argument("directory")
+    parser.add_argument("-o", "--output", dest="output", default=None,
+                        help="directory of the store, default to "
+                        "<directory>/store")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=None,
+                        help="number of worker processes")
+    arguments = parser.parse_args(args)
+
+    from musicode.music.ingest import ingest
+    manifest = ingest(arguments.directory, arguments.output, arguments.jobs)
+    failed = [each for each in manifest["files"] if "error" in each]
+    for each in failed:
+        error_collector.add(CompilerError(
+            f"could not ingest '{each['source']}': {each['error']}"))
+    print(f"ingested {len(manifest['files']) - len(failed)} of "
+          f"{len(manifest['files'])} MIDI files")
+    error_collector.show()
+    return 1 if failed else 0
+
+
+def index_main(args):
+    """Run the index command.
+
+    Build a melodic similarity index of the tracks of the MIDI files in a
+    columnar store made by the ingest command.
+    """
+    desc = "Build a melodic similarity index of a columnar store"
+    parser = argparse.ArgumentParser(
+        description=desc, usage="musicode index [-h] [options] store")
+    parser.add_argument("store")
+    parser.add_argument("-o", "--output", dest="output", default=None,
+                        help="directory of the index, default to "
+                        "<store>/index")
+    parser.add_argument("-n", dest="n", type=int, default=3,
+                        help="number of melody intervals of each n-gram")
+    arguments = parser.parse_args(args)
+
+    from musicode.music.similarity import build_similarity_index
+    output = arguments.output
+    if output is None:
+        output = os.path.join(arguments.store, "index")
+    header = build_similarity_index(arguments.store, output, arguments.n)
+    print(f"indexed {len(header['documents'])} tracks")
+    return 0
+
+
+def search_main(args):
+    """Run the search command.
+
+    Find the tracks of a similarity index which contain a phrase similar
+    to a track of a MIDI file, and print them from the most similar one.
+    """
+    desc = "Find the tracks of a similarity index similar to a phrase"
+    parser = argparse.ArgumentParser(
+        description=desc, usage="musicode search [-h] [options] index file")
+    parser.add_argument("index")
+    parser.add_argument("file", help="MIDI file of the phrase")
+    parser.add_argument("-t", "--track", dest="track", type=int, default=1,
+                        help="track of the phrase in the MIDI file")
+    parser.add_argument("-k", dest="k", type=int, default=10,
+                        help="number of tracks to find")
+    parser.add_argument("--candidates", dest="candidates", type=int,
+                        default=100,
+                        help="number of tracks to re-rank")
+    arguments = parser.parse_args(args)
+
+    from musicode.music import music
+    try:
+        phrase = music.read(arguments.file, mode="all",
+                            to_piece=True).tracks[arguments.track - 1]
+    except Exception as e:
+        error_collector.add(CompilerError(
+            f"could not read phrase from '{arguments.file}': {e}"))
+        error_collector.show()
+        return 1
+    index = music.similarity_index(arguments.index)
+    for score, name, track in index.query(phrase, arguments.k,
+                                          arguments.candidates):
+        print(f"{score:.3f}  {name}  track {track}")
+    return 0
+
+
+def serve_main(args):
+    """Run the serve command.
+
+    Keep the compiler loaded, and recompile the .mc files of a directory
+    when they change, or when they are sent to the Unix socket of the
+    daemon. The outputs of each file are written next to it, such as
+    song.mid for song.mc.
+    """
+    desc = "Recompile the .mc files of a directory when they change"
+    parser = argparse.ArgumentParser(
+        description=desc, usage="musicode serve [-h] [options] --watch dir")
+    parser.add_argument("--watch", dest="watch", required=True,
+                        help="directory of the .mc files")
+    parser.add_argument("--socket", dest="socket", default=None,
+                        help="Unix socket for compile requests, default to "
+                        "<dir>/.musicode.sock")
+    parser.add_argument("--no-socket", dest="no_socket",
+                        action="store_true",
+                        help="only watch the directory")
+    parser.add_argument("--poll", dest="poll", action="store_true",
+                        help="poll the files instead of using inotify")
+    parser.add_argument("--interval", dest="interval", type=float,
+                        default=0.5,
+                        help="seconds between two polls of the files")
+    parser.add_argument("--emit", dest="emit", default="all",
+                        choices=serve_emits,
+                        help="outputs of each compile")
+    add_output_arguments(parser)
+    arguments = parser.parse_args(args)
+    arguments.check_only = False
+    arguments.time_stages = False
+
+    from musicode.serve import CompileServer, make_watcher
+
+    def compile_file(file, emit=None):
+        if emit is not None and emit not in serve_emits:
+            error_collector.add(CompilerError(f"unsupported emit '{emit}'"))
+            return None
+        file_arguments = argparse.Namespace(**vars(arguments))
+        # the prefix is the file name without only the .mc extension, so
+        # that song.v1.mc and song.v2.mc have different outputs
+        file_arguments.output = None
+        file_arguments.prefix = os.path.splitext(file)[0]
+        file_arguments.emit = emit or arguments.emit
+        return process_file(file, file_arguments)
+
+    def report(file, ok, issues, elapsed):
+        for issue in issues:
+            print(issue)
+        print(f"{'compiled' if ok else 'failed'} {file} in {elapsed:.1f}ms",
+              flush=True)
+
+    socket_path = None
+    if not arguments.no_socket:
+        socket_path = arguments.socket or os.path.join(arguments.watch,
+                                                       ".musicode.sock")
+    directory = os.path.abspath(arguments.watch)
+    server = CompileServer(compile_file, directory, socket_path)
+    try:
+        watcher = make_watcher(directory, arguments.interval, arguments.poll)
+        server.start_socket()
+    except OSError as e:
+        error_collector.add(CompilerError(f"could not serve: {e}"))
+        error_collector.show()
+        return 1
+    print(f"watching {arguments.watch} with {type(watcher).__name__}" +
+          (f", listening on {socket_path}" if socket_path else ""),
+          flush=True)
+    try:
+        server.watch(watcher, report)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        server.close()
+    return 0
+
+
+def http_main(args):
+    """Run the http command.
+
+    Serve the compile and render endpoints of musicode.service over HTTP,
+    with a pool of warm worker processes.
+    """
+    desc = "Compile and render musicode sources over HTTP"
+    parser = argparse.ArgumentParser(
+        description=desc, usage="musicode http [-h] [options]")
+    parser.add_argument("--host", dest="host", default="127.0.0.1",
+                        help="address to listen on, default to 127.0.0.1")
+    parser.add_argument("--port", dest="port", type=int, default=8000,
+                        help="port to listen on, 0 for any free port")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=None,
+                        help="number of worker processes")
+    parser.add_argument("--timeout", dest="timeout", type=float,
+                        default=None,
+                        help="seconds a request waits for its compile")
+    parser.add_argument("--max-body", dest="max_body", type=int,
+                        default=2**20,
+                        help="largest request body in bytes")
+    arguments = parser.parse_args(args)
+
+    import asyncio
+    from musicode.service import run_service
+
+    def ready(service):
+        print(f"listening on http://{service.host}:{service.port} with "
+              f"{service.jobs} workers", flush=True)
+
+    try:
+        asyncio.run(run_service(arguments.host, arguments.port,
+                                arguments.jobs, arguments.timeout,
+                                arguments.max_body, ready))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        error_collector.add(CompilerError(f"could not serve: {e}"))
+        error_collector.show()
+        return 1
+    return 0
 
 
-    return parser.parse_args()
+# the outputs of musicode --emit which are written by the serve and build
+# commands
+serve_emits = ["all", "midi", "ly", "none"]
+
+
+def build_main(args):
+    """Run the build command.
+
+    Compile several files in parallel worker processes. The outputs of each
+    file are named after it, such as song.mid for song.mc, and the errors
+    of the files are shown in the order of the files once all of them are
+    compiled. Returns 1 if any file fails.
+    """
+    desc = "Compile several .mc files in parallel"
+    parser = argparse.ArgumentParser(
+        description=desc, usage="musicode build [-h] [options] files...")
+    parser.add_argument("files", metavar="files", nargs="+")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int,
+                        default=os.cpu_count() or 1,
+                        help="number of worker processes, default to the "
+                        "number of CPUs")
+    parser.add_argument("--out-dir", dest="out_dir", default=None,
+                        help="directory of the outputs, default to the "
+                        "directory of each file")
+    parser.add_argument("--summary", dest="summary", default=None,
+                        help="write a JSON summary of the build to this "
+                        "file, or to stdout if it is -")
+    parser.add_argument("--emit", dest="emit", default="all",
+                        choices=serve_emits,
+                        help="outputs of each file")
+    add_output_arguments(parser)
+    arguments = parser.parse_args(args)
+    if arguments.jobs < 1:
+        parser.error("-j/--jobs must be at least 1")
+    arguments.check_only = False
+    arguments.time_stages = False
+
+    jobs = []
+    prefixes = {}
+    for file in arguments.files:
+        # the prefix is given to the outputs as it is, so only the .mc
+        # extension is removed from song.v1.mc
+        prefix = os.path.splitext(file)[0]
+        if arguments.out_dir is not None:
+            prefix = os.path.join(arguments.out_dir, os.path.basename(prefix))
+        # the same file could be given by different paths
+        name = os.path.abspath(prefix)
+        if name in prefixes:
+            parser.error(f"'{file}' and '{prefixes[name]}' have the same "
+                         "output files")
+        prefixes[name] = file
+        file_arguments = argparse.Namespace(**vars(arguments))
+        file_arguments.output = None
+        file_arguments.prefix = prefix
+        jobs.append((file, file_arguments))
+    if arguments.out_dir is not None:
+        os.makedirs(arguments.out_dir, exist_ok=True)
+
+    import json
+    from musicode.build import build, summary
+
+    start = time.perf_counter()
+    results = build(jobs, arguments.jobs)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    # the summary on stdout is the only thing printed there
+    out = sys.stderr if arguments.summary == "-" else sys.stdout
+    for result in results:
+        for issue in result.diagnostics:
+            print(issue, file=out)
+        print(f"{'compiled' if result.ok else 'failed'} {result.file} in "
+              f"{result.time_ms:.1f}ms", file=out)
+    built = sum(i.ok for i in results)
+    print(f"built {built} of {len(results)} files in {elapsed / 1000:.2f}s "
+          f"with {min(arguments.jobs, len(results))} jobs", file=out)
+
+    if arguments.summary is not None:
+        text = json.dumps(summary(results, arguments.jobs, elapsed),
+                          indent=2)
+        if arguments.summary == "-":
+            print(text)
+        else:
+            with open(arguments.summary, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+    return 0 if built == len(results) else 1
 
 
 def read_file(file):
@@ -158,6 +650,16 @@ def read_file(file):
         error_collector.add(CompilerError(descrip))
 
 
+commands = {
+    "ingest": ingest_main,
+    "index": index_main,
+    "search": search_main,
+    "render": render_main,
+    "serve": serve_main,
+    "http": http_main,
+    "build": build_main
+}
+
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,71 @@
+"""Benchmark of chord detection over all of the chords of pieces.
+
+Run from the parent directory of the package:
+
+    python -m musicode.benchmarks.bench_detect [MIDI files]
+"""
+
+import argparse
+import glob
+import os
+import time
+
+from musicode.music import music
+
+assets = os.path.join(os.path.dirname(os.path.dirname(__file__)), "assets")
+
+
+def piece_chords(name, window=0):
+    """Return the chords of a MIDI file.
+
+    The notes of all of the tracks that start in the same window of bars are
+    one chord. If window is 0, the notes that start at the same time are one
+    chord.
+    """
+    current_piece = music.read(name, mode="all", to_piece=True)
+    groups = {}
+    for track, start_time in zip(current_piece.tracks,
+                                 current_piece.start_times):
+        current_time = start_time
+        for each, interval in zip(track.notes, track.interval):
+            if type(each) == music.note:
+                key = (current_time // window if window else round(
+                    current_time, 6))
+                groups.setdefault(key, []).append(each)
+            current_time += interval
+    chords = [music.chord(groups[i]) for i in sorted(groups)]
+    return [each for each in chords if len(each) > 2]
+
+
+def main():
+    """Time music.detect over the chords of MIDI files."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("-w", "--window", type=float, default=0,
+                        help="group the notes in windows of this many bars")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("-c", "--cache-size", type=int,
+                        help="size of the detect cache, 0 disables it")
+    args = parser.parse_args()
+
+    if args.cache_size is not None:
+        music.set_detect_cache_size(args.cache_size)
+
+    files = args.files or sorted(glob.glob(os.path.join(assets, "*.mid")))
+    chords = []
+    for name in files:
+        chords += piece_chords(name, args.window)
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for each in chords:
+            music.detect(each)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{len(chords)} chords, best of {args.repeat}: {best:.3f}s, "
+          f"{best / len(chords) * 1e6:.1f}us per chord")
+    print(music.detect_cache)
+
+
+if __name__ == "__main__":
+    main()
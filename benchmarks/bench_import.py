@@ -0,0 +1,86 @@
+"""Benchmark of the startup time of the compiler with python -X importtime.
+
+Run from the parent directory of the package:
+
+    python -m musicode.benchmarks.bench_import [-m MODULE] [--max-ms MS]
+
+The module is imported in a new interpreter, and the import times printed
+by -X importtime are read from its output. The benchmark fails if any of
+the lazily loaded backends (see music/backends.py) is imported at startup,
+or if the import takes longer than --max-ms milliseconds.
+"""
+
+import argparse
+import subprocess
+import sys
+
+from musicode.music.backends import backends
+
+
+def import_times(module):
+    """Return {module name: cumulative microseconds} of importing module.
+
+    Raises RuntimeError with the errors of the new interpreter if the
+    module could not be imported.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    lines = result.stderr.decode(errors="replace").splitlines()
+    if result.returncode != 0:
+        errors = "\n".join(i for i in lines
+                           if not i.startswith("import time:"))
+        raise RuntimeError(f"could not import {module}:\n{errors}")
+    times = {}
+    for line in lines:
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        times[fields[2].strip()] = int(fields[1])
+    return times
+
+
+def main():
+    """Time importing the compiler and check the lazy backends."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-m", "--module", default="musicode.__main__",
+                        help="module to import")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="fail if the import takes longer than this")
+    parser.add_argument("--top", type=int, default=10,
+                        help="number of the slowest imports to show")
+    args = parser.parse_args()
+
+    best = None
+    for _ in range(args.repeat):
+        try:
+            times = import_times(args.module)
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            return 1
+        if best is None or times[args.module] < best[args.module]:
+            best = times
+    total = best[args.module] / 1000
+    print(f"import {args.module}, best of {args.repeat}: {total:.1f}ms")
+    # the top-level packages are the slowest of the imports
+    top_level = sorted(((j, i) for i, j in best.items() if "." not in i),
+                       reverse=True)
+    for microseconds, name in top_level[:args.top]:
+        print(f"    {name}: {microseconds / 1000:.1f}ms")
+
+    failed = False
+    for name, (module_name, setup, usage) in backends.items():
+        if module_name in best:
+            print(f"{module_name} ({usage}) is imported at startup")
+            failed = True
+    if args.max_ms is not None and total > args.max_ms:
+        print(f"the import takes longer than {args.max_ms:.1f}ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,33 @@
+"""Micro-benchmark of looking up chord types by their aliases.
+
+Run from the parent directory of the package:
+
+    python -m musicode.benchmarks.bench_match
+"""
+
+import argparse
+import timeit
+
+from musicode.music import music
+
+
+def main():
+    """Time music.trans and the chordTypes lookups behind it."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("chord", nargs="?", default="C7sus4")
+    parser.add_argument("-n", "--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    chord_type = args.chord[1:]
+    statements = [
+        ("trans", lambda: music.trans(args.chord)),
+        ("chordTypes[]", lambda: music.chordTypes[chord_type]),
+        ("in chordTypes", lambda: chord_type in music.chordTypes),
+    ]
+    for name, statement in statements:
+        best = min(timeit.repeat(statement, number=args.number, repeat=5))
+        print(f"{name}: {best / args.number * 1e6:.2f}us per call")
+
+
+if __name__ == "__main__":
+    main()
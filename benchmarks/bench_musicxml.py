@@ -0,0 +1,72 @@
+"""Benchmark of writing scores as MusicXML and as rendered LilyPond scores.
+
+Run from the parent directory of the package:
+
+    python -m musicode.benchmarks.bench_musicxml [-n NOTES]
+
+write_musicxml is compared with gen_score_ly, which only makes the
+LilyPond source, and with gen_score, which also runs the renderer. The
+gen_score version is skipped if the renderer is not installed. The peak
+memory of each writer is measured with tracemalloc.
+"""
+
+import argparse
+import os
+import shutil
+import shlex
+import tempfile
+import time
+import tracemalloc
+
+from musicode.music import music
+from musicode.music.lilypond import lilypond_command
+from musicode.benchmarks.bench_score import random_piece, best_time
+
+
+def peak_memory(func):
+    """Return the peak memory in bytes allocated while running func."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    """Time write_musicxml, gen_score_ly and gen_score of a random piece."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-n", "--notes", type=int, default=20000,
+                        help="number of notes of each track")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    p = random_piece(args.notes)
+    directory = tempfile.mkdtemp(prefix="musicode_bench_")
+    try:
+        xml_name = os.path.join(directory, "score.musicxml")
+        ly_name = os.path.join(directory, "score.ly")
+        xml = best_time(lambda: music.write_musicxml(p, xml_name),
+                        args.repeat)
+        ly = best_time(lambda: music.gen_score_ly(p, ly_name), args.repeat)
+        print(f"{args.notes} notes per track, best of {args.repeat}")
+        print(f"write_musicxml: {xml:.3f}s, "
+              f"{os.path.getsize(xml_name) / 2**20:.1f} MiB, peak memory "
+              f"{peak_memory(lambda: music.write_musicxml(p, xml_name)) / 2**20:.1f} MiB")
+        print(f"gen_score_ly: {ly:.3f}s, "
+              f"{os.path.getsize(ly_name) / 2**20:.1f} MiB, peak memory "
+              f"{peak_memory(lambda: music.gen_score_ly(p, ly_name)) / 2**20:.1f} MiB")
+
+        if shutil.which(shlex.split(lilypond_command)[0]) is None:
+            print(f"{lilypond_command} is not installed")
+            return
+        pdf_name = os.path.join(directory, "score.pdf")
+        rendered = best_time(lambda: music.gen_score(p, pdf_name, cache=False),
+                             1)
+        print(f"gen_score: {rendered:.3f}s ({rendered / xml:.1f}x)")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
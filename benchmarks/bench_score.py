@@ -0,0 +1,83 @@
+"""Benchmark of making the LilyPond source of scores with and without abjad.
+
+Run from the parent directory of the package:
+
+    python -m musicode.benchmarks.bench_score [-n NOTES]
+
+Only the LilyPond source is made, LilyPond itself is not run. The abjad
+version is skipped if abjad is not installed.
+"""
+
+import argparse
+import random
+import time
+
+from musicode.music import music
+
+
+def random_piece(notes, tracks=2, seed=0):
+    """Return a piece of tracks of random notes with some chords."""
+    rand = random.Random(seed)
+    result = []
+    for _ in range(tracks):
+        result.append(music.chord(
+            [music.degree_to_note(rand.randint(40, 80),
+                                  rand.choice([1 / 8, 1 / 4, 3 / 8]))
+             for _ in range(notes)],
+            interval=[rand.choice([0, 1 / 8, 1 / 4])
+                      for _ in range(notes - 1)] + [1 / 4]))
+    return music.piece(result)
+
+
+def abjad_source(abjad, p):
+    """Return the LilyPond source of the score made by gen_abjad_score."""
+    staffs = []
+    for i, current_chord in enumerate(p.tracks):
+        voices = []
+        for each in music.gen_abjad_str(current_chord):
+            voice = abjad.Voice()
+            voice.extend(each)
+            voices.append(voice)
+        staffs.append(abjad.Staff(voices, name=f"staff_{i}",
+                                  simultaneous=True))
+    all_staff = abjad.StaffGroup(name="staff_all")
+    all_staff.extend(staffs)
+    return abjad.lilypond(abjad.Score([all_staff], name="Score"))
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    """Time gen_score_ly and the abjad score of a random piece."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-n", "--notes", type=int, default=2000,
+                        help="number of notes of each track")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    p = random_piece(args.notes)
+    native = best_time(lambda: music.gen_score_ly(p), args.repeat)
+    print(f"{args.notes} notes per track, best of {args.repeat}, "
+          f"gen_score_ly: {native:.3f}s")
+
+    start = time.perf_counter()
+    try:
+        import abjad
+    except ImportError:
+        print("abjad is not installed")
+        return
+    print(f"import abjad: {time.perf_counter() - start:.3f}s")
+    with_abjad = best_time(lambda: abjad_source(abjad, p), args.repeat)
+    print(f"abjad: {with_abjad:.3f}s ({with_abjad / native:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
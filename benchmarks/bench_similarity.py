@@ -0,0 +1,79 @@
+"""Benchmark of building and querying a melodic similarity index.
+
+Run from the parent directory of the package:
+
+    python -m musicode.benchmarks.bench_similarity [-n TRACKS]
+
+The corpus is made of random melodies, and a few of them contain a
+transposed copy of the query phrase, which should be found first.
+"""
+
+import argparse
+import random
+import tempfile
+import time
+
+from musicode.music import music
+
+
+def random_melody(rand, length):
+    """Return the onsets and pitches of a random walk melody."""
+    onsets = []
+    pitches = []
+    onset = 0
+    pitch = rand.randint(55, 75)
+    for _ in range(length):
+        onsets.append(onset)
+        pitches.append(pitch)
+        onset += rand.choice([120, 240, 240, 480])
+        pitch = min(max(pitch + rand.randint(-5, 5), 36), 96)
+    return onsets, pitches
+
+
+def main():
+    """Time building the index and the queries of a synthetic corpus."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-n", "--tracks", type=int, default=20000)
+    parser.add_argument("-l", "--length", type=int, default=200,
+                        help="number of notes of each track")
+    parser.add_argument("-q", "--queries", type=int, default=20)
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    phrase_onsets, phrase_pitches = random_melody(rand, 16)
+    planted = set(rand.sample(range(args.tracks), 5))
+    tracks = []
+    for i in range(args.tracks):
+        onsets, pitches = random_melody(rand, args.length)
+        if i in planted:
+            start = rand.randrange(args.length - 16)
+            shift = rand.randint(-6, 6)
+            offset = onsets[start] - phrase_onsets[0]
+            onsets[start:start + 16] = [j + offset for j in phrase_onsets]
+            pitches[start:start + 16] = [j + shift for j in phrase_pitches]
+            onsets[start + 16:] = [
+                j - onsets[start + 16] + onsets[start + 15] + 240
+                for j in onsets[start + 16:]
+            ]
+        tracks.append((f"track_{i}", 1,
+                       music.melody_tokens(onsets, pitches)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        music.build_similarity_index(tracks, directory)
+        print(f"{args.tracks} tracks of {args.length} notes, build: "
+              f"{time.perf_counter() - start:.3f}s")
+        index = music.similarity_index(directory)
+        phrase = music.melody_tokens(phrase_onsets, phrase_pitches)
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            result = index.query(phrase, k=5)
+        elapsed = (time.perf_counter() - start) / args.queries
+        found = {int(name.split("_")[1]) for score, name, track in result}
+        print(f"query: {elapsed * 1000:.2f}ms, planted tracks found in the "
+              f"top 5: {len(found & planted)} of {len(planted)}")
+        del index
+
+
+if __name__ == "__main__":
+    main()
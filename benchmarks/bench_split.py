@@ -0,0 +1,54 @@
+"""Benchmark of splitting the melody and the chords of large tracks.
+
+Run from the parent directory of the package:
+
+    python -m musicode.benchmarks.bench_split [MIDI files]
+"""
+
+import argparse
+import random
+import time
+
+from musicode.music import music
+
+
+def random_track(length, seed=0):
+    """Return a chord of random notes, some of which are played together."""
+    rand = random.Random(seed)
+    notes = [
+        music.degree_to_note(rand.randint(36, 84), rand.choice([0.125, 0.25]))
+        for _ in range(length)
+    ]
+    intervals = [rand.choice([0, 0.125, 0.25]) for _ in range(length)]
+    return music.chord(notes, interval=intervals)
+
+
+def main():
+    """Time music.split_all over large tracks."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("-n", "--notes", type=int, default=20000,
+                        help="number of notes of the random track")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.files:
+        tracks = []
+        for name in args.files:
+            tracks += music.read(name, mode="all", to_piece=True).tracks
+    else:
+        tracks = [random_track(args.notes)]
+    notes = sum(len(each) for each in tracks)
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for each in tracks:
+            music.split_all(each)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{len(tracks)} tracks, {notes} notes, best of {args.repeat}: "
+          f"{best:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Benchmark of the length in seconds of pieces with tempo changes.
+
+Run from the parent directory of the package:
+
+    python -m musicode.benchmarks.bench_tempo [-n NOTES] [-c CHANGES]
+
+piece.eval_time(normalize_tempo=True), which uses the tempo map of the
+piece, is compared with normalizing the tempo of a copy of the piece. The
+tracks start at different bars, and the benchmark fails if the two lengths
+are not the same.
+"""
+
+import argparse
+import random
+import sys
+import time
+from copy import deepcopy
+
+from musicode.music import music
+
+
+def random_piece(notes, changes, tracks=2, seed=0):
+    """Return a piece of tracks with tempo changes which start late."""
+    rand = random.Random(seed)
+    result = []
+    for _ in range(tracks):
+        current = music.chord(
+            [music.degree_to_note(rand.randint(40, 80), 1 / 4)
+             for _ in range(notes)],
+            interval=[rand.choice([1 / 8, 1 / 4]) for _ in range(notes)])
+        for i in sorted(rand.sample(range(notes), changes), reverse=True):
+            current.notes.insert(i, music.tempo(rand.randint(60, 180)))
+            current.interval.insert(i, 0)
+        result.append(current)
+    start_times = [rand.choice([1, 1.5, 2.25]) for _ in range(tracks)]
+    return music.piece(result, [1] * tracks, 120, start_times=start_times)
+
+
+def normalized_time(current_piece):
+    """Return the length of a piece by normalizing the tempo of a copy."""
+    temp = deepcopy(current_piece)
+    temp.normalize_tempo()
+    return temp.eval_time()
+
+
+def main():
+    """Time piece.eval_time with tempo changes and check it."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-n", "--notes", type=int, default=2000,
+                        help="number of notes of each track")
+    parser.add_argument("-c", "--changes", type=int, default=50,
+                        help="number of tempo changes of each track")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    current_piece = random_piece(args.notes, args.changes)
+    results = {}
+    for name, func in [
+        ("tempo map", lambda: current_piece.eval_time(normalize_tempo=True)),
+        ("normalized copy", lambda: normalized_time(current_piece)),
+    ]:
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[name] = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name}: {results[name]}, best of {args.repeat}: "
+              f"{best:.3f}s")
+    if results["tempo map"] != results["normalized copy"]:
+        print("the lengths are not the same")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
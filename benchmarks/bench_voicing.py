@@ -0,0 +1,42 @@
+"""Benchmark of voicing long chord progressions with the least voice movement.
+
+Run from the parent directory of the package:
+
+    python -m musicode.benchmarks.bench_voicing
+"""
+
+import argparse
+import random
+import time
+
+from musicode.music import music
+
+CHORD_NAMES = [
+    "C", "Dm", "Em", "F", "G7", "Am", "Bdim", "Cmaj7", "F#m7", "Bbmaj9",
+    "Ebsus", "Abaug"
+]
+
+
+def main():
+    """Time music.chord_progression with voice leading."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-n", "--chords", type=int, default=500,
+                        help="number of chords of the random progression")
+    parser.add_argument("-b", "--beam", type=int, default=32)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    names = [rand.choice(CHORD_NAMES) for _ in range(args.chords)]
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        music.chord_progression(names, voice_leading=True, beam=args.beam)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{args.chords} chords, beam {args.beam}, best of {args.repeat}: "
+          f"{best:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
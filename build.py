@@ -0,0 +1,115 @@
+"""Objects for the parallel builds run by musicode build.
+
+Each file is compiled in a worker process with an error collector of its
+own, so the files do not share any state of the compiler and the errors of
+one file are never reported for another one. The results are returned in
+the order of the files, whichever worker finishes first.
+"""
+
+import concurrent.futures
+import concurrent.futures.process
+import time
+
+from musicode.errors import collect_errors, CompilerError
+
+
+class BuildResult:
+    """Result of compiling one file.
+
+    file (str) - Path of the compiled file.
+    ok (bool) - Whether the file is compiled without errors.
+    diagnostics (List[CompilerError]) - Errors and warnings of the file.
+    outputs (List[str]) - Names of the files written for it.
+    time_ms (float) - Milliseconds taken by its compile.
+    """
+
+    def __init__(self, file, ok, diagnostics, outputs, time_ms):
+        """Initialize BuildResult."""
+        self.file = file
+        self.ok = ok
+        self.diagnostics = diagnostics
+        self.outputs = outputs
+        self.time_ms = time_ms
+
+
+def build_file(file, arguments):
+    """Compile one file with the arguments of musicode and return a
+    BuildResult. This runs in the worker processes.
+    """
+    # imported here, since __main__ imports this module for the command
+    from musicode.__main__ import process_file
+
+    outputs = []
+    start = time.perf_counter()
+    with collect_errors() as collector:
+        try:
+            ok = bool(process_file(file, arguments, outputs))
+        except Exception as e:
+            # an internal error of one file does not stop the build
+            collector.add(CompilerError(f"internal error: {e!r}"))
+            ok = False
+    elapsed = (time.perf_counter() - start) * 1000
+    return BuildResult(file, ok, collector.issues, outputs, elapsed)
+
+
+def failed_result(file, message):
+    """Return the BuildResult of a file whose worker did not return."""
+    return BuildResult(file, False, [CompilerError(message)], [], 0.0)
+
+
+def build(jobs, workers=1, report=None):
+    """Compile files and return their BuildResults in the same order.
+
+    jobs (List[Tuple[str, Namespace]]) - The files, each with the arguments
+    of musicode to compile it with.
+    workers (int) - Number of worker processes. The files are compiled in
+    the current process if it is 1.
+    report (function) - report(result) is called as soon as each file is
+    compiled, in the order the files finish.
+    """
+    results = [None] * len(jobs)
+    if workers <= 1 or len(jobs) <= 1:
+        for i, (file, arguments) in enumerate(jobs):
+            results[i] = build_file(file, arguments)
+            if report is not None:
+                report(results[i])
+        return results
+
+    with concurrent.futures.ProcessPoolExecutor(
+            min(workers, len(jobs))) as executor:
+        futures = {executor.submit(build_file, file, arguments): i
+                   for i, (file, arguments) in enumerate(jobs)}
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            file = jobs[i][0]
+            try:
+                results[i] = future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                results[i] = failed_result(
+                    file, "internal error: the worker process died")
+            except Exception as e:
+                results[i] = failed_result(file, f"internal error: {e!r}")
+            if report is not None:
+                report(results[i])
+    return results
+
+
+def summary(results, workers, elapsed):
+    """Return the JSON summary of a build.
+
+    results (List[BuildResult]) - Results of the files, in their order.
+    workers (int) - Number of worker processes of the build.
+    elapsed (float) - Milliseconds taken by the whole build.
+    """
+    from musicode.serve import diagnostic
+
+    return {"ok": all(i.ok for i in results),
+            "jobs": workers,
+            "time_ms": elapsed,
+            "files": [{"file": i.file,
+                       "ok": i.ok,
+                       "time_ms": i.time_ms,
+                       "outputs": i.outputs,
+                       "diagnostics": [diagnostic(j)
+                                       for j in i.diagnostics]}
+                      for i in results]}
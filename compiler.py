@@ -0,0 +1,74 @@
+"""In-process API of the compiler.
+
+compile_source compiles the text of a program without reading or writing
+any files or printing anything. The errors go to a collector of its own,
+and the outputs of play() and score() are kept in memory, so it can be
+called from many threads of a service at the same time.
+"""
+
+import musicode.lexer as lexer
+
+from musicode.errors import collect_errors
+from musicode.mcparser.parser import parse
+from musicode.il_gen import ILCode, SymbolTable, Context
+from musicode.outputs import MemorySink
+
+
+class CompileResult:
+    """Result of compile_source.
+
+    diagnostics (List[CompilerError]) - Errors and warnings, sorted by
+    their position.
+    midi (List[bytes]) - MIDI files of the play() expressions, in the
+    order they are evaluated.
+    ly (List[str]) - LilyPond sources of the score() expressions, if they
+    are asked for.
+    musicxml (List[bytes]) - MusicXML files of the score() expressions, if
+    they are asked for.
+    """
+
+    def __init__(self, diagnostics, midi, ly, musicxml=()):
+        """Initialize CompileResult."""
+        self.diagnostics = diagnostics
+        self.midi = midi
+        self.ly = ly
+        self.musicxml = list(musicxml)
+
+    @property
+    def ok(self):
+        """Return True iff there are no errors."""
+        return not any(not issue.warning for issue in self.diagnostics)
+
+    def __repr__(self):  # pragma: no cover
+        return (f"CompileResult(ok={self.ok}, "
+                f"diagnostics={len(self.diagnostics)}, "
+                f"midi={len(self.midi)}, ly={len(self.ly)}, "
+                f"musicxml={len(self.musicxml)})")
+
+
+def compile_source(text, *, filename=None, outputs=("midi",)):
+    """Compile the text of a program and return a CompileResult.
+
+    filename (str) - Name of the file in the positions of the diagnostics.
+    outputs (Iterable[str]) - "midi" for the MIDI files of play(), "ly"
+    for the LilyPond sources of score(), and "musicxml" for the MusicXML
+    files of score(). Nothing is rendered.
+
+    The program is not evaluated if it has syntax errors.
+    """
+    outputs = set(outputs)
+    unknown = outputs - MemorySink.kinds
+    if unknown:
+        raise ValueError(f"unknown outputs: {', '.join(sorted(unknown))}")
+    if filename is None:
+        filename = "<source>"
+
+    sink = MemorySink(outputs)
+    with collect_errors() as collector:
+        token_list = lexer.tokenize(text, filename)
+        if collector.ok():
+            ast_root = parse(token_list)
+            if ast_root:
+                ast_root.make_il(ILCode(), SymbolTable(), Context(sink))
+    return CompileResult(collector.issues, sink.midi, sink.ly,
+                         sink.musicxml)
@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 
 
 class ErrorCollector:
@@ -26,7 +28,42 @@ class ErrorCollector:
         self.issues = []
 
 
-error_collector = ErrorCollector()
+class CurrentErrorCollector:
+    """The error collector of the compile running in the current context.
+
+    Every module reports errors to error_collector, which is this object.
+    It passes everything to the ErrorCollector set by collect_errors() in
+    the current thread or task, or to a global one outside of
+    collect_errors(), so that compiles running at the same time (or one
+    after another in the same process) do not see each other's errors.
+    """
+
+    def __init__(self):
+        """Initialize with the global ErrorCollector."""
+        self.default = ErrorCollector()
+        self.current = ContextVar("error_collector")
+
+    def get(self):
+        """Return the ErrorCollector of the current context."""
+        return self.current.get(self.default)
+
+    def __getattr__(self, name):
+        """Get the attribute of the ErrorCollector of the current context."""
+        return getattr(self.get(), name)
+
+    @contextmanager
+    def collect(self):
+        """Collect the errors of the enclosed code in a new ErrorCollector."""
+        collector = ErrorCollector()
+        token = self.current.set(collector)
+        try:
+            yield collector
+        finally:
+            self.current.reset(token)
+
+
+error_collector = CurrentErrorCollector()
+collect_errors = error_collector.collect
 
 
 class Position:
@@ -70,6 +107,14 @@ class CompilerError(Exception):
         self.range = range
         self.warning = warning
 
+    def __reduce__(self):
+        """Pickle the error as a CompilerError with the same message.
+
+        This keeps the range and the warning flag when errors are sent
+        between processes.
+        """
+        return (CompilerError, (self.descrip, self.range, self.warning))
+
     def __str__(self):  # pragma: no cover
         """Return a pretty-printable statement of the error.
 
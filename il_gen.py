@@ -211,12 +211,17 @@ class SymbolTable:
 
 class Context:
 
-    def __init__(self):
-        """Initialize Context."""
+    def __init__(self, output_sink=None):
+        """Initialize Context.
+
+        output_sink (OutputSink) - Queue for the outputs of play() and score()
+        expressions, if None they are rendered immediately.
+        """
         self.break_label = None
         self.continue_label = None
         self.return_type = None
         self.is_global = False
+        self.output_sink = output_sink
 
     def set_global(self, val):
         """Return copy of self with is_global set to given value."""
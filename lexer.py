@@ -174,9 +174,19 @@ def chunk_to_str(chunk):
     return "".join(c.c for c in chunk)
 
 
+# The symbol kinds starting with each character, longest first, the same
+# order as symbol_kinds, so that only these are tried at each character.
+symbol_kinds_by_first = {}
+for symbol_kind in symbol_kinds:
+    symbol_kinds_by_first.setdefault(symbol_kind.text_repr[0],
+                                     []).append(symbol_kind)
+
+
 def match_symbol_kind_at(content, start):
 
-    for symbol_kind in symbol_kinds:
+    if start >= len(content):
+        return None
+    for symbol_kind in symbol_kinds_by_first.get(content[start].c, ()):
         try:
             for i, c in enumerate(symbol_kind.text_repr):
                 if content[start + i].c != c:
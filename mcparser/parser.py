@@ -1,3 +1,4 @@
+import threading
 
 import musicode.mcparser.utils as p
 import musicode.tree.nodes as nodes
@@ -9,16 +10,23 @@ from musicode.mcparser.declaration import parse_declaration
 from musicode.mcparser.statement import parse_statement
 
 
+# The parser keeps its state in the globals of utils, so one file is
+# parsed at a time, and the state is reset before each of them.
+parse_lock = threading.Lock()
+
+
 def parse(tokens_to_parse):
 
-    p.best_error = None
-    p.tokens = tokens_to_parse
+    with parse_lock:
+        p.best_error = None
+        p.tokens = tokens_to_parse
+        p.symbols = p.SimpleSymbolTable()
 
-    with log_error():
-        return parse_root(0)[0]
+        with log_error():
+            return parse_root(0)[0]
 
-    error_collector.add(p.best_error)
-    return None
+        error_collector.add(p.best_error)
+        return None
 
 
 @add_range
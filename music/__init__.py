@@ -0,0 +1 @@
+from .music import *
@@ -0,0 +1,184 @@
+from functools import lru_cache
+
+from .database import standard, standard_reverse, chordTypes
+from .structures import note, chord, piece
+from .degree_tables import chord_degree_table
+from .backends import get_backend
+
+# batch harmonic analysis of whole chords and pieces, the notes are turned
+# into arrays of onsets, durations and pitch classes once, and then the
+# duration-weighted pitch class histograms of all of the windows are built
+# and matched against the key profiles and the chord templates with array
+# operations instead of walking the notes of each window
+
+# the Krumhansl-Kessler key profiles of C major and C minor
+major_profile = [
+    6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88
+]
+minor_profile = [
+    6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17
+]
+
+
+@lru_cache(maxsize=None)
+def build_key_profiles():
+    # the profiles of the 24 major and minor keys as the rows of an array,
+    # rotated to each root, with the names of the keys, which are built the
+    # first time they are used so that importing this module needs no numpy
+    numpy = get_backend('numpy')
+    profiles = []
+    names = []
+    for mode, profile in (('major', major_profile), ('minor',
+                                                     minor_profile)):
+        for root in range(12):
+            profiles.append(numpy.roll(profile, root))
+            names.append(f'{standard_reverse[root]} {mode}')
+    return numpy.array(profiles), names
+
+
+@lru_cache(maxsize=None)
+def build_chord_templates():
+    # the pitch class sets of all of the chord types of the 12 roots as
+    # the rows of a 0/1 array, with the chord names in the same form as
+    # the results of detect
+    numpy = get_backend('numpy')
+    templates = []
+    names = []
+    for root in range(12):
+        for key in chordTypes.dic:
+            current_template = numpy.zeros(12)
+            degrees = chord_degree_table(key)[root][0]
+            current_template[[i % 12 for i in degrees]] = 1
+            templates.append(current_template)
+            names.append(f'{standard_reverse[root]}{key[0]}')
+    return numpy.array(templates), names
+
+
+def note_arrays(obj, start_time=0):
+    # return the arrays of the onsets (in bars), durations
+    # and pitch classes of all of the notes of a chord or a piece
+    numpy = get_backend('numpy')
+    if type(obj) == piece:
+        tracks = list(zip(obj.tracks, obj.start_times))
+    elif type(obj) == chord:
+        tracks = [(obj, start_time)]
+    else:
+        raise ValueError('only chord and piece can be analyzed')
+    onsets = []
+    durations = []
+    pitch_classes = []
+    for current_chord, current_start_time in tracks:
+        notes = current_chord.notes
+        current_onsets = numpy.cumsum([0] + current_chord.interval[:-1],
+                                      dtype=float) + current_start_time
+        inds = [i for i in range(len(notes)) if type(notes[i]) == note]
+        onsets.append(current_onsets[inds])
+        durations.append([notes[i].duration for i in inds])
+        pitch_classes.append([standard[notes[i].name] % 12 for i in inds])
+    if not tracks:
+        return numpy.zeros(0), numpy.zeros(0), numpy.zeros(0, dtype=int)
+    return (numpy.concatenate(onsets),
+            numpy.concatenate(durations).astype(float),
+            numpy.concatenate(pitch_classes).astype(int))
+
+
+def pitch_class_histograms(onsets, durations, pitch_classes, window=1):
+    # the duration-weighted pitch class histograms of the windows of the
+    # given length in bars, a note that lasts over several windows adds its
+    # overlap with each of them, returns an array of shape (windows, 12)
+    numpy = get_backend('numpy')
+    ends = onsets + durations
+    if len(onsets) == 0:
+        return numpy.zeros((0, 12))
+    first_windows = numpy.floor(onsets / window).astype(int)
+    last_windows = numpy.maximum(
+        numpy.ceil(ends / window).astype(int) - 1, first_windows)
+    window_num = int(last_windows.max()) + 1
+    # repeat each note once for each window it overlaps
+    counts = last_windows - first_windows + 1
+    note_inds = numpy.repeat(numpy.arange(len(onsets)), counts)
+    offsets = numpy.arange(len(note_inds)) - numpy.repeat(
+        numpy.cumsum(counts) - counts, counts)
+    window_inds = first_windows[note_inds] + offsets
+    weights = numpy.minimum(ends[note_inds],
+                            (window_inds + 1) * window) - numpy.maximum(
+                                onsets[note_inds], window_inds * window)
+    result = numpy.zeros((window_num, 12))
+    numpy.add.at(result, (window_inds, pitch_classes[note_inds]),
+                 numpy.maximum(weights, 0))
+    return result
+
+
+def sum_windows(histograms, size):
+    # the sums of the histograms over the windows centered on each window,
+    # with a sliding sum of the cumulative sums
+    numpy = get_backend('numpy')
+    if size <= 1:
+        return histograms
+    cumulative = numpy.concatenate(
+        [numpy.zeros((1, 12)),
+         numpy.cumsum(histograms, axis=0)])
+    window_num = len(histograms)
+    starts = numpy.clip(numpy.arange(window_num) - size // 2, 0, window_num)
+    ends = numpy.clip(starts + size, 0, window_num)
+    return cumulative[ends] - cumulative[starts]
+
+
+def correlate(histograms, profiles):
+    # the pearson correlations of each histogram with each profile
+    numpy = get_backend('numpy')
+    histograms = histograms - histograms.mean(axis=1, keepdims=True)
+    profiles = profiles - profiles.mean(axis=1, keepdims=True)
+    norms = numpy.linalg.norm(histograms, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (histograms / norms) @ (
+        profiles / numpy.linalg.norm(profiles, axis=1, keepdims=True)).T
+
+
+def detect_keys(histograms, key_window=1):
+    # the most likely key of each window, the histograms of key_window
+    # windows around each window are added up first, the windows without
+    # any notes get None
+    key_profiles, key_names = build_key_profiles()
+    histograms = sum_windows(histograms, key_window)
+    best = correlate(histograms, key_profiles).argmax(axis=1)
+    empty = histograms.sum(axis=1) == 0
+    return [
+        None if empty[i] else key_names[best[i]] for i in range(len(best))
+    ]
+
+
+def detect_window_chords(histograms, threshold=0.1):
+    # the chord template with the highest cosine similarity to the pitch
+    # classes of each window, the pitch classes that take up less than
+    # threshold of the duration of the window are ignored, the windows
+    # with less than 3 pitch classes get None
+    numpy = get_backend('numpy')
+    chord_templates, chord_template_names = build_chord_templates()
+    totals = histograms.sum(axis=1, keepdims=True)
+    totals[totals == 0] = 1
+    weights = histograms / totals
+    weights[weights < threshold] = 0
+    norms = numpy.linalg.norm(weights, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    similarities = (weights / norms) @ (chord_templates / numpy.linalg.norm(
+        chord_templates, axis=1, keepdims=True)).T
+    best = similarities.argmax(axis=1)
+    pitch_class_nums = (weights > 0).sum(axis=1)
+    return [
+        None if pitch_class_nums[i] < 3 else chord_template_names[best[i]]
+        for i in range(len(best))
+    ]
+
+
+def harmonic_timeline(obj, window=1, key_window=4, start_time=0,
+                      threshold=0.1):
+    # analyze the keys and chords of a chord or a piece over the windows
+    # of the given length in bars, returns a list of [bar, key, chord],
+    # where bar is the start of the window counting from bar 1
+    histograms = pitch_class_histograms(*note_arrays(obj, start_time),
+                                        window)
+    keys = detect_keys(histograms, key_window)
+    chords = detect_window_chords(histograms, threshold)
+    return [[i * window + 1, keys[i], chords[i]]
+            for i in range(len(histograms))]
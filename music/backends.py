@@ -0,0 +1,62 @@
+import os
+import importlib
+import threading
+
+# the heavy optional modules used by only some of the functions of the
+# package, such as pygame for playing audio and abjad for making scores
+# with abjad, are imported the first time they are used instead of when
+# the package is imported, so that compiling a program which only makes
+# MIDI files does not wait for them or need an audio device, each backend
+# is the name of a module with an optional setup function which is called
+# with the module once after it is imported
+
+
+def setup_pygame(pygame):
+    pygame.mixer.init(44100, -16, 2, 1024)
+
+
+backends = {}
+loaded_backends = {}
+backends_lock = threading.RLock()
+
+
+def register_backend(name, module, setup=None, usage=None):
+    # usage is what the backend is needed for, which is shown if it could
+    # not be imported
+    backends[name] = (module, setup, usage)
+
+
+def get_backend(name):
+    # the module of a backend, which is imported and set up if it is the
+    # first time it is used
+    if name in loaded_backends:
+        return loaded_backends[name]
+    with backends_lock:
+        if name not in loaded_backends:
+            module_name, setup, usage = backends[name]
+            try:
+                current_module = importlib.import_module(module_name)
+            except ImportError as e:
+                raise ImportError(
+                    f'{module_name} is required for {usage or name}, please make sure it is installed: {e}'
+                ) from e
+            if setup is not None:
+                setup(current_module)
+            loaded_backends[name] = current_module
+    return loaded_backends[name]
+
+
+def backend_loaded(name):
+    return name in loaded_backends
+
+
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = 'hide'
+register_backend('pygame', 'pygame', setup_pygame, 'playing audio')
+register_backend('abjad', 'abjad', usage='making scores with abjad')
+register_backend('mido', 'mido', usage='reading MIDI files')
+register_backend('midiutil', 'midiutil.MidiFile', usage='writing MIDI files')
+register_backend(
+    'numpy',
+    'numpy',
+    usage='harmonic analysis, voice leading, motifs and similarity search')
+register_backend('ete3', 'ete3', usage='printing the syntax tree')
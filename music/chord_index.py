@@ -0,0 +1,99 @@
+from .database import chordTypes, standard, standard_reverse
+from .degree_tables import chord_degree_table
+
+# an index of the chord types of all of the 12 roots by the 12-bit masks
+# of their pitch classes, bit i of a mask is set if the pitch class i
+# (C is 0, C# is 1, ...) is in the chord, the inversions of a chord have
+# the same mask as the chord, so each entry also records the bass notes
+
+popcount = [bin(i).count('1') for i in range(1 << 12)]
+
+
+def pitch_class_mask(degrees):
+    mask = 0
+    for each in degrees:
+        mask |= 1 << (each % 12)
+    return mask
+
+
+def names_mask(names):
+    return pitch_class_mask(standard[i] for i in names)
+
+
+def chord_mask(current_chord):
+    return names_mask(current_chord.names())
+
+
+def build_chord_masks():
+    masks = {}
+    masks_list = []
+    for root in range(12):
+        for key in chordTypes.dic:
+            chord_type = key[0]
+            # all of the voicings of a chord type have the same pitch classes
+            degrees = chord_degree_table(key)[root][0]
+            mask = pitch_class_mask(degrees)
+            bass_notes = []
+            for each in degrees:
+                if each % 12 not in bass_notes:
+                    bass_notes.append(each % 12)
+            entry = (standard_reverse[root], chord_type,
+                     tuple(standard_reverse[i] for i in bass_notes))
+            if mask not in masks:
+                masks[mask] = []
+                masks_list.append(mask)
+            masks[mask].append(entry)
+    return masks, masks_list
+
+
+chord_masks, chord_masks_list = build_chord_masks()
+
+
+def lookup_mask(mask, bass=None):
+    # return the (root, chord type, bass notes) of the chords with exactly
+    # the pitch classes of the mask, if bass is given, only return the
+    # chords which have an inversion with this bass note
+    result = chord_masks.get(mask, [])
+    if bass is not None:
+        bass = standard_reverse[standard[bass] % 12]
+        result = [i for i in result if bass in i[2]]
+    return result
+
+
+def nearest_masks(mask, n=1):
+    # return the n nearest chord masks to the mask by the hamming distance
+    # (the number of pitch classes that are different), the ties are in
+    # the order of the index, which is by roots from C and then chordTypes
+    distances = [(popcount[mask ^ i], i) for i in chord_masks_list]
+    distances.sort(key=lambda s: s[0])
+    return distances[:n]
+
+
+def nearest_chords(mask, n=1):
+    # return the (distance, root, chord type) of the n nearest chords
+    result = []
+    for distance, each in nearest_masks(mask, len(chord_masks_list)):
+        for root, chord_type, bass_notes in chord_masks[each]:
+            result.append((distance, root, chord_type))
+            if len(result) == n:
+                return result
+    return result
+
+
+chord_templates_dict = {}
+
+
+def chord_templates(root_name):
+    # the (chord type, note names, note names set) of all of the chord types
+    # with the root, which are the note names of chd(root, chord type)
+    if root_name not in chord_templates_dict:
+        root = standard[root_name] % 12
+        templates = []
+        for key in chordTypes.dic:
+            chord_type = key[0]
+            degrees = chord_degree_table(key)[root][0]
+            names = [root_name
+                     ] + [standard_reverse[i % 12] for i in degrees[1:]]
+            templates.append((chord_type, names, frozenset(names)))
+        chord_templates_dict[root_name] = templates
+    return chord_templates_dict[root_name]
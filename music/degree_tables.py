@@ -0,0 +1,69 @@
+from .database import chordTypes, scaleTypes
+
+# the degrees of the notes of every chord type and scale type for each of
+# the 12 roots, so that a chord or a scale is made by looking up the
+# degrees of its root in the table and adding the octave of the root,
+# the degrees in the tables are counted from C-1 (degree 0), the tables
+# are filled lazily and each entry is rebuilt if its chord type or scale
+# type is changed in chordTypes or scaleTypes
+
+# chord type key -> (the voicings in chordTypes, the degrees of the
+# voicings of each root)
+chord_degree_tables = {}
+# scale type key -> (the intervals in scaleTypes, the degrees of each root)
+scale_degree_tables = {}
+
+
+def chord_degree_table(key):
+    # the degrees of the voicings of the chord type for each root
+    voicings = chordTypes.dic[key]
+    current = chord_degree_tables.get(key)
+    if current is None or current[0] is not voicings:
+        current = (voicings, [
+            tuple((root, ) + tuple(root + i for i in each)
+                  for each in voicings) for root in range(12)
+        ])
+        chord_degree_tables[key] = current
+    return current[1]
+
+
+def scale_degree_table(key):
+    # the degrees of the notes of the scale type for each root,
+    # the intervals of a scale are between each note and the next one
+    # the intervals are lists, so they are compared with a copy
+    intervals = scaleTypes.dic[key]
+    current = scale_degree_tables.get(key)
+    if current is None or current[0] != intervals:
+        intervals = list(intervals)
+        table = []
+        for root in range(12):
+            degrees = [root]
+            for each in intervals:
+                degrees.append(degrees[-1] + each)
+            table.append(tuple(degrees))
+        current = (intervals, table)
+        scale_degree_tables[key] = current
+    return current[1]
+
+
+def chord_degrees(root, chord_type, ind=0):
+    # the degrees of the notes of a chord type with the root degree,
+    # ind is the index of the voicing, returns None if the chord type
+    # is not found in chordTypes
+    keys = chordTypes.find_keys(chord_type, True)
+    if not keys:
+        return
+    offset = root % 12
+    base = root - offset
+    return [i + base for i in chord_degree_table(keys[0])[offset][ind]]
+
+
+def scale_degrees(root, mode):
+    # the degrees of the notes of a scale type with the root degree,
+    # returns None if the scale type is not found in scaleTypes
+    keys = scaleTypes.find_keys(mode, True)
+    if not keys:
+        return
+    offset = root % 12
+    base = root - offset
+    return [i + base for i in scale_degree_table(keys[0])[offset]]
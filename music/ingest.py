@@ -0,0 +1,236 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from .database import standard_reverse
+from .structures import note, chord, piece, tempo
+from .lazy_midi import lazy_midi
+from .backends import get_backend
+
+# a store is a directory with a manifest and one .npz file for each MIDI
+# file, the notes are stored as columns sorted by track and onset,
+# and the tempo changes and program changes are stored as tables, the
+# dtypes of the columns are given by name so that numpy is not imported
+# until a store is read or written
+store_version = 1
+manifest_name = 'manifest.json'
+midi_extensions = ('.mid', '.midi')
+note_columns = {
+    'track': 'uint16',
+    'channel': 'uint8',
+    'onset': 'int64',
+    'duration': 'int64',
+    'pitch': 'uint8',
+    'velocity': 'uint8'
+}
+tempo_columns = {
+    'tempo_track': 'uint16',
+    'tempo_onset': 'int64',
+    'tempo': 'uint32'
+}
+program_columns = {
+    'program_track': 'uint16',
+    'program_channel': 'uint8',
+    'program_onset': 'int64',
+    'program': 'uint8'
+}
+
+
+def read_columns(name):
+    # parse a MIDI file into the columns of the store, the duration of
+    # a note is the time to the first note off of the same pitch and
+    # channel after it, the same as midi_to_chord
+    numpy = get_backend('numpy')
+    current_midi = lazy_midi(name)
+    columns = {
+        i: []
+        for i in list(note_columns) + list(tempo_columns) +
+        list(program_columns)
+    }
+    track_names = []
+    for k in range(len(current_midi)):
+        current_track_name = None
+        pending_notes = {}
+        for current_time, status, data1, data2 in current_midi.events(k):
+            if status == 0xFF:
+                if data1 == 0x51:
+                    columns['tempo_track'].append(k)
+                    columns['tempo_onset'].append(current_time)
+                    columns['tempo'].append(int.from_bytes(data2, 'big'))
+                elif data1 == 0x03 and current_track_name is None:
+                    current_track_name = bytes(data2).decode('latin1')
+                continue
+            if status >= 0xF0:
+                continue
+            current_type = status & 0xF0
+            current_channel = status & 0x0F
+            if current_type == 0x90 and data2 != 0:
+                pending_notes.setdefault((current_channel, data1), []).append(
+                    len(columns['onset']))
+                columns['track'].append(k)
+                columns['channel'].append(current_channel)
+                columns['onset'].append(current_time)
+                columns['duration'].append(0)
+                columns['pitch'].append(data1)
+                columns['velocity'].append(data2)
+            elif current_type == 0x80 or current_type == 0x90:
+                for each in pending_notes.pop((current_channel, data1), []):
+                    current_duration = current_time - columns['onset'][each]
+                    columns['duration'][each] = current_duration
+            elif current_type == 0xC0:
+                columns['program_track'].append(k)
+                columns['program_channel'].append(current_channel)
+                columns['program_onset'].append(current_time)
+                columns['program'].append(data1)
+        track_names.append(current_track_name)
+    current_midi.close()
+    dtypes = dict(note_columns, **tempo_columns, **program_columns)
+    result = {i: numpy.array(j, dtype=dtypes[i]) for i, j in columns.items()}
+    result['ticks_per_beat'] = numpy.array(current_midi.ticks_per_beat)
+    return result, track_names
+
+
+def ingest_file(name, output_name):
+    # the task of each worker process, returns the manifest entry
+    numpy = get_backend('numpy')
+    try:
+        columns, track_names = read_columns(name)
+        numpy.savez(output_name, **columns)
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}'}
+    return {
+        'ticks_per_beat': int(columns['ticks_per_beat']),
+        'notes': len(columns['onset']),
+        'track_names': track_names
+    }
+
+
+def find_midi_files(directory):
+    result = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for each in sorted(files):
+            if os.path.splitext(each)[1].lower() in midi_extensions:
+                result.append(os.path.join(root, each))
+    return result
+
+
+def ingest(directory, output=None, jobs=None):
+    # parse all of the MIDI files in a directory in a process pool and
+    # write them to a store, returns the manifest of the store
+    if output is None:
+        output = os.path.join(directory, 'store')
+    os.makedirs(output, exist_ok=True)
+    files = find_midi_files(directory)
+    entries = []
+    for i, each in enumerate(files):
+        source = os.path.relpath(each, directory)
+        store_name = f'{i}_{os.path.splitext(os.path.basename(each))[0]}.npz'
+        entries.append({'source': source, 'store': store_name})
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(ingest_file, files, [
+            os.path.join(output, each['store']) for each in entries
+        ],
+                               chunksize=8)
+        for each, current_result in zip(entries, results):
+            each.update(current_result)
+            if 'error' in each:
+                del each['store']
+    manifest = {'version': store_version, 'files': entries}
+    with open(os.path.join(output, manifest_name), 'w',
+              encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return manifest
+
+
+def load_manifest(store):
+    with open(os.path.join(store, manifest_name), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest['version'] != store_version:
+        raise ValueError(
+            f'unsupported store version {manifest["version"]}, the current version is {store_version}'
+        )
+    return manifest
+
+
+def to_bars(ticks, interval_unit):
+    result = ticks / interval_unit
+    return int(result) if result.is_integer() else result
+
+
+def load_piece(store, entry):
+    # rebuild a piece from the columns of a MIDI file in the store,
+    # entry is a manifest entry or the source file name of the entry
+    numpy = get_backend('numpy')
+    if type(entry) == str:
+        entry = [
+            i for i in load_manifest(store)['files'] if i['source'] == entry
+        ][0]
+    with numpy.load(os.path.join(store, entry['store'])) as current_file:
+        data = {i: current_file[i] for i in current_file.files}
+    interval_unit = int(data['ticks_per_beat']) * 4
+    track_column = data['track']
+    onsets = data['onset']
+    program_tracks = data['program_track'].tolist()
+    programs = data['program'].tolist()
+    tracks = []
+    instruments_list = []
+    start_times = []
+    channels = []
+    track_names = []
+    track_inds = numpy.unique(track_column).tolist()
+    bounds = numpy.searchsorted(track_column,
+                                track_inds).tolist() + [len(onsets)]
+    for i, k in enumerate(track_inds):
+        start, end = bounds[i], bounds[i + 1]
+        current_onsets = onsets[start:end].tolist()
+        durations = data['duration'][start:end].tolist()
+        pitches = data['pitch'][start:end].tolist()
+        velocities = data['velocity'][start:end].tolist()
+        current_channels = data['channel'][start:end].tolist()
+        notes = [
+            note(standard_reverse[pitches[j] % 12], pitches[j] // 12 - 1,
+                 to_bars(durations[j], interval_unit), velocities[j],
+                 current_channels[j]) for j in range(len(pitches))
+        ]
+        intervals = [
+            to_bars(current_onsets[j + 1] - current_onsets[j], interval_unit)
+            for j in range(len(current_onsets) - 1)
+        ]
+        intervals.append(notes[-1].duration)
+        tracks.append(chord(notes, interval=intervals))
+        start_times.append(to_bars(current_onsets[0], interval_unit))
+        channels.append(current_channels[0])
+        current_programs = [
+            programs[j] for j in range(len(programs))
+            if program_tracks[j] == k
+        ]
+        instruments_list.append(current_programs[0] +
+                                1 if current_programs else 1)
+        track_names.append(entry['track_names'][k])
+    tempo_onsets = data['tempo_onset'].tolist()
+    tempos = [60000000 / i for i in data['tempo'].tolist()]
+    bpm = 120
+    if tempos:
+        first_onset = min(tempo_onsets)
+        bpm = [
+            tempos[j] for j in range(len(tempos))
+            if tempo_onsets[j] == first_onset
+        ][-1]
+        if tracks:
+            for j in range(len(tempos)):
+                tracks[0].notes.append(
+                    tempo(tempos[j], tempo_onsets[j] / interval_unit + 1))
+                tracks[0].interval.append(0)
+    if not all(track_names):
+        track_names = None
+    return piece(tracks, instruments_list, bpm, start_times, track_names,
+                 channels,
+                 os.path.splitext(os.path.basename(entry['source']))[0])
+
+
+def load_store(store):
+    # load all of the successfully ingested pieces of a store
+    for each in load_manifest(store)['files']:
+        if 'error' not in each:
+            yield load_piece(store, each)
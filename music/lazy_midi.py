@@ -0,0 +1,220 @@
+import mmap
+import struct
+from io import BytesIO
+
+from .backends import get_backend
+
+# number of data bytes that follow each channel message status,
+# and each system common message status
+channel_data_length = {
+    0x80: 2,
+    0x90: 2,
+    0xA0: 2,
+    0xB0: 2,
+    0xC0: 1,
+    0xD0: 1,
+    0xE0: 2
+}
+system_data_length = {0xF1: 1, 0xF2: 2, 0xF3: 1}
+
+
+class track_info:
+    # the result of scanning the raw bytes of a track chunk,
+    # without decoding any messages
+    def __init__(self):
+        self.has_note_on = False
+        self.note_on_channels = set()
+        self.has_tempo = False
+        self.first_tempo_time = None
+
+    def __repr__(self):
+        return f'[track info] note_on: {self.has_note_on}, tempo: {self.has_tempo}'
+
+
+class lazy_tracks:
+    # a sequence of the tracks of a lazy_midi object,
+    # each track is only decoded the first time it is accessed
+    def __init__(self, current_midi):
+        self.current_midi = current_midi
+        self.decoded = {}
+
+    def __len__(self):
+        return len(self.current_midi.chunks)
+
+    def __getitem__(self, ind):
+        if type(ind) == slice:
+            return [self[i] for i in range(*ind.indices(len(self)))]
+        if ind < 0:
+            ind += len(self)
+        if ind not in self.decoded:
+            self.decoded[ind] = self.current_midi.decode(ind)
+        return self.decoded[ind]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class lazy_midi:
+    # index the track chunks of a MIDI file by their offsets and lengths
+    # with a single pass over the chunk headers, and only decode the tracks
+    # that are actually used, so that reading one track of a large MIDI file
+    # costs roughly the size of that track instead of the whole file
+    def __init__(self, name=None, file=None):
+        if file is not None:
+            file.seek(0)
+            self.data = file.read()
+            self.filename = getattr(file, 'name', None)
+        else:
+            with open(name, 'rb') as f:
+                try:
+                    self.data = mmap.mmap(f.fileno(),
+                                          0,
+                                          access=mmap.ACCESS_READ)
+                except ValueError:
+                    raise IOError(f'{name} is an empty file')
+            self.filename = name
+        self.read_header()
+        self.tracks = lazy_tracks(self)
+        self.infos = {}
+
+    def read_header(self):
+        data = self.data
+        if len(data) < 14 or data[:4] != b'MThd':
+            raise IOError('MThd not found. Probably not a MIDI file')
+        header_size = struct.unpack('>I', data[4:8])[0]
+        self.type, track_num, self.ticks_per_beat = struct.unpack(
+            '>hhh', data[8:14])
+        # chunks stores the (offset, length) of the data of each track chunk
+        self.chunks = []
+        file_length = len(data)
+        offset = 8 + header_size
+        while offset + 8 <= file_length and len(self.chunks) < track_num:
+            chunk_name, chunk_size = struct.unpack('>4sI',
+                                                   data[offset:offset + 8])
+            if chunk_name == b'MTrk':
+                self.chunks.append(
+                    (offset + 8, min(chunk_size, file_length - offset - 8)))
+            offset += 8 + chunk_size
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def __repr__(self):
+        return f'[lazy midi] {self.filename}, {len(self)} tracks'
+
+    def close(self):
+        if type(self.data) == mmap.mmap:
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def track_bytes(self, ind):
+        offset, length = self.chunks[ind]
+        return memoryview(self.data)[offset:offset + length]
+
+    def decode(self, ind):
+        # decode one track into mido messages
+        offset, length = self.chunks[ind]
+        read_track = get_backend('mido').midifiles.midifiles.read_track
+        return read_track(BytesIO(self.data[offset - 8:offset + length]))
+
+    def info(self, ind):
+        if ind not in self.infos:
+            self.infos[ind] = self.scan(ind)
+        return self.infos[ind]
+
+    def has_note_on(self, ind):
+        return self.info(ind).has_note_on
+
+    def has_tempo(self, ind):
+        return self.info(ind).has_tempo
+
+    def first_tempo_time(self, ind):
+        return self.info(ind).first_tempo_time
+
+    def note_on_channels(self, ind):
+        return self.info(ind).note_on_channels
+
+    def events(self, ind):
+        # walk the events of a track chunk following the delta times and
+        # running status without building any message objects, yields
+        # (time in ticks, status, data1, data2) of each channel message,
+        # (time in ticks, 0xFF, meta type, data) of each meta message,
+        # and (time in ticks, status, None, data) of each sysex message
+        offset, length = self.chunks[ind]
+        data = self.data
+        end = offset + length
+        position = offset
+        current_time = 0
+        last_status = None
+        try:
+            while position < end:
+                delta, position = read_variable_int(data, position)
+                current_time += delta
+                if position >= end:
+                    return
+                status = data[position]
+                if status < 0x80:
+                    if last_status is None:
+                        return
+                    status = last_status
+                else:
+                    position += 1
+                    if status != 0xFF:
+                        last_status = status
+                if status == 0xFF:
+                    meta_type = data[position]
+                    size, position = read_variable_int(data, position + 1)
+                    yield current_time, status, meta_type, data[
+                        position:position + size]
+                    if meta_type == 0x2F:
+                        return
+                    position += size
+                elif status in (0xF0, 0xF7):
+                    size, position = read_variable_int(data, position)
+                    yield current_time, status, None, data[position:position +
+                                                           size]
+                    position += size
+                elif status >= 0xF0:
+                    position += system_data_length.get(status, 0)
+                    yield current_time, status, None, None
+                else:
+                    if channel_data_length[status & 0xF0] == 2:
+                        yield current_time, status, data[position], data[
+                            position + 1]
+                        position += 2
+                    else:
+                        yield current_time, status, data[position], None
+                        position += 1
+        except IndexError:
+            # the track chunk is truncated
+            return
+
+    def scan(self, ind):
+        # find out if a track has note on messages and tempo changes
+        # by only looking at the status bytes and meta types
+        current_info = track_info()
+        for current_time, status, data1, data2 in self.events(ind):
+            if status == 0xFF:
+                if data1 == 0x51 and not current_info.has_tempo:
+                    current_info.has_tempo = True
+                    current_info.first_tempo_time = current_time
+            elif status & 0xF0 == 0x90 and status < 0xF0:
+                current_info.has_note_on = True
+                current_info.note_on_channels.add(status & 0x0F)
+        return current_info
+
+
+def read_variable_int(data, position):
+    result = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result = (result << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return result, position
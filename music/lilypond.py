@@ -0,0 +1,384 @@
+import os
+import sys
+import shlex
+import shutil
+import hashlib
+import threading
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# write the LilyPond source of a piece directly as text, the notes of each
+# track are the strings of gen_abjad_str, which are split into voices on
+# the zero intervals, and the score has the same structure as the abjad
+# score made by gen_abjad_score, so that abjad is not needed to make the
+# score, only to check the results against the abjad version
+
+lilypond_version = '2.22.1'
+indent = '    '
+# the renderer command, which could be any program taking the arguments
+# of LilyPond, such as a stand-in script for testing, the command is split
+# as a shell command, so it could include its own arguments
+lilypond_command = os.environ.get('MUSICODE_LILYPOND', 'lilypond')
+default_cache_directory = os.environ.get(
+    'MUSICODE_RENDER_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'musicode', 'scores'))
+default_cache_size = 256 * 2**20
+# the temporary directories of the renders in the cache directory which
+# are older than this many seconds are left by renders which were killed
+stale_render_age = 3600
+
+
+def escape_string(text):
+    return text.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def instrument_name(instrument):
+    return 'Piano' if 'Piano' in instrument else instrument
+
+
+def ly_lines(p, voice_strs, instrument_names=True):
+    # the lines of the LilyPond source of a piece, voice_strs is the list
+    # of the strings of the voices of each track
+    num = len(voice_strs)
+    yield f'\\version "{lilypond_version}"'
+    yield '\\language "english"'
+    yield ''
+    yield '\\score'
+    yield '{'
+    yield indent + '\\context Score = "Score"'
+    yield indent + '<<'
+    yield indent * 2 + '\\context StaffGroup = "staff_all"'
+    yield indent * 2 + '<<'
+    for i, strs in enumerate(voice_strs):
+        yield indent * 3 + f'\\context Staff = "staff_{i}"'
+        if instrument_names:
+            current_name = escape_string(
+                instrument_name(p.instruments_list[i]))
+            yield indent * 3 + f'\\with {{ instrumentName = \\markup {{ "{current_name}" }} }}'
+        yield indent * 3 + '<<'
+        for current_str in strs:
+            yield indent * 4 + '\\new Voice'
+            yield indent * 4 + '{'
+            current_str = current_str.strip()
+            if current_str:
+                if i != 0 and i == num - 1:
+                    yield indent * 5 + '\\clef "bass"'
+                yield indent * 5 + current_str
+            yield indent * 4 + '}'
+        yield indent * 3 + '>>'
+    yield indent * 2 + '>>'
+    yield indent + '>>'
+    yield '}'
+
+
+def gen_ly(p, voice_strs, instrument_names=True):
+    return '\n'.join(ly_lines(p, voice_strs, instrument_names)) + '\n'
+
+
+def write_ly(p, voice_strs, file, instrument_names=True):
+    # write the LilyPond source of a piece to a file name or a text stream
+    if hasattr(file, 'write'):
+        for each in ly_lines(p, voice_strs, instrument_names):
+            file.write(each + '\n')
+    else:
+        with open(file, 'w', encoding='utf-8') as f:
+            write_ly(p, voice_strs, f, instrument_names)
+
+
+def output_base(name):
+    # the output name of LilyPond without the .pdf or .png suffix
+    base, ext = os.path.splitext(name)
+    return base if ext.lower() in ('.pdf', '.png') else name
+
+
+def output_format(name):
+    return 'png' if name.lower().endswith('.png') else 'pdf'
+
+
+def run_lilypond(ly_name, base, current_format='pdf', command=None,
+                 timeout=None):
+    # run LilyPond on a source file, the outputs are base.pdf or base.png,
+    # or base-page1.png, base-page2.png, ... for the pages of a PNG score,
+    # timeout is the longest time in seconds to wait for LilyPond
+    if command is None:
+        command = lilypond_command
+    args = shlex.split(command)
+    if current_format == 'png':
+        args.append('--png')
+    args += ['-o', base, ly_name]
+    try:
+        result = subprocess.run(args,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f'{command} timed out after {timeout} seconds')
+    if result.returncode != 0:
+        raise RuntimeError(
+            f'{command} failed with exit code {result.returncode}: {result.stdout.decode(errors="replace")}'
+        )
+
+
+renderer_versions = {}
+
+
+def renderer_version(command=None):
+    # the first line printed by the renderer command with --version,
+    # which is part of the keys of the render cache
+    if command is None:
+        command = lilypond_command
+    if command not in renderer_versions:
+        try:
+            result = subprocess.run(shlex.split(command) + ['--version'],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            lines = result.stdout.decode(errors='replace').splitlines()
+            renderer_versions[command] = lines[0].strip() if lines else ''
+        except OSError:
+            renderer_versions[command] = ''
+    return renderer_versions[command]
+
+
+class render_cache:
+    # a cache of the rendered scores in a directory, the key of a score
+    # is the hash of its LilyPond source with the renderer command, the
+    # version of the renderer and the output format, each entry is a
+    # directory of the output files named by the key, and when the total
+    # size of the entries is more than max_size bytes, the least recently
+    # used entries are removed
+    def __init__(self, directory=None, max_size=None):
+        if directory is None:
+            directory = default_cache_directory
+        if max_size is None:
+            max_size = default_cache_size
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f'[render cache] {self.directory}, hits={self.hits}, misses={self.misses}'
+
+    def key(self, source, current_format='pdf', command=None):
+        if command is None:
+            command = lilypond_command
+        current_hash = hashlib.blake2b(digest_size=20)
+        for each in (command, renderer_version(command), current_format,
+                     source):
+            current_hash.update(each.encode('utf-8'))
+            current_hash.update(b'\0')
+        return current_hash.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key, base):
+        # copy the output files of a cached score to base, base-page1, ...
+        # returns the names of the copied files, or None if it is not found
+        current_entry = self.entry(key)
+        # the lock keeps the entry from being evicted while it is copied
+        with self.lock:
+            try:
+                names = sorted(os.listdir(current_entry))
+            except OSError:
+                self.misses += 1
+                return
+            result = []
+            for each in names:
+                current_name = base + each[len('score'):]
+                shutil.copyfile(os.path.join(current_entry, each),
+                                current_name)
+                result.append(current_name)
+            os.utime(current_entry)
+            self.hits += 1
+        return result
+
+    def put(self, key, directory):
+        # move the output files of a score rendered in a temporary
+        # directory into the cache, the files are named score.pdf,
+        # score-page1.png and so on
+        current_entry = self.entry(key)
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            os.replace(directory, current_entry)
+        except OSError:
+            # the same score is already cached by another render
+            shutil.rmtree(directory, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        # the (last used time, size, path) of the entries
+        result = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return result
+        for each in names:
+            current_entry = os.path.join(self.directory, each)
+            if each.startswith('.') or not os.path.isdir(current_entry):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(current_entry, i))
+                for i in os.listdir(current_entry))
+            result.append((os.path.getmtime(current_entry), size,
+                           current_entry))
+        return result
+
+    def remove_stale_renders(self):
+        # remove the temporary directories of the killed renders
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        now = time.time()
+        for each in names:
+            if not each.startswith('.render_'):
+                continue
+            current_directory = os.path.join(self.directory, each)
+            try:
+                if now - os.path.getmtime(
+                        current_directory) < stale_render_age:
+                    continue
+            except OSError:
+                continue
+            shutil.rmtree(current_directory, ignore_errors=True)
+
+    def evict(self):
+        with self.lock:
+            self.remove_stale_renders()
+            current_entries = self.entries()
+            total = sum(i[1] for i in current_entries)
+            current_entries.sort()
+            for last_used, size, current_entry in current_entries:
+                if total <= self.max_size:
+                    break
+                shutil.rmtree(current_entry, ignore_errors=True)
+                total -= size
+
+    def clear(self):
+        with self.lock:
+            for each in self.entries():
+                shutil.rmtree(each[2], ignore_errors=True)
+        self.hits = 0
+        self.misses = 0
+
+
+def render_source(source, name, cache=None, command=None, timeout=None):
+    # render a LilyPond source to name (a .pdf or .png file), the scores
+    # with the same source and renderer are copied from the cache without
+    # running the renderer, if cache is False, the cache is not used,
+    # returns the names of the output files
+    if cache is None:
+        cache = default_render_cache
+    current_format = output_format(name)
+    base = output_base(name)
+    if cache:
+        key = cache.key(source, current_format, command)
+        result = cache.get(key, base)
+        if result is not None:
+            return result
+        os.makedirs(cache.directory, exist_ok=True)
+        directory = tempfile.mkdtemp(prefix='.render_', dir=cache.directory)
+    else:
+        directory = tempfile.mkdtemp(prefix='musicode_')
+    try:
+        ly_name = os.path.join(directory, 'score.ly')
+        with open(ly_name, 'w', encoding='utf-8') as f:
+            f.write(source)
+        run_lilypond(ly_name, os.path.join(directory, 'score'),
+                     current_format, command, timeout)
+        os.remove(ly_name)
+        result = []
+        for each in sorted(os.listdir(directory)):
+            current_name = base + each[len('score'):]
+            shutil.copyfile(os.path.join(directory, each), current_name)
+            result.append(current_name)
+        if not result:
+            raise RuntimeError(f'no {current_format} file is rendered')
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    if cache:
+        cache.put(key, directory)
+    else:
+        shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+class render_pool:
+    # render LilyPond sources with up to jobs renderer processes at the
+    # same time, the results are collected in the order of submission as
+    # [output name, names of the rendered files, error], where the names
+    # are None if the score could not be rendered and the error is None
+    # if it is rendered
+    def __init__(self, jobs=None, timeout=None, command=None, cache=None):
+        self.jobs = jobs if jobs is not None else (os.cpu_count() or 1)
+        self.timeout = timeout
+        self.command = command
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+        self.pending = []
+
+    def __repr__(self):
+        return f'[render pool] {self.jobs} jobs, {len(self.pending)} pending'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, source, name):
+        # queue rendering a LilyPond source to name, returns the index of
+        # the score in the results
+        self.pending.append((name,
+                             self.executor.submit(render_source, source,
+                                                  name, self.cache,
+                                                  self.command,
+                                                  self.timeout)))
+        return len(self.pending) - 1
+
+    def submit_file(self, ly_name, name=None):
+        # queue rendering a LilyPond source file, the output is the PDF
+        # file with the same name by default
+        if name is None:
+            name = os.path.splitext(ly_name)[0] + '.pdf'
+        with open(ly_name, encoding='utf-8') as f:
+            return self.submit(f.read(), name)
+
+    def results(self):
+        # wait for all of the queued scores and return their results
+        result = []
+        for name, future in self.pending:
+            try:
+                result.append([name, future.result(), None])
+            except Exception as e:
+                result.append([name, None, e])
+        self.pending = []
+        return result
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def open_file(name):
+    if sys.platform == 'win32':
+        os.startfile(name)
+    elif sys.platform == 'darwin':
+        subprocess.Popen(['open', name])
+    else:
+        subprocess.Popen(['xdg-open', name])
+
+
+def show_ly(source, cache=None):
+    # render a LilyPond source in a temporary directory and open the PDF
+    directory = tempfile.mkdtemp(prefix='musicode_')
+    pdf_name = os.path.join(directory, 'score.pdf')
+    render_source(source, pdf_name, cache)
+    open_file(pdf_name)
+
+
+default_render_cache = render_cache()
@@ -7,6 +7,50 @@ class match:
             self.dic = keys
         else:
             self.dic = {totuple(keys[i]): values[i] for i in range(len(keys))}
+        self.build_index()
+
+    def build_index(self):
+        # index maps each alias to the keys of dic that have it in order,
+        # so that looking up an alias does not need to test every key,
+        # if a key is not a tuple (for example a string, where in tests
+        # for substrings), index is None and the keys are searched one by one
+        self.index = {}
+        for i in self.dic:
+            if not self.add_index(i):
+                self.index = None
+                break
+        self.index_size = len(self.dic)
+
+    def add_index(self, key):
+        if type(key) != tuple:
+            return False
+        for each in key:
+            current_keys = self.index.setdefault(each, [])
+            if not current_keys or current_keys[-1] is not key:
+                current_keys.append(key)
+        return True
+
+    def get_index(self):
+        # rebuild the index if dic is changed without update or delete
+        if len(self.dic) != self.index_size:
+            self.build_index()
+        return self.index
+
+    def find_keys(self, key, first=False):
+        index = self.get_index()
+        if index is not None:
+            try:
+                result = index.get(key, [])
+                return result[:1] if first else list(result)
+            except TypeError:
+                pass
+        result = []
+        for i in self.dic:
+            if key in i:
+                result.append(i)
+                if first:
+                    break
+        return result
 
     def __call__(self, *key, mode=0, index=None):
         # unlike __getitem__, this treat key as a whole to match(mode == 0)
@@ -28,22 +72,17 @@ class match:
             return result[index]
 
     def __getitem__(self, key):
-        dic = self.dic
-        for i in dic:
-            if key in i:
-                return dic[i]
+        result = self.find_keys(key, True)
+        if result:
+            return self.dic[result[0]]
         return 'not found'
 
     def __contains__(self, obj):
-        return any(obj in i for i in self.dic)
+        return bool(self.find_keys(obj, True))
 
     def search_all(self, key):
-        result = []
         dic = self.dic
-        for i in dic:
-            if key in i:
-                result.append(dic[i])
-        return result
+        return [dic[i] for i in self.find_keys(key)]
 
     def keys(self):
         return self.dic.keys()
@@ -72,21 +111,39 @@ class match:
         return str(self.dic)
 
     def update(self, key, value=None):
+        index = self.get_index()
         types = type(key)
+        if types == match:
+            key = key.dic
+            types = dict
         if types == dict:
+            new_keys = [i for i in key if i not in self.dic]
             self.dic.update(key)
-        elif types == match:
-            self.dic.update(key.dic)
         else:
             if types not in [list, tuple, set]:
                 key = (key, )
-            self.dic[tuple(key)] = value
+            key = tuple(key)
+            new_keys = [key] if key not in self.dic else []
+            self.dic[key] = value
+        if index is not None:
+            for i in new_keys:
+                if not self.add_index(i):
+                    self.index = None
+                    break
+        self.index_size = len(self.dic)
 
     def delete(self, key):
-        for i in self.dic:
-            if key in i:
-                del self.dic[i]
-                return
+        result = self.find_keys(key, True)
+        if result:
+            current_key = result[0]
+            del self.dic[current_key]
+            if self.index is not None:
+                for each in set(current_key):
+                    current_keys = self.index[each]
+                    current_keys.remove(current_key)
+                    if not current_keys:
+                        del self.index[each]
+            self.index_size = len(self.dic)
 
 
 def totuple(x):
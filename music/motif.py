@@ -0,0 +1,269 @@
+from .database import standard, standard_reverse
+from .structures import note, chord, copy
+from .backends import get_backend
+
+# find the motifs (the repeated segments) of a chord with a suffix array,
+# the notes are encoded as tokens of (the pitch interval to the next note,
+# duration, interval, volume, channel, name), so that the transposed
+# repeats of a segment have the same tokens, the name is only kept if it is
+# not the standard name of its pitch (such as Db instead of C#), the other
+# objects in the notes such as tempo changes and the notes with extra
+# attributes get tokens of their own, which are never repeated, for the
+# search, each token is split into the token of the attributes of the note
+# and the token of its pitch interval, so that n notes are 2n - 1 tokens
+# which do not include the pitch interval from the last note to the note
+# after it
+
+note_attributes = ('name', 'num', 'duration', 'volume', 'channel')
+
+
+def motif_tokens(current_chord):
+    # the tokens of the notes of the chord, the pitch interval of a note
+    # is None if the next one is not a note
+    notes = current_chord.notes
+    intervals = current_chord.interval
+    degrees = [
+        each.degree if type(each) == note and each.name in standard
+        and all(i in note_attributes for i in vars(each)) else None
+        for each in notes
+    ]
+    tokens = []
+    for i, each in enumerate(notes):
+        degree = degrees[i]
+        if degree is None:
+            tokens.append(('event', i))
+            continue
+        next_degree = degrees[i + 1] if i + 1 < len(notes) else None
+        name = each.name
+        tokens.append(
+            (None if next_degree is None else next_degree - degree,
+             each.duration, intervals[i], each.volume, each.channel,
+             None if standard_reverse[degree % 12] == name else name))
+    return tokens
+
+
+def search_tokens(tokens):
+    # the tokens of the attributes and the pitch intervals of the notes in
+    # turn, the tokens of the notes at i are at 2i and 2i + 1
+    result = []
+    for each in tokens:
+        if each[0] == 'event':
+            result += [each, None]
+        else:
+            result += [each[1:], each[0]]
+    return result
+
+
+def suffix_array(tokens):
+    # the suffix array of the tokens by prefix doubling, the suffixes are
+    # sorted by the ranks of their first k tokens, and then by the ranks
+    # of their first 2k tokens from the ranks of the two halves
+    numpy = get_backend('numpy')
+    n = len(tokens)
+    if n == 0:
+        return numpy.zeros(0, dtype=int)
+    # the tokens are ranked by their first appearance, any order of
+    # the tokens works for finding the repeats
+    token_ids = {}
+    ranks = numpy.array([token_ids.setdefault(i, len(token_ids))
+                         for i in tokens])
+    k = 1
+    while True:
+        second = numpy.full(n, -1)
+        second[:n - k] = ranks[k:]
+        sa = numpy.lexsort((second, ranks))
+        keys = numpy.stack([ranks[sa], second[sa]], axis=1)
+        changed = numpy.any(keys[1:] != keys[:-1], axis=1)
+        new_ranks = numpy.empty(n, dtype=int)
+        new_ranks[sa] = numpy.concatenate([[0], numpy.cumsum(changed)])
+        ranks = new_ranks
+        if ranks.max() == n - 1 or k >= n:
+            return sa
+        k *= 2
+
+
+def lcp_array(tokens, sa):
+    # the lengths of the longest common prefixes of each suffix in the
+    # suffix array and the one before it (Kasai's algorithm),
+    # lcp[0] is 0
+    n = len(tokens)
+    rank = [0] * n
+    for i in range(n):
+        rank[sa[i]] = i
+    lcp = [0] * n
+    h = 0
+    for i in range(n):
+        if rank[i] > 0:
+            j = sa[rank[i] - 1]
+            while i + h < n and j + h < n and tokens[i + h] == tokens[j + h]:
+                h += 1
+            lcp[rank[i]] = h
+            if h > 0:
+                h -= 1
+        else:
+            h = 0
+    return lcp
+
+
+def repeated_segments(tokens, min_length=2, min_count=2):
+    # the maximal repeated segments of the tokens as a list of
+    # [length, positions], a repeated segment is maximal if it can not be
+    # extended to the left or the right for all of its positions at the
+    # same time, the segments are found from the intervals of the lcp
+    # array with a stack, and each interval keeps the token before its
+    # positions if it is the same for all of them, or -1 if it is not
+    n = len(tokens)
+    if n == 0:
+        return []
+    sa = [int(i) for i in suffix_array(tokens)]
+    lcp = lcp_array(tokens, sa)
+    token_ids = {}
+    left = [
+        token_ids.setdefault(tokens[i - 1], len(token_ids)) if i > 0 else -1
+        for i in sa
+    ]
+    result = []
+    # each item is [lcp, left bound, left token], the left token is None
+    # before any position is added to the interval
+    stack = [[0, 0, None]]
+    for i in range(1, n + 1):
+        current_lcp = lcp[i] if i < n else 0
+        bound = i - 1
+        current_left = left[i - 1]
+        while current_lcp < stack[-1][0]:
+            interval = stack.pop()
+            interval[2] = merge_left(interval[2], current_left)
+            length, bound, current_left = interval
+            if length >= min_length and i - bound >= min_count and \
+                    current_left == -1:
+                result.append([length, sorted(sa[bound:i])])
+        if current_lcp > stack[-1][0]:
+            stack.append([current_lcp, bound, current_left])
+        else:
+            stack[-1][2] = merge_left(stack[-1][2], current_left)
+    return result
+
+
+def merge_left(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a if a == b else -1
+
+
+def find_motifs(current_chord, min_length=4, min_count=2):
+    # the maximal repeated segments of the notes of the chord as a list of
+    # [length, positions], the positions are the indexes of the first
+    # notes of the segments, the segments are sorted by the number of
+    # notes they cover without overlapping
+    result = []
+    for length, positions in repeated_segments(
+            search_tokens(motif_tokens(current_chord)), 2 * min_length - 1,
+            min_count):
+        # the repeats which start with a pitch interval start with the
+        # note after it, the positions of a repeat are all the attributes
+        # or all the pitch intervals, which are never the same tokens
+        if positions[0] % 2:
+            positions = [i + 1 for i in positions]
+            length -= 1
+        length = (length + 1) // 2
+        if length >= min_length:
+            result.append([length, [i // 2 for i in positions]])
+    result.sort(key=lambda s: (-s[0] * len(non_overlapping(*s)), s[1][0]))
+    return result
+
+
+def non_overlapping(length, positions):
+    result = []
+    last_end = 0
+    for each in positions:
+        if each >= last_end:
+            result.append(each)
+            last_end = each + length
+    return result
+
+
+class motif_encoding:
+    # a compressed representation of a chord, where the repeats of each
+    # motif are stored once as the tokens of the motif, and the chord is a
+    # sequence of [motif index, degree of the first note] for the repeats
+    # of the motifs and [None, note or other object, interval] for the
+    # others, the motifs are chosen greedily from the ones covering the
+    # most notes
+    def __init__(self, current_chord, min_length=4, min_count=2):
+        tokens = motif_tokens(current_chord)
+        notes = current_chord.notes
+        covered = [False] * len(notes)
+        starts = {}
+        self.motifs = []
+        for length, positions in find_motifs(current_chord, min_length,
+                                             min_count):
+            current_positions = [
+                i for i in non_overlapping(length, positions)
+                if not any(covered[i:i + length])
+            ]
+            if len(current_positions) < min_count:
+                continue
+            motif_ind = len(self.motifs)
+            self.motifs.append(tuple(tokens[positions[0]:positions[0] +
+                                            length]))
+            for i in current_positions:
+                covered[i:i + length] = [True] * length
+                starts[i] = motif_ind
+        self.sequence = []
+        i = 0
+        while i < len(notes):
+            if i in starts:
+                motif_ind = starts[i]
+                self.sequence.append([motif_ind, notes[i].degree])
+                i += len(self.motifs[motif_ind])
+            else:
+                self.sequence.append(
+                    [None, copy(notes[i]), current_chord.interval[i]])
+                i += 1
+        self.attributes = {
+            i: copy(j)
+            for i, j in vars(current_chord).items()
+            if i not in ('notes', 'interval')
+        }
+
+    def __repr__(self):
+        return f'[motif encoding] {len(self.motifs)} motifs, {len(self.sequence)} items, {len(self)} notes'
+
+    def __len__(self):
+        return sum(1 if i[0] is None else len(self.motifs[i[0]])
+                   for i in self.sequence)
+
+    def motif_notes(self, motif_ind, degree):
+        # the notes and intervals of a repeat of a motif
+        notes = []
+        intervals = []
+        for step, duration, interval, volume, channel, name in self.motifs[
+                motif_ind]:
+            if name is None:
+                name = standard_reverse[degree % 12]
+            notes.append(
+                note(name, (degree - standard[name]) // 12 - 1, duration,
+                     volume, channel))
+            intervals.append(interval)
+            if step is not None:
+                degree += step
+        return notes, intervals
+
+    def decode(self):
+        notes = []
+        intervals = []
+        for each in self.sequence:
+            if each[0] is None:
+                notes.append(copy(each[1]))
+                intervals.append(each[2])
+            else:
+                current_notes, current_intervals = self.motif_notes(*each)
+                notes.extend(current_notes)
+                intervals.extend(current_intervals)
+        result = chord.__new__(chord)
+        result.notes = notes
+        result.interval = intervals
+        result.__dict__.update(copy(self.attributes))
+        return result
@@ -0,0 +1,314 @@
+import json
+import mmap
+import struct
+from array import array
+from fractions import Fraction
+
+from . import structures
+from .structures import note, chord, piece
+
+# the binary format of chord and piece data files (.mpb):
+# magic (4 bytes) | version (uint16) | kind (uint16) | header size (uint32)
+# | header (utf-8 json) | padding to 8 bytes | packed column arrays
+# the header stores the attributes of the chord or piece and the offsets of
+# the columns of each track, the notes of each track are stored as columns
+# of pitch, num, name, duration, interval, volume and channel, the other
+# types of objects in the tracks such as tempo changes are in the header,
+# the durations and intervals which are fractions are also in the header as
+# numerators and denominators so that they are read back as fractions
+magic = b'MPB\x00'
+version = 2
+kinds = {'chord': 0, 'piece': 1}
+prefix = struct.Struct('<4sHHI')
+column_types = {
+    'pitch': 'h',
+    'num': 'h',
+    'name': 'H',
+    'duration': 'd',
+    'interval': 'd',
+    'volume': 'h',
+    'channel': 'h'
+}
+note_attributes = ('name', 'num', 'duration', 'volume', 'channel')
+
+
+def encode_value(value):
+    # convert a value to json compatible data, the objects of the classes
+    # in structures are stored with their class names and attributes
+    types = type(value)
+    if value is None or types in (bool, int, float, str):
+        return value
+    if types == Fraction:
+        return {'fraction': [value.numerator, value.denominator]}
+    if types == list:
+        return [encode_value(i) for i in value]
+    if types == tuple:
+        return {'tuple': [encode_value(i) for i in value]}
+    if types == dict:
+        return {'dict': [[encode_value(i), encode_value(j)]
+                         for i, j in value.items()]}
+    if types in (bytes, bytearray):
+        return {'bytes': value.hex()}
+    if getattr(structures, types.__name__, None) is types:
+        return {
+            'type': types.__name__,
+            'attributes':
+            {i: encode_value(j)
+             for i, j in vars(value).items()}
+        }
+    raise ValueError(f'cannot write the data of type {types.__name__}')
+
+
+def decode_value(value):
+    if type(value) == list:
+        return [decode_value(i) for i in value]
+    if type(value) != dict:
+        return value
+    if 'tuple' in value:
+        return tuple(decode_value(i) for i in value['tuple'])
+    if 'dict' in value:
+        return {decode_value(i): decode_value(j) for i, j in value['dict']}
+    if 'bytes' in value:
+        return bytes.fromhex(value['bytes'])
+    if 'fraction' in value:
+        return Fraction(*value['fraction'])
+    types = getattr(structures, value['type'])
+    result = types.__new__(types)
+    result.__dict__.update(
+        {i: decode_value(j)
+         for i, j in value['attributes'].items()})
+    return result
+
+
+def to_number(value):
+    return int(value) if value.is_integer() else value
+
+
+class track_writer:
+    # split a chord into the note columns and the header data of the track
+    def __init__(self, current_chord):
+        notes = current_chord.notes
+        intervals = current_chord.interval
+        names = []
+        names_inds = {}
+        self.columns = {i: [] for i in column_types}
+        self.events = []
+        self.note_extras = []
+        columns = self.columns
+        for i in range(len(notes)):
+            each = notes[i]
+            if type(each) != note:
+                self.events.append(
+                    [i, encode_value(each),
+                     encode_value(intervals[i])])
+                continue
+            if each.name not in names_inds:
+                names_inds[each.name] = len(names)
+                names.append(each.name)
+            columns['pitch'].append(each.degree if each.name in
+                                    structures.standard else 0)
+            columns['num'].append(each.num)
+            columns['name'].append(names_inds[each.name])
+            columns['duration'].append(each.duration)
+            columns['interval'].append(intervals[i])
+            columns['volume'].append(each.volume)
+            columns['channel'].append(-1 if each.channel is None else each.
+                                      channel)
+            extras = {
+                j: encode_value(k)
+                for j, k in vars(each).items() if j not in note_attributes
+            }
+            if extras:
+                self.note_extras.append([len(columns['num']) - 1, extras])
+        self.fractions = {
+            i: [[j, k.numerator, k.denominator]
+                for j, k in enumerate(columns[i]) if type(k) == Fraction]
+            for i in ('duration', 'interval')
+        }
+        self.header = {
+            'length': len(notes),
+            'names': names,
+            'fractions': self.fractions,
+            'events': self.events,
+            'note_extras': self.note_extras,
+            'attributes': {
+                i: encode_value(j)
+                for i, j in vars(current_chord).items()
+                if i not in ('notes', 'interval')
+            }
+        }
+
+    def pack(self):
+        result = {}
+        for i, j in self.columns.items():
+            typecode = column_types[i]
+            if typecode == 'h' and any(type(k) != int for k in j):
+                typecode = 'd'
+            result[i] = array(typecode, j)
+        return result
+
+
+def write_mpb(obj, name):
+    if type(obj) == chord:
+        kind = kinds['chord']
+        tracks = [obj]
+        attributes = {}
+    elif type(obj) == piece:
+        kind = kinds['piece']
+        tracks = obj.tracks
+        attributes = {
+            i: encode_value(j)
+            for i, j in vars(obj).items() if i != 'tracks'
+        }
+    else:
+        raise ValueError('only chord and piece can be written as binary data')
+    writers = [track_writer(each) for each in tracks]
+    packed = [each.pack() for each in writers]
+    offset = 0
+    for each, current_packed in zip(writers, packed):
+        each.header['columns'] = {}
+        for i, j in current_packed.items():
+            each.header['columns'][i] = [j.typecode, offset, len(j)]
+            offset += len(j) * j.itemsize
+            offset += -offset % 8
+    header = json.dumps({
+        'attributes': attributes,
+        'tracks': [each.header for each in writers]
+    }).encode('utf-8')
+    with open(name, 'wb') as f:
+        f.write(prefix.pack(magic, version, kind, len(header)))
+        f.write(header)
+        f.write(bytes(-(prefix.size + len(header)) % 8))
+        for current_packed in packed:
+            for each in current_packed.values():
+                current_bytes = each.tobytes()
+                f.write(current_bytes)
+                f.write(bytes(-len(current_bytes) % 8))
+
+
+def is_mpb(name):
+    with open(name, 'rb') as f:
+        return f.read(4) == magic
+
+
+class mpb_file:
+    # memory map a binary data file, the columns of the tracks are
+    # memoryviews of the file and each track can be read on its own,
+    # the memoryviews are released when the file is closed, so they must
+    # be copied (such as with tolist) to be used after that
+    def __init__(self, name):
+        with open(name, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        current_magic, self.version, self.kind, header_size = prefix.unpack_from(
+            self.data)
+        if current_magic != magic:
+            raise ValueError(f'{name} is not a binary data file')
+        if self.version > version:
+            raise ValueError(
+                f'the version of {name} is {self.version}, which is newer than the supported version {version}'
+            )
+        header_end = prefix.size + header_size
+        self.header = json.loads(
+            bytes(self.data[prefix.size:header_end]).decode('utf-8'))
+        self.data_start = header_end + (-header_end % 8)
+        self.view = memoryview(self.data)
+        # the memoryviews of the columns, which are released on closing
+        self.views = []
+
+    def __len__(self):
+        return len(self.header['tracks'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for each in self.views:
+            each.release()
+        self.views = []
+        self.view.release()
+        self.data.close()
+
+    def column_views(self, ind):
+        # the (name, memoryview of the column, memoryview it is cast from)
+        # of the columns of a track
+        result = []
+        for i, (typecode, offset, length) in self.header['tracks'][
+                ind - 1]['columns'].items():
+            start = self.data_start + offset
+            current_view = self.view[start:start +
+                                     length * struct.calcsize(typecode)]
+            result.append((i, current_view.cast(typecode), current_view))
+        return result
+
+    def columns(self, ind):
+        # the columns of a track as memoryviews without copying,
+        # the tracks are counted from 1 as the tracks of piece
+        result = {}
+        for i, current_column, current_view in self.column_views(ind):
+            result[i] = current_column
+            # the cast view is released before the view it is cast from
+            self.views += [current_column, current_view]
+        return result
+
+    def track(self, ind):
+        current_header = self.header['tracks'][ind - 1]
+        columns = {}
+        for i, current_column, current_view in self.column_views(ind):
+            columns[i] = current_column.tolist()
+            current_column.release()
+            current_view.release()
+        names = current_header['names']
+        durations = [to_number(i) for i in columns['duration']]
+        intervals = [to_number(i) for i in columns['interval']]
+        # the files of version 1 have no fractions
+        fractions = current_header.get('fractions', {})
+        for values, column in ((durations, 'duration'), (intervals,
+                                                         'interval')):
+            for i, numerator, denominator in fractions.get(column, []):
+                values[i] = Fraction(numerator, denominator)
+        notes = [
+            note(names[name], num, duration, volume,
+                 None if channel == -1 else channel)
+            for name, num, duration, volume, channel in zip(
+                columns['name'], columns['num'], durations,
+                columns['volume'], columns['channel'])
+        ]
+        for i, extras in current_header['note_extras']:
+            notes[i].__dict__.update(
+                {j: decode_value(k)
+                 for j, k in extras.items()})
+        for i, each, current_interval in current_header['events']:
+            notes.insert(i, decode_value(each))
+            intervals.insert(i, decode_value(current_interval))
+        result = chord.__new__(chord)
+        result.notes = notes
+        result.interval = intervals
+        result.__dict__.update({
+            i: decode_value(j)
+            for i, j in current_header['attributes'].items()
+        })
+        return result
+
+    def load(self):
+        tracks = [self.track(i) for i in range(1, len(self) + 1)]
+        if self.kind == kinds['chord']:
+            return tracks[0]
+        result = piece.__new__(piece)
+        result.__dict__.update({
+            i: decode_value(j)
+            for i, j in self.header['attributes'].items()
+        })
+        result.tracks = tracks
+        return result
+
+
+def read_mpb(name, track=None):
+    # read a binary data file, if track is not None, only read that track,
+    # the tracks are counted from 1
+    with mpb_file(name) as current_file:
+        if track is None:
+            return current_file.load()
+        return current_file.track(track)
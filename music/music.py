@@ -4,26 +4,28 @@ import math
 import random
 import struct
 import chunk
+import threading
 from io import BytesIO
+from collections import OrderedDict
 from difflib import SequenceMatcher
-from midiutil.MidiFile import *
-import mido
-from mido.midifiles.midifiles import MidiFile as midi
-from mido import Message
-import mido.midifiles.units as unit
-from mido.midifiles.tracks import merge_tracks as merge
-from mido.midifiles.tracks import MidiTrack
-from mido.midifiles.meta import MetaMessage
+from .lazy_midi import lazy_midi
+from .mpb import write_mpb, read_mpb, is_mpb
+from .chord_index import chord_mask, chord_masks, chord_templates
+from .degree_tables import chord_degrees, scale_degrees
+from .analysis import pitch_class_histograms, detect_keys, detect_window_chords, harmonic_timeline
+from .voicing import voice_progression
+from .motif import motif_tokens, search_tokens, repeated_segments, find_motifs, motif_encoding
+from .similarity import melody_tokens, build_similarity_index, similarity_index, query_similarity_index
+from .lilypond import gen_ly, write_ly, render_source, render_cache, default_render_cache, render_pool, show_ly, output_base
+from .musicxml import write_musicxml
+from .backends import register_backend, get_backend, backend_loaded
 from .database import *
 from .structures import *
 
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
-import pygame
-
-pygame.mixer.init(44100, -16, 2, 1024)
 '''
 mido and midiutil is requried for this module, please make sure you have
-these two modules with this file
+these two modules with this file, they are imported when they are first
+used, the same as pygame (for playing audio), see backends.py
 '''
 
 
@@ -152,40 +154,38 @@ def getchord(start,
     mode = mode.lower().replace(' ', '')
     initial = start.degree
     chordlist = [start]
-    interval_premode = chordTypes(premode, mode=1, index=ind)
-    if interval_premode != 'not found':
-        interval = interval_premode
+    degrees = chord_degrees(initial, premode, ind)
+    if degrees is None:
+        degrees = chord_degrees(initial, mode, ind)
+    if degrees is not None:
+        chordlist += [degree_to_note(i) for i in degrees[1:]]
     else:
-        interval_mode = chordTypes(mode, mode=1, index=ind)
-        if interval_mode != 'not found':
-            interval = interval_mode
+        if mode[:3] == 'add':
+            try:
+                addnum = int(mode[3:])
+                interval = [
+                    major_third, perfect_fifth,
+                    scale(start,
+                          'major').notes[:-1][(addnum % 7) - 1].degree -
+                    start.degree + octave * (addnum // 7)
+                ]
+            except:
+                return 'add(n) chord: n should be an integer'
+        elif mode[:4] == 'madd':
+            try:
+                addnum = int(mode[4:])
+                interval = [
+                    minor_third, perfect_fifth,
+                    scale(start,
+                          'minor').notes[:-1][(addnum % 7) - 1].degree -
+                    start.degree + octave * (addnum // 7)
+                ]
+            except:
+                return 'add(n) chord: n should be an integer'
         else:
-            if mode[:3] == 'add':
-                try:
-                    addnum = int(mode[3:])
-                    interval = [
-                        major_third, perfect_fifth,
-                        scale(start,
-                              'major').notes[:-1][(addnum % 7) - 1].degree -
-                        start.degree + octave * (addnum // 7)
-                    ]
-                except:
-                    return 'add(n) chord: n should be an integer'
-            elif mode[:4] == 'madd':
-                try:
-                    addnum = int(mode[4:])
-                    interval = [
-                        minor_third, perfect_fifth,
-                        scale(start,
-                              'minor').notes[:-1][(addnum % 7) - 1].degree -
-                        start.degree + octave * (addnum // 7)
-                    ]
-                except:
-                    return 'add(n) chord: n should be an integer'
-            else:
-                return 'could not detect the chord types'
-    for i in range(len(interval)):
-        chordlist.append(degree_to_note(initial + interval[i]))
+            return 'could not detect the chord types'
+        for i in range(len(interval)):
+            chordlist.append(degree_to_note(initial + interval[i]))
     if addition is not None:
         chordlist.append(degree_to_note(initial + addition))
     if b != None:
@@ -237,6 +237,75 @@ def multi_voice(*current_chord, method=chord, start_times=None):
     return result
 
 
+def chord_progression(chords,
+                      durations=1 / 4,
+                      intervals=0,
+                      volumes=None,
+                      chords_interval=None,
+                      merge=True,
+                      voice_leading=False,
+                      voice_range=('C3', 'C6'),
+                      keep_root=True,
+                      beam=32,
+                      to_piece=False,
+                      bpm=120,
+                      instrument=1):
+    # make a chord progression from a list of chords or chord names,
+    # durations, intervals, volumes and chords_interval (the rests between
+    # the chords) could be a value for all of the chords or a list,
+    # if voice_leading is True, the chords are voiced with the least total
+    # voice movement in the range of voice_range, if merge is False,
+    # returns the list of the chords, if to_piece is True, returns a piece
+    # with the chord progression as its only track
+    chords = [trans(i) if type(i) == str else i for i in chords]
+    length = len(chords)
+    if type(durations) != list:
+        durations = [durations for i in range(length)]
+    if type(intervals) != list:
+        intervals = [intervals for i in range(length)]
+    if volumes is not None and type(volumes) != list:
+        volumes = [volumes for i in range(length)]
+    if chords_interval is not None and type(chords_interval) != list:
+        chords_interval = [chords_interval for i in range(length)]
+    chords = [
+        chords[i].set(durations[i], intervals[i],
+                      volumes[i] if volumes is not None else None)
+        for i in range(length)
+    ]
+    if voice_leading:
+        chords = voice_progression(chords,
+                                   *voice_range,
+                                   keep_root=keep_root,
+                                   beam=beam)
+    if not merge:
+        return chords
+    # the same as adding each chord after the previous one with |,
+    # but the notes are collected at once instead of copying the result
+    # of each step, which is quadratic for long progressions
+    notes = []
+    new_intervals = []
+    for i in range(length):
+        current_chord = chords[i]
+        if i > 0:
+            current_rest = current_chord.start_time
+            if chords_interval is not None:
+                current_rest += chords_interval[i - 1]
+            if new_intervals[-1] == 0:
+                new_intervals[-1] = notes[-1].duration
+            new_intervals[-1] += current_rest
+        notes.extend(copy(current_chord.notes))
+        new_intervals.extend(current_chord.interval)
+    result = chord(notes,
+                   interval=new_intervals,
+                   start_time=chords[0].start_time)
+    if to_piece:
+        return piece(tracks=[result],
+                     instruments_list=[instrument],
+                     bpm=bpm,
+                     start_times=[0])
+    return result
+
+
 def play(current_chord,
          bpm=80,
          track_ind=0,
@@ -273,6 +342,7 @@ def play(current_chord,
                  eventtime_is_ticks=eventtime_is_ticks,
                  msg=msg,
                  nomsg=nomsg)
+    pygame = get_backend('pygame')
     if save_as_file:
         result_file = name
         pygame.mixer.music.load(result_file)
@@ -284,8 +354,8 @@ def play(current_chord,
 
 
 def get_tracks(name):
-    current_midi = midi(name)
-    return current_midi.tracks
+    with lazy_midi(name) as current_midi:
+        return list(current_midi.tracks)
 
 
 def read(name,
@@ -306,25 +376,44 @@ def read(name,
     if is_file:
         name.seek(0)
         try:
-            current_midi = midi(file=name)
+            current_midi = lazy_midi(file=name)
             name.close()
         except Exception as OSError:
             name.seek(0)
-            current_midi = midi(file=riff_to_midi(name))
+            current_midi = lazy_midi(file=riff_to_midi(name))
             name.close()
             split_channels = True
         name = name.name
 
     else:
         try:
-            current_midi = midi(name)
+            current_midi = lazy_midi(name)
         except Exception as OSError:
-            current_midi = midi(file=riff_to_midi(name))
+            current_midi = lazy_midi(file=riff_to_midi(name))
             split_channels = True
+    # the MIDI file is closed once the tracks are decoded
+    with current_midi:
+        return read_lazy_midi(current_midi, name, trackind, mode, is_file,
+                              merge, get_off_drums, to_piece, split_channels,
+                              clear_empty_notes, clear_other_channel_msg,
+                              add_pan_volume)
+
+
+def read_lazy_midi(current_midi, name, trackind, mode, is_file, merge,
+                   get_off_drums, to_piece, split_channels, clear_empty_notes,
+                   clear_other_channel_msg, add_pan_volume):
+    # the part of read after the MIDI file is opened
+    # the tracks are only decoded when they are accessed, the checks for
+    # note on messages and tempo changes are done on the raw track chunks
     whole_tracks = current_midi.tracks
+    tracks_num = len(whole_tracks)
+    note_tracks_inds = [
+        i for i in range(tracks_num) if current_midi.has_note_on(i)
+    ]
     current_track = None
     changes_track = [
-        each for each in whole_tracks if all(i.type != 'note_on' for i in each)
+        whole_tracks[i] for i in range(tracks_num)
+        if i not in note_tracks_inds
     ]
     found_bpm = False
     whole_bpm = 120
@@ -345,49 +434,19 @@ def read(name,
             ]
             whole_bpm = whole_bpm_list[-1].bpm
             found_bpm = True
-        if not found_bpm:
-            whole_tempo = []
-            whole_tempo_start_time = []
-            for each in whole_tracks:
-                current_tempo = [i for i in each if i.type == 'set_tempo']
-                if current_tempo:
-                    for k in range(len(each)):
-                        if each[k].type == 'set_tempo':
-                            current_start_time = sum(
-                                [each[j].time for j in range(k + 1)])
-                            break
-                    whole_tempo_start_time.append(current_start_time)
-                    whole_tempo.append(current_tempo)
-            if whole_tempo:
-                min_start_time = min(whole_tempo_start_time)
-                min_tempo_track = whole_tempo[whole_tempo_start_time.index(
-                    min_start_time)]
-                min_start_time = min_tempo_track[0].time
-                whole_bpm_list = []
-                for each in min_tempo_track:
-                    if each.time == min_start_time:
-                        whole_bpm_list.append(each)
-                    else:
-                        break
-                whole_bpm = unit.tempo2bpm(whole_bpm_list[-1].tempo)
     else:
         changes = []
-        whole_tempo = []
-        whole_tempo_start_time = []
-        for each in whole_tracks:
-            current_tempo = [i for i in each if i.type == 'set_tempo']
-            if current_tempo:
-                for k in range(len(each)):
-                    if each[k].type == 'set_tempo':
-                        current_start_time = sum(
-                            [each[j].time for j in range(k + 1)])
-                        break
-                whole_tempo_start_time.append(current_start_time)
-                whole_tempo.append(current_tempo)
-        if whole_tempo:
-            min_start_time = min(whole_tempo_start_time)
-            min_tempo_track = whole_tempo[whole_tempo_start_time.index(
-                min_start_time)]
+    if not found_bpm:
+        tempo_tracks_inds = [
+            i for i in range(tracks_num) if current_midi.has_tempo(i)
+        ]
+        if tempo_tracks_inds:
+            min_tempo_track_ind = min(tempo_tracks_inds,
+                                      key=current_midi.first_tempo_time)
+            min_tempo_track = [
+                i for i in whole_tracks[min_tempo_track_ind]
+                if i.type == 'set_tempo'
+            ]
             min_start_time = min_tempo_track[0].time
             whole_bpm_list = []
             for each in min_tempo_track:
@@ -395,33 +454,26 @@ def read(name,
                     whole_bpm_list.append(each)
                 else:
                     break
-            whole_bpm = unit.tempo2bpm(whole_bpm_list[-1].tempo)
+            whole_bpm = get_backend('mido').tempo2bpm(
+                whole_bpm_list[-1].tempo)
     if mode == 'find':
-        found = False
-        for each in whole_tracks:
-            if any(each_msg.type == 'note_on' for each_msg in each):
-                found = True
-                current_track = each
-                break
-        if not found:
+        if not note_tracks_inds:
             raise ValueError(
                 'No tracks found in the MIDI file, please check if the input MIDI file is empty'
             )
+        current_track = whole_tracks[note_tracks_inds[0]]
         result = midi_to_chord(current_midi, current_track, whole_bpm)
         if changes:
             result[1] += changes
         return result
     elif mode == 'all':
-        available_tracks = [
-            each for each in whole_tracks
-            if any(each_msg.type == 'note_on' for each_msg in each)
-        ]
         if get_off_drums:
             available_tracks = [
-                each for each in available_tracks
-                if not any(j.type == 'note_on' and j.channel == 9
-                           for j in each)
+                whole_tracks[i] for i in note_tracks_inds
+                if 9 not in current_midi.note_on_channels(i)
             ]
+        else:
+            available_tracks = [whole_tracks[i] for i in note_tracks_inds]
         all_tracks = [
             midi_to_chord(current_midi,
                           available_tracks[j],
@@ -561,8 +613,7 @@ def read(name,
                     volume_list)
                 if split_channels:
                     remain_available_tracks = [
-                        each for each in whole_tracks
-                        if any(j.type == 'note_on' for j in each)
+                        whole_tracks[i] for i in note_tracks_inds
                     ]
                     channels_numbers = concat(
                         [[i.channel for i in each if hasattr(i, 'channel')]
@@ -839,7 +890,8 @@ def midi_to_chord(current_midi,
                     current_append_note.track_num = track_ind
             notelist.append(current_append_note)
         elif current_msg.type == 'set_tempo':
-            current_tempo = tempo(unit.tempo2bpm(current_msg.tempo),
+            current_bpm = get_backend('mido').tempo2bpm(current_msg.tempo)
+            current_tempo = tempo(current_bpm,
                                   (current_time / interval_unit) + 1,
                                   track=track_ind)
             if add_track_num:
@@ -954,14 +1006,15 @@ def read_other_messages(message, other_messages, time, track_ind):
             clocks_per_tick=message.clocks_per_click,
             notes_per_quarter=message.notated_32nd_notes_per_beat)
     elif current_type == 'key_signature':
+        midiutil = get_backend('midiutil')
         current_key = message.key
         if current_key[-1] == 'm':
-            current_mode = MINOR
+            current_mode = midiutil.MINOR
             current_key = scale(current_key[:-1], 'minor')
         else:
-            current_mode = MAJOR
+            current_mode = midiutil.MAJOR
             current_key = scale(current_key, 'major')
-        current_accidental_type = SHARPS
+        current_accidental_type = midiutil.SHARPS
         current_accidentals = len(
             [i for i in current_key.names() if i[-1] == '#'])
         current_message = key_signature(
@@ -999,6 +1052,8 @@ def write(current_chord,
           nomsg=False):
     if i is not None:
         instrument = i
+    if type(current_chord) == motif_encoding:
+        current_chord = current_chord.decode()
     is_track_type = False
     if type(current_chord) == track:
         is_track_type = True
@@ -1023,6 +1078,7 @@ def write(current_chord,
             i if type(i) == int else instruments[i]
             for i in instruments_numbers
         ]
+        MIDIFile = get_backend('midiutil').MIDIFile
         MyMIDI = MIDIFile(track_number,
                           deinterleave=deinterleave,
                           ticks_per_quarternote=ticks_per_quarternote,
@@ -1127,6 +1183,7 @@ def write(current_chord,
             current_chord = chord([current_chord])
         content = concat(current_chord, '|') if isinstance(
             current_chord, list) else current_chord
+        MIDIFile = get_backend('midiutil').MIDIFile
         MyMIDI = MIDIFile(track_num,
                           deinterleave=deinterleave,
                           ticks_per_quarternote=ticks_per_quarternote,
@@ -1637,6 +1694,69 @@ def get_chord_notations(chords,
             ' ' * functions_interval).join(notations)
 
 
+class melody_window:
+    # the degrees and durations of the melody notes found so far, with a
+    # sliding window over the most recent notes, the window has the same
+    # notes as add_to_index(durations, length, len(durations) - 1, -1, -1),
+    # which are the recent notes back to the first one where the durations
+    # add up to at least length, and the note after it once more if they
+    # add up to exactly length, so the average degree is found in O(1)
+    def __init__(self, length):
+        self.length = length
+        self.degrees = []
+        self.durations = []
+        self.start = 0
+        self.degree_sum = 0
+        self.duration_sum = 0
+        # the running sums only give the same results as adding up the
+        # durations backwards if there are no rounding errors, which is
+        # the case if the durations are floats or integers with small
+        # enough denominators, otherwise use add_to_index
+        self.exact = type(length) in (int, float)
+        self.total = 0
+        self.denominator = 1
+
+    def __len__(self):
+        return len(self.degrees)
+
+    def append(self, degree, duration):
+        self.degrees.append(degree)
+        self.durations.append(duration)
+        if not self.exact:
+            return
+        if type(duration) not in (int, float) or not (0 <= duration <
+                                                            math.inf):
+            self.exact = False
+            return
+        self.denominator = max(self.denominator,
+                               duration.as_integer_ratio()[1])
+        self.total += duration
+        if self.total * self.denominator >= 2**50:
+            self.exact = False
+            return
+        self.degree_sum += degree
+        self.duration_sum += duration
+        last = len(self.durations) - 1
+        while self.start < last and self.duration_sum - self.durations[
+                self.start] >= self.length:
+            self.degree_sum -= self.degrees[self.start]
+            self.duration_sum -= self.durations[self.start]
+            self.start += 1
+
+    def average(self):
+        if not self.exact:
+            recent_notes = add_to_index(self.durations, self.length,
+                                        len(self) - 1, -1, -1)
+            return sum([self.degrees[j]
+                        for j in recent_notes]) / len(recent_notes)
+        degree_sum = self.degree_sum
+        count = len(self) - self.start
+        if self.duration_sum == self.length:
+            degree_sum += self.degrees[self.start + 1]
+            count += 1
+        return degree_sum / count
+
+
 def split_melody(current_chord,
                  mode='index',
                  melody_tol=minor_seventh,
@@ -1684,35 +1804,54 @@ def split_melody(current_chord,
         whole_notes = temp.notes
         whole_interval = temp.interval
         if get_off_overlap_notes:
+            # the first non-zero interval after each note
+            next_intervals = [None for j in range(N)]
+            next_interval = None
+            for j in range(N - 1, -1, -1):
+                next_intervals[j] = next_interval
+                if whole_interval[j] != 0:
+                    next_interval = whole_interval[j]
             for j in range(N):
                 current_note = whole_notes[j]
                 current_interval = whole_interval[j]
-                if current_interval != 0:
+                if current_interval == 0:
+                    current_interval = next_intervals[j]
+                if current_interval is not None and current_interval != 0:
                     if current_note.duration >= current_interval:
                         current_note.duration = current_interval
-                else:
-                    for y in range(j + 1, N):
-                        next_interval = whole_interval[y]
-                        if next_interval != 0:
-                            if current_note.duration >= next_interval:
-                                current_note.duration = next_interval
-                            break
             unit_duration = min([i.duration for i in whole_notes])
             for each in whole_notes:
                 each.duration = unit_duration
             whole_interval = [
                 current_chord_interval[j.number] for j in whole_notes
             ]
+            # remove the notes that repeat the note before them at the same
+            # time, the interval of the note before becomes the interval of
+            # the removed note, and the note after the removed note is not
+            # compared with the note before
+            new_notes = []
+            new_interval = []
+            N = len(whole_notes)
             k = 0
-            while k < len(whole_notes) - 1:
+            current_interval = whole_interval[0] if N else None
+            while k < N - 1:
                 current_note = whole_notes[k]
                 next_note = whole_notes[k + 1]
-                current_interval = whole_interval[k]
-                if current_note.degree == next_note.degree:
-                    if current_interval == 0:
-                        del whole_notes[k + 1]
-                        del whole_interval[k]
-                k += 1
+                new_notes.append(current_note)
+                if current_note.degree == next_note.degree and current_interval == 0:
+                    new_interval.append(whole_interval[k + 1])
+                    k += 2
+                    if k < N:
+                        current_interval = whole_interval[k]
+                else:
+                    new_interval.append(current_interval)
+                    k += 1
+                    current_interval = whole_interval[k]
+            if k == N - 1:
+                new_notes.append(whole_notes[k])
+                new_interval.append(current_interval)
+            whole_notes = new_notes
+            whole_interval = new_interval
 
         play_together = find_all_continuous(whole_interval, 0)
         for each in play_together:
@@ -1727,49 +1866,43 @@ def split_melody(current_chord,
             start = 1
         i = start + 1
         melody = [whole_notes[start]]
-        notes_num = 1
-        melody_duration = [melody[0].duration]
+        recent_notes = melody_window(average_degree_length)
+        recent_notes.append(melody[0].degree, melody[0].duration)
         while i < N:
             current_note = whole_notes[i]
             next_note = whole_notes[i + 1]
             next_degree_diff = next_note.degree - current_note.degree
-            recent_notes = add_to_index(melody_duration, average_degree_length,
-                                        notes_num - 1, -1, -1)
-            if recent_notes:
-                current_average_degree = sum(
-                    [melody[j].degree
-                     for j in recent_notes]) / len(recent_notes)
-                average_diff = current_average_degree - current_note.degree
-                if average_diff <= melody_tol:
-                    if melody[-1].degree - current_note.degree < chord_tol:
-                        melody.append(current_note)
-                        notes_num += 1
-                        melody_duration.append(current_note.duration)
-                    else:
-                        if abs(
-                                next_degree_diff
-                        ) < chord_tol and current_note.degree >= melody_degree_tol.degree:
-                            melody.append(current_note)
-                            notes_num += 1
-                            melody_duration.append(current_note.duration)
+            current_average_degree = recent_notes.average()
+            average_diff = current_average_degree - current_note.degree
+            if average_diff <= melody_tol:
+                if melody[-1].degree - current_note.degree < chord_tol:
+                    melody.append(current_note)
+                    recent_notes.append(current_note.degree,
+                                        current_note.duration)
                 else:
+                    if abs(
+                            next_degree_diff
+                    ) < chord_tol and current_note.degree >= melody_degree_tol.degree:
+                        melody.append(current_note)
+                        recent_notes.append(current_note.degree,
+                                            current_note.duration)
+            else:
 
-                    if (melody[-1].degree - current_note.degree < chord_tol
-                            and next_degree_diff < chord_tol
+                if (melody[-1].degree - current_note.degree < chord_tol
+                        and next_degree_diff < chord_tol
+                        and all(k.degree - current_note.degree < chord_tol
+                                for k in melody[-2:])):
+                    melody.append(current_note)
+                    recent_notes.append(current_note.degree,
+                                        current_note.duration)
+                else:
+                    if (abs(next_degree_diff) < chord_tol and
+                            current_note.degree >= melody_degree_tol.degree
                             and all(k.degree - current_note.degree < chord_tol
                                     for k in melody[-2:])):
                         melody.append(current_note)
-                        notes_num += 1
-                        melody_duration.append(current_note.duration)
-                    else:
-                        if (abs(next_degree_diff) < chord_tol and
-                                current_note.degree >= melody_degree_tol.degree
-                                and all(
-                                    k.degree - current_note.degree < chord_tol
-                                    for k in melody[-2:])):
-                            melody.append(current_note)
-                            notes_num += 1
-                            melody_duration.append(current_note.duration)
+                        recent_notes.append(current_note.degree,
+                                            current_note.duration)
             i += 1
         melody_inds = [each.number for each in melody]
         whole_inds = melody_inds + other_messages_inds
@@ -1789,10 +1922,10 @@ def split_chord(current_chord,
                               melody_degree_tol)
     N = len(current_chord)
     whole_notes = current_chord.notes
-    other_messages_inds = [i for i in range(N) if type(whole_notes[i]) != note]
+    melody_ind_set = set(melody_ind)
     chord_ind = [
         i for i in range(N)
-        if (i not in melody_ind) or (i in other_messages_inds)
+        if (i not in melody_ind_set) or (type(whole_notes[i]) != note)
     ]
     if mode == 'index':
         return chord_ind
@@ -1825,9 +1958,10 @@ def split_all(current_chord,
                               melody_degree_tol)
     N = len(current_chord)
     whole_notes = current_chord.notes
+    melody_ind_set = set(melody_ind)
     chord_ind = [
         i for i in range(N)
-        if (i not in melody_ind) or (type(whole_notes[i]) != note)
+        if (i not in melody_ind_set) or (type(whole_notes[i]) != note)
     ]
     if mode == 'index':
         return [melody_ind, chord_ind]
@@ -2235,23 +2369,23 @@ def find_similarity(a,
     result = ''
     types = None
     if b is None:
-        wholeTypes = chordTypes.keynames()
+        # compare with the precomputed note names of the chord types
+        # with the same root, only build the chord that is chosen
         selfname = a.names()
+        selfname_set = set(selfname)
         rootnote = a[1]
-        possible_chords = [(chd(rootnote, i), i) for i in wholeTypes]
-        lengths = len(possible_chords)
+        possible_chords = chord_templates(rootnote.name)
         if same_note_special:
-            ratios = [(1 if samenote_set(a, x[0]) else SequenceMatcher(
-                None, selfname, x[0].names()).ratio(), x[1])
+            ratios = [(1 if selfname_set == x[2] else SequenceMatcher(
+                None, selfname, x[1]).ratio(), x[0])
                       for x in possible_chords]
         else:
-            ratios = [(SequenceMatcher(None, selfname,
-                                       x[0].names()).ratio(), x[1])
+            ratios = [(SequenceMatcher(None, selfname, x[1]).ratio(), x[0])
                       for x in possible_chords]
         alen = len(a)
         ratios_temp = [
             ratios[k] for k in range(len(ratios))
-            if len(possible_chords[k][0]) >= alen
+            if len(possible_chords[k][1]) >= alen
         ]
         if len(ratios_temp) != 0:
             ratios = ratios_temp
@@ -2262,7 +2396,7 @@ def find_similarity(a,
             return ratios[0]
         first = ratios[0]
         highest = first[0]
-        chordfrom = possible_chords[wholeTypes.index(first[1])][0]
+        chordfrom = chd(rootnote, first[1])
         if ratio_and_chord:
             if ratio_chordname:
                 return first, chordfrom
@@ -2282,12 +2416,11 @@ def find_similarity(a,
                     except:
                         first = ratios[0]
                         highest = first[0]
-                        chordfrom = possible_chords[wholeTypes.index(
-                            first[1])][0]
+                        chordfrom = chd(rootnote, first[1])
                         result = ''
                         break
                     highest = first[0]
-                    chordfrom = possible_chords[wholeTypes.index(first[1])][0]
+                    chordfrom = chd(rootnote, first[1])
                     if highest > 0.6:
                         result = find_similarity(
                             a,
@@ -2297,8 +2430,7 @@ def find_similarity(a,
                     else:
                         first = ratios[0]
                         highest = first[0]
-                        chordfrom = possible_chords[wholeTypes.index(
-                            first[1])][0]
+                        chordfrom = chd(rootnote, first[1])
                         result = ''
                         break
             if highest == 1:
@@ -2517,6 +2649,94 @@ def interval_check(a, two_show_interval=True):
             return f'{a.notes[0]} octave (or times of octave)'
 
 
+class detect_lru_cache:
+    # a bounded cache of the results of detect, the least recently used
+    # result is dropped when the cache is full, maxsize 0 disables it
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f'[detect cache] hits: {self.hits}, misses: {self.misses}, size: {len(self)}, maxsize: {self.maxsize}'
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            while len(self.data) > maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self),
+            'maxsize': self.maxsize
+        }
+
+
+detect_cache = detect_lru_cache()
+
+
+def detect_cache_info():
+    return detect_cache.info()
+
+
+def set_detect_cache_size(maxsize):
+    detect_cache.resize(maxsize)
+
+
+def clear_detect_cache():
+    detect_cache.clear()
+
+
+def detect_key(a, return_fromchord=False):
+    # the key of a chord in the detect cache is the names and octaves of
+    # its notes in order, which is all that the chord names depend on,
+    # the chords returned with return_fromchord also keep the durations,
+    # volumes and intervals of the notes, so they are a part of the key then
+    notes = a.notes
+    if any(type(i) != note for i in notes):
+        return
+    key = tuple((i.name, i.num) for i in notes)
+    if return_fromchord:
+        try:
+            extra = (tuple((i.duration, i.volume, i.channel)
+                           for i in notes), tuple(a.interval))
+            hash(extra)
+        except TypeError:
+            return
+        key += extra
+    return key
+
+
 def detect(a,
            mode='chord',
            inv_num=False,
@@ -2530,6 +2750,43 @@ def detect(a,
            poly_chord_first=False,
            root_position_return_first=True,
            alter_notes_show_degree=False):
+    # the results of detecting chords are memoized in detect_cache by the
+    # notes of the chord and the arguments, see detect_uncached
+    args = (inv_num, rootpitch, change_from_first, original_first,
+            same_note_special, whole_detect, return_fromchord,
+            two_show_interval, poly_chord_first, root_position_return_first,
+            alter_notes_show_degree)
+    key = None
+    if mode == 'chord' and detect_cache.maxsize > 0:
+        if type(a) != chord:
+            a = chord(a, rootpitch=rootpitch)
+        key = detect_key(a, return_fromchord)
+    if key is None:
+        return detect_uncached(a, mode, *args)
+    key = (key, args)
+    result = detect_cache.get(key, detect_cache)
+    if result is detect_cache:
+        result = detect_uncached(a, mode, *args)
+        detect_cache.set(key, copy(result))
+        return result
+    # the lists and the chords in the results are copied so that they can
+    # be changed without changing the cache
+    return copy(result) if isinstance(result, (list, tuple)) else result
+
+
+def detect_uncached(a,
+                    mode='chord',
+                    inv_num=False,
+                    rootpitch=4,
+                    change_from_first=True,
+                    original_first=True,
+                    same_note_special=False,
+                    whole_detect=True,
+                    return_fromchord=False,
+                    two_show_interval=True,
+                    poly_chord_first=False,
+                    root_position_return_first=True,
+                    alter_notes_show_degree=False):
     # mode could be chord/scale
     if mode == 'chord':
         if type(a) != chord:
@@ -2575,7 +2832,10 @@ def detect(a,
             if original_ratio == 1:
                 return original_msg if not return_fromchord else (
                     original_msg, original_detect[1], original_detect[2])
-        for i in range(1, N):
+        # the inversions can only be found in detectTypes if the pitch
+        # classes of the chord are the pitch classes of a chord type
+        is_chord_mask = chord_mask(a) in chord_masks
+        for i in range(1, N if is_chord_mask else 1):
             current = chord(a.inversion(i).names())
             root = current[1].degree
             distance = tuple(i.degree - root for i in current[2:])
@@ -2603,7 +2863,7 @@ def detect(a,
                         return inversion_result if not return_fromchord else (
                             inversion_result, current,
                             f'{current[1].name}{result1[0]}')
-        for i in range(1, N):
+        for i in range(1, N if is_chord_mask else 1):
             current = chord(a.inversion_highest(i).names())
             root = current[1].degree
             distance = tuple(i.degree - root for i in current[2:])
@@ -3017,6 +3277,10 @@ def translate(pattern):
 
 
 def stopall():
+    # nothing is playing if pygame is not loaded yet
+    if not backend_loaded('pygame'):
+        return
+    pygame = get_backend('pygame')
     pygame.mixer.stop()
     pygame.mixer.music.stop()
 
@@ -3060,12 +3324,21 @@ def riff_to_midi(riff_name, name='temp.mid', output_file=False):
 
 
 def write_data(obj, name='untitled.mpb'):
+    # chord and piece are written in the binary format of mpb,
+    # other types of objects are pickled
+    if type(obj) in (chord, piece):
+        write_mpb(obj, name)
+        return
     import pickle
     with open(name, 'wb') as f:
         pickle.dump(obj, f)
 
 
-def load_data(name):
+def load_data(name, track=None):
+    # if track is not None, only read that track of the binary data file,
+    # the data files written by pickle are still supported
+    if is_mpb(name):
+        return read_mpb(name, track)
     import pickle
     with open(name, 'rb') as f:
         result = pickle.load(f)
@@ -3098,36 +3371,61 @@ def gen_pitch_suffix(num):
         res += suffix
     return res
 
+def gen_abjad_note_str(n):
+    cur = ""
+    cur_name = n.name.lower()
+    cur_name = cur_name.replace('#', 's')
+    cur_name = cur_name.replace('b', 'f')
+    cur_num = gen_pitch_suffix(n.num)
+    durations = split_duration(n.duration).keys()
+    for j, duration in enumerate(durations):
+        cur += "{}{}{}".format(cur_name, cur_num, duration)
+        if j == 0:
+            cur += '('
+        cur += " "
+    if cur[-2] != '(':
+        cur += ") "
+    else:
+        cur = cur[:-2] + " "
+    return cur
+
+
+def gen_abjad_note_strs(chord):
+    # the strings of the notes of a chord or a motif encoding with their
+    # intervals, the strings of the repeats of a motif starting from the
+    # same note are only generated once
+    if type(chord) != motif_encoding:
+        for i, n in enumerate(chord.notes):
+            yield gen_abjad_note_str(n), chord.interval[i]
+        return
+    repeats = {}
+    for each in chord.sequence:
+        if each[0] is None:
+            yield gen_abjad_note_str(each[1]), each[2]
+            continue
+        key = tuple(each)
+        if key not in repeats:
+            notes, intervals = chord.motif_notes(*each)
+            repeats[key] = [(gen_abjad_note_str(n), intervals[i])
+                            for i, n in enumerate(notes)]
+        yield from repeats[key]
+
+
 def gen_abjad_str(chord):
-    strs = [""]
+    # the strings of the notes of each voice are collected in lists and
+    # joined at the end, instead of adding each of them to the string
+    strs = [[]]
     cnt = 0
-    for i, n in enumerate(chord.notes):
+    for cur, interval in gen_abjad_note_strs(chord):
 
-        if chord.interval[i] == 0:
+        if interval == 0:
             cnt += 1
             if cnt == len(strs):
-                strs.append("")
+                strs.append([])
         else:
             cnt = 0
-        str = strs[cnt]
-        cur = ""
-        cur_name = n.name.lower()
-        cur_name = cur_name.replace('#', 's')
-        cur_name = cur_name.replace('b', 'f')
-        cur_num = gen_pitch_suffix(n.num)
-        durations = split_duration(n.duration).keys()
-        for j, duration in enumerate(durations):
-            cur += "{}{}{}".format(cur_name, cur_num, duration)
-            if j == 0:
-                cur += '('
-            cur += " "
-        if cur[-2] != '(':
-            cur += ") "
-        else:
-            cur = cur[:-2] + " "
-        str += cur
-        strs[cnt] = str
-    return strs
+        strs[cnt].append(cur)
+    return ["".join(each) for each in strs]
 
 
 def gen_abjad_str_v2(chord):
@@ -3147,8 +3445,119 @@ def gen_abjad_str_v2(chord):
     return strs
 
 
-import abjad
-def gen_score(p):
+def gen_score_ly(p, file=None, instrument_names=True):
+    # the LilyPond source of the score of a piece, if file (a file name or
+    # a text stream) is given, write the source to it instead of returning
+    voice_strs = [gen_abjad_str(each) for each in p.tracks]
+    if file is None:
+        return gen_ly(p, voice_strs, instrument_names)
+    write_ly(p, voice_strs, file, instrument_names)
+
+
+def gen_score(p, name=None, cache=None, pool=None):
+    # if name is given, save the score as a PDF (or PNG) file with the name
+    # instead of showing it, the LilyPond source is saved with the same
+    # name and the .ly suffix, the scores are rendered once and then
+    # copied from the render cache, if cache is False, the cache is not used,
+    # if pool (a render_pool) is given, the score is queued to be rendered
+    # by the pool, and the index of its result in the pool is returned
+    source = gen_score_ly(p)
+    if name is None:
+        show_ly(source, cache)
+        return
+    with open(output_base(name) + '.ly', 'w', encoding='utf-8') as f:
+        f.write(source)
+    if pool is not None:
+        return pool.submit(source, name)
+    render_source(source, name, cache)
+
+
+def piece_chunks(p, bars=16):
+    # split a piece into pieces of the given number of bars, each of them
+    # has the notes of each track starting in its bars, the same as
+    # piece.cut, but with one pass over the notes of each track,
+    # returns a list of [start bar, piece], where the bars count from 1
+    chunks = {}
+    track_number = len(p.tracks)
+    for k, current_chord in enumerate(p.tracks):
+        notes = current_chord.notes
+        intervals = current_chord.interval
+        current_bar = p.start_times[k]
+        # the notes, the intervals and the start time of the track in the
+        # chunk of the last note
+        last_track = None
+        for i in range(len(notes)):
+            current_note = notes[i]
+            if type(current_note) == note:
+                ind = int(current_bar // bars)
+                if ind not in chunks:
+                    chunks[ind] = [[[], [], 0] for j in range(track_number)]
+                current_track = chunks[ind][k]
+                if not current_track[0]:
+                    current_track[2] = current_bar - ind * bars
+                current_track[0].append(current_note)
+                current_track[1].append(intervals[i])
+                last_track = current_track
+            elif last_track is not None:
+                # the other objects are left out, so their intervals are
+                # added to the interval of the note before them
+                last_track[1][-1] += intervals[i]
+            current_bar += intervals[i]
+    result = []
+    for ind in sorted(chunks):
+        tracks = [
+            chord(copy(each[0]), interval=copy(each[1]))
+            for each in chunks[ind]
+        ]
+        current_piece = piece(tracks,
+                              copy(p.instruments_list),
+                              p.bpm,
+                              [each[2] for each in chunks[ind]],
+                              copy(p.track_names),
+                              copy(p.channels),
+                              p.name)
+        result.append([ind * bars + 1, current_piece])
+    return result
+
+
+def gen_score_chunks(p, name, bars=16, pool=None, cache=None):
+    # render a long piece as separate scores of the given number of bars,
+    # so that each of them is rendered on its own (in parallel if a
+    # render_pool is given) and a failed one does not fail the others,
+    # the scores are named name-1.pdf, name-2.pdf, ... in the order of the
+    # bars, returns a list of [start bar, output name, names of the
+    # rendered files, error] in the same order, the names of the rendered
+    # files put together are the pages of the whole score, all of the
+    # scores queued to the pool are waited for
+    base = output_base(name)
+    ext = name[len(base):] or '.pdf'
+    own_pool = pool is None
+    if own_pool:
+        pool = render_pool(cache=cache)
+    result = []
+    for i, (start_bar, current_piece) in enumerate(piece_chunks(p, bars)):
+        current_name = f'{base}-{i + 1}{ext}'
+        try:
+            ind = gen_score(current_piece, current_name, cache, pool)
+        except Exception as e:
+            ind = e
+        result.append([start_bar, current_name, ind])
+    results = pool.results()
+    if own_pool:
+        pool.close()
+    for each in result:
+        if isinstance(each[2], Exception):
+            each[2:] = [None, each[2]]
+        else:
+            each[2:] = results[each[2]][1:]
+    return result
+
+
+def gen_abjad_score(p, name=None):
+    # make the score with abjad, which is slower than gen_score,
+    # if name is given, save the score as a PDF file with the name
+    # instead of showing it
+    abjad = get_backend('abjad')
 
     chords = p.tracks
     num = len(chords)
@@ -3197,7 +3606,10 @@ def gen_score(p):
     # bar_line = abjad.BarLine("|.")
     # note = abjad.select(voices[0]).note(-1)
     # abjad.attach(bar_line, note)
-    abjad.show(score)
+    if name is None:
+        abjad.show(score)
+    else:
+        abjad.persist.as_pdf(score, name)
 
 
 
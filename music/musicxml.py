@@ -0,0 +1,259 @@
+from io import StringIO
+from xml.sax.saxutils import XMLGenerator
+
+import musicode.music as mp
+from .structures import note, chord, piece
+from .lilypond import instrument_name
+
+# write the MusicXML of a piece as a stream of elements, the notes of each
+# track are split into voices on the zero intervals and their durations
+# are split into tied notes by split_duration, the same as gen_abjad_str,
+# and the notes that go over a bar line are split into tied notes at the
+# bar line, the time signature is 4/4 and a bar is a whole note, the notes
+# are kept as small tuples of the voices of one track at a time, and the
+# elements are written to the file as soon as they are made
+
+# the number of divisions of a quarter note, so that a 1/32 note is 1
+divisions = 8
+bar_divisions = divisions * 4
+note_types = {
+    1: 'whole',
+    2: 'half',
+    4: 'quarter',
+    8: 'eighth',
+    16: '16th',
+    32: '32nd'
+}
+doctype = '<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 4.0 Partwise//EN" "http://www.musicxml.org/dtds/partwise.dtd">\n'
+
+
+def note_voices(current_chord):
+    # the (voice, note) of the notes of a chord, a note goes to the next
+    # voice if the interval before it is 0, and back to the first voice if
+    # not, the same as gen_abjad_str
+    cnt = 0
+    notes = current_chord.notes
+    intervals = current_chord.interval
+    for i in range(len(notes)):
+        if intervals[i] == 0:
+            cnt += 1
+        else:
+            cnt = 0
+        if type(notes[i]) == note:
+            yield cnt, notes[i]
+
+
+def note_pieces(duration):
+    # the durations (as the denominators of the note types) of the tied
+    # notes of a note, the same as gen_abjad_str
+    pieces = mp.split_duration(duration)
+    if pieces is None:
+        raise ValueError(
+            f'the duration {duration} can not be written as notes of up to 1/32'
+        )
+    return list(pieces.keys())
+
+
+def bar_pieces(start, length):
+    # split a note of the length (in divisions) starting at start into
+    # the notes of binary lengths in each bar, returns a list of the
+    # lengths in divisions
+    result = []
+    while length > 0:
+        current_length = min(length, bar_divisions - start % bar_divisions)
+        length -= current_length
+        start += current_length
+        size = bar_divisions
+        while current_length > 0:
+            if size <= current_length:
+                result.append(size)
+                current_length -= size
+            size //= 2
+    return result
+
+
+def track_voices(current_chord):
+    # the voices of a track, each of them is a list of the tied notes of
+    # (step, alter, octave, length in divisions, tie start, tie stop)
+    voices = []
+    times = []
+    durations = {}
+    for voice, current_note in note_voices(current_chord):
+        while len(voices) <= voice:
+            voices.append([])
+            times.append(0)
+        name = current_note.name
+        step = name[0].upper()
+        alter = name.count('#') - name.count('b')
+        duration = current_note.duration
+        if duration not in durations:
+            durations[duration] = note_pieces(duration)
+        lengths = []
+        current_time = times[voice]
+        for each in durations[duration]:
+            current_lengths = bar_pieces(current_time, bar_divisions // each)
+            current_time += bar_divisions // each
+            lengths += current_lengths
+        last = len(lengths) - 1
+        current_voice = voices[voice]
+        for i, length in enumerate(lengths):
+            current_voice.append(
+                (step, alter, current_note.num, length, i < last, i > 0))
+        times[voice] = current_time
+    return voices, times
+
+
+def voice_times(current_chord):
+    # the lengths in divisions of the voices of a track
+    times = []
+    lengths = {}
+    for voice, current_note in note_voices(current_chord):
+        while len(times) <= voice:
+            times.append(0)
+        duration = current_note.duration
+        if duration not in lengths:
+            lengths[duration] = sum(bar_divisions // each
+                                    for each in note_pieces(duration))
+        times[voice] += lengths[duration]
+    return times
+
+
+def write_element(writer, name, text=None, attrs={}):
+    writer.startElement(name, attrs)
+    if text is not None:
+        writer.characters(str(text))
+    writer.endElement(name)
+
+
+def note_element(voice, current_note):
+    # the text of the element of a note
+    step, alter, octave, length, tie_start, tie_stop = current_note
+    text = StringIO()
+    writer = XMLGenerator(text, 'utf-8', short_empty_elements=True)
+    writer.startElement('note', {})
+    writer.startElement('pitch', {})
+    write_element(writer, 'step', step)
+    if alter:
+        write_element(writer, 'alter', alter)
+    write_element(writer, 'octave', octave)
+    writer.endElement('pitch')
+    write_element(writer, 'duration', length)
+    if tie_stop:
+        write_element(writer, 'tie', attrs={'type': 'stop'})
+    if tie_start:
+        write_element(writer, 'tie', attrs={'type': 'start'})
+    write_element(writer, 'voice', voice + 1)
+    note_type = bar_divisions // length
+    write_element(writer, 'type', note_types[note_type])
+    if tie_start or tie_stop:
+        writer.startElement('notations', {})
+        if tie_stop:
+            write_element(writer, 'tied', attrs={'type': 'stop'})
+        if tie_start:
+            write_element(writer, 'tied', attrs={'type': 'start'})
+        writer.endElement('notations')
+    writer.endElement('note')
+    return text.getvalue() + '\n'
+
+
+def write_part(writer, voices, measure_number, bass_clef):
+    # the pieces of the notes are repeated a lot, so the text of each of
+    # them is made once and written as it is
+    note_elements = {}
+    # the (time, index of the next note) of each voice
+    positions = [(0, 0) for each in voices]
+    for measure in range(measure_number):
+        writer.startElement('measure', {'number': str(measure + 1)})
+        writer.ignorableWhitespace('\n')
+        if measure == 0:
+            writer.startElement('attributes', {})
+            write_element(writer, 'divisions', divisions)
+            writer.startElement('key', {})
+            write_element(writer, 'fifths', 0)
+            writer.endElement('key')
+            writer.startElement('time', {})
+            write_element(writer, 'beats', 4)
+            write_element(writer, 'beat-type', 4)
+            writer.endElement('time')
+            writer.startElement('clef', {})
+            write_element(writer, 'sign', 'F' if bass_clef else 'G')
+            write_element(writer, 'line', 4 if bass_clef else 2)
+            writer.endElement('clef')
+            writer.endElement('attributes')
+            writer.ignorableWhitespace('\n')
+        measure_end = (measure + 1) * bar_divisions
+        written = False
+        for voice, current_voice in enumerate(voices):
+            # the notes of the voice in this bar, from its time in the bar
+            current_time, ind = positions[voice]
+            length = 0
+            while ind < len(current_voice) and current_time < measure_end:
+                key = (voice, current_voice[ind])
+                if key not in note_elements:
+                    note_elements[key] = note_element(*key)
+                writer.ignorableWhitespace(note_elements[key])
+                current_time += current_voice[ind][3]
+                length += current_voice[ind][3]
+                ind += 1
+            positions[voice] = (current_time, ind)
+            if length:
+                written = True
+            if length and voice < len(voices) - 1:
+                writer.startElement('backup', {})
+                write_element(writer, 'duration', length)
+                writer.endElement('backup')
+                writer.ignorableWhitespace('\n')
+        if not written:
+            writer.startElement('note', {})
+            write_element(writer, 'rest', attrs={'measure': 'yes'})
+            write_element(writer, 'duration', bar_divisions)
+            write_element(writer, 'voice', 1)
+            writer.endElement('note')
+            writer.ignorableWhitespace('\n')
+        writer.endElement('measure')
+        writer.ignorableWhitespace('\n')
+
+
+def write_musicxml(p, file):
+    # write the MusicXML of a piece (or a chord) to a file name or a binary
+    # stream, the tracks are the parts of the score, and the last track
+    # has a bass clef if there are more than one of them
+    if type(p) == chord:
+        p = mp.P([p])
+    elif type(p) != piece:
+        raise ValueError('only chord and piece can be written as MusicXML')
+    if not hasattr(file, 'write'):
+        with open(file, 'wb') as f:
+            return write_musicxml(p, f)
+    # the number of bars is needed before the first part is written
+    measure_number = 1
+    for current_chord in p.tracks:
+        times = voice_times(current_chord)
+        if times:
+            measure_number = max(measure_number,
+                                 -(-max(times) // bar_divisions))
+    writer = XMLGenerator(file, 'utf-8', short_empty_elements=True)
+    writer.startDocument()
+    file.write(doctype.encode('utf-8'))
+    writer.startElement('score-partwise', {'version': '4.0'})
+    writer.ignorableWhitespace('\n')
+    writer.startElement('part-list', {})
+    num = len(p.tracks)
+    for i in range(num):
+        writer.startElement('score-part', {'id': f'P{i + 1}'})
+        write_element(writer, 'part-name',
+                      instrument_name(p.instruments_list[i]))
+        writer.endElement('score-part')
+    writer.endElement('part-list')
+    writer.ignorableWhitespace('\n')
+    for i, current_chord in enumerate(p.tracks):
+        voices, times = track_voices(current_chord)
+        writer.startElement('part', {'id': f'P{i + 1}'})
+        writer.ignorableWhitespace('\n')
+        write_part(writer, voices, measure_number, i != 0 and i == num - 1)
+        writer.endElement('part')
+        writer.ignorableWhitespace('\n')
+        del voices
+    writer.endElement('score-partwise')
+    writer.ignorableWhitespace('\n')
+    writer.endDocument()
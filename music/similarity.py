@@ -0,0 +1,294 @@
+import os
+import json
+import hashlib
+from difflib import SequenceMatcher
+
+from .structures import note, chord, piece
+from .ingest import load_manifest
+from .backends import get_backend
+
+# an index of the melodies of many tracks for finding the tracks which
+# contain a phrase similar to a given one, the melody of a track is the
+# highest note of each onset, and each note of the melody after the first
+# one is encoded as a token of the pitch interval from the previous note
+# and the ratio of the time from the previous note to the time between the
+# two notes before, so that the tokens do not change with transposition
+# and tempo, the n-grams of the tokens of each track are the keys of the
+# posting lists of the tracks containing them, the posting lists are
+# stored on disk as numpy arrays which are memory mapped when the index is
+# opened, a query scores the tracks by the weighted n-grams they share with
+# the query phrase, and the best of them are re-ranked by matching their
+# tokens with the tokens of the phrase
+
+index_version = 1
+index_header_name = 'index.json'
+index_arrays = ('keys', 'offsets', 'postings', 'counts', 'tokens',
+                'token_offsets')
+# the pitch intervals are clipped to [-max_step, max_step], and the
+# rhythm ratios are rounded to the nearest half power of 2 and clipped
+# to [-max_ratio, max_ratio] half powers
+max_step = 24
+max_ratio = 6
+ratio_num = 2 * max_ratio + 1
+# the number of bits of a token, the n-grams of up to 6 tokens are packed
+# into 64-bit keys, the longer ones are hashed with blake2b
+token_bits = 10
+max_packed = 64 // token_bits
+
+
+def melody_tokens(onsets, pitches):
+    # the tokens of the melody of the notes with the onsets and pitches,
+    # the onsets could be in any unit of time
+    numpy = get_backend('numpy')
+    onsets = numpy.asarray(onsets, dtype=float)
+    pitches = numpy.asarray(pitches, dtype=int)
+    if len(onsets) == 0:
+        return numpy.zeros(0, dtype=numpy.int32)
+    order = numpy.lexsort((-pitches, onsets))
+    onsets = onsets[order]
+    pitches = pitches[order]
+    first = numpy.concatenate([[True], onsets[1:] != onsets[:-1]])
+    onsets = onsets[first]
+    pitches = pitches[first]
+    steps = numpy.clip(numpy.diff(pitches), -max_step, max_step)
+    gaps = numpy.diff(onsets)
+    ratios = numpy.zeros(len(gaps), dtype=int)
+    if len(gaps) > 1:
+        ratios[1:] = numpy.clip(numpy.round(2 * numpy.log2(gaps[1:] /
+                                                          gaps[:-1])),
+                                -max_ratio, max_ratio)
+    return ((steps + max_step) * ratio_num + ratios + max_ratio).astype(
+        numpy.int32)
+
+
+def chord_tokens(current_chord, start_time=0):
+    # the tokens of the melody of a chord
+    numpy = get_backend('numpy')
+    notes = current_chord.notes
+    onsets = numpy.cumsum([0] + current_chord.interval[:-1],
+                          dtype=float) + start_time
+    inds = [i for i in range(len(notes)) if type(notes[i]) == note]
+    return melody_tokens(onsets[inds], [notes[i].degree for i in inds])
+
+
+def ngram_keys(tokens, n=3):
+    # the keys of all of the n-grams of the tokens as an array of uint64
+    numpy = get_backend('numpy')
+    tokens = numpy.asarray(tokens, dtype=numpy.uint64)
+    size = len(tokens) - n + 1
+    if size <= 0:
+        return numpy.zeros(0, dtype=numpy.uint64)
+    if n > max_packed:
+        grams = numpy.lib.stride_tricks.sliding_window_view(tokens, n)
+        return numpy.array([
+            int.from_bytes(
+                hashlib.blake2b(each.tobytes(), digest_size=8).digest(),
+                'little') for each in grams
+        ],
+                           dtype=numpy.uint64)
+    keys = numpy.zeros(size, dtype=numpy.uint64)
+    for i in range(n):
+        keys |= tokens[i:i + size] << numpy.uint64(token_bits * i)
+    return keys
+
+
+def piece_tracks(obj, name):
+    # the (name, track number, tokens) of the tracks of a chord or a piece,
+    # the tracks are counted from 1
+    if type(obj) == chord:
+        yield name, 1, chord_tokens(obj)
+    elif type(obj) == piece:
+        for i, each in enumerate(obj.tracks):
+            yield name, i + 1, chord_tokens(each, obj.start_times[i])
+    else:
+        raise ValueError('only chord and piece can be indexed')
+
+
+def store_tracks(store):
+    # the (name, track number, tokens) of the tracks of all of the
+    # successfully ingested MIDI files of a store, which are read from the
+    # columns of the store without making pieces
+    numpy = get_backend('numpy')
+    for entry in load_manifest(store)['files']:
+        if 'error' in entry:
+            continue
+        with numpy.load(os.path.join(store, entry['store'])) as current_file:
+            track_column = current_file['track']
+            onsets = current_file['onset']
+            pitches = current_file['pitch']
+        track_inds = numpy.unique(track_column).tolist()
+        bounds = numpy.searchsorted(track_column,
+                                    track_inds).tolist() + [len(onsets)]
+        # the tracks are numbered as the tracks of the pieces of the store
+        for i in range(len(track_inds)):
+            yield entry['source'], i + 1, melody_tokens(
+                onsets[bounds[i]:bounds[i + 1]],
+                pitches[bounds[i]:bounds[i + 1]])
+
+
+def build_similarity_index(tracks, directory, n=3):
+    # write the index of the tracks to a directory, tracks could be the
+    # directory of a store made by ingest, or an iterable of (name, chord
+    # or piece) or (name, track number, tokens), returns the header of
+    # the index
+    numpy = get_backend('numpy')
+    if type(tracks) == str:
+        tracks = store_tracks(tracks)
+    documents = []
+    tokens_list = []
+    keys_list = []
+    documents_list = []
+    for each in tracks:
+        if len(each) == 2:
+            current_tracks = piece_tracks(each[1], each[0])
+        else:
+            current_tracks = [each]
+        for name, track_num, tokens in current_tracks:
+            current_keys = ngram_keys(tokens, n)
+            documents_list.append(
+                numpy.full(len(current_keys), len(documents), numpy.uint32))
+            keys_list.append(current_keys)
+            tokens_list.append(tokens)
+            documents.append([name, track_num])
+    keys = numpy.concatenate(keys_list + [numpy.zeros(0, numpy.uint64)])
+    document_inds = numpy.concatenate(documents_list +
+                                      [numpy.zeros(0, numpy.uint32)])
+    # sort the (key, document) pairs and count the repeated ones,
+    # then the posting list of each key is the documents of its pairs
+    order = numpy.lexsort((document_inds, keys))
+    keys = keys[order]
+    document_inds = document_inds[order]
+    pair_starts = numpy.ones(len(keys), dtype=bool)
+    pair_starts[1:] = (keys[1:] != keys[:-1]) | (document_inds[1:] !=
+                                                 document_inds[:-1])
+    pair_starts = numpy.flatnonzero(pair_starts)
+    counts = numpy.diff(numpy.append(pair_starts, len(keys))).astype(
+        numpy.uint32)
+    keys = keys[pair_starts]
+    postings = document_inds[pair_starts]
+    key_starts = numpy.ones(len(keys), dtype=bool)
+    key_starts[1:] = keys[1:] != keys[:-1]
+    key_starts = numpy.flatnonzero(key_starts)
+    arrays = {
+        'keys': keys[key_starts],
+        'offsets': numpy.append(key_starts, len(keys)).astype(numpy.int64),
+        'postings': postings,
+        'counts': counts,
+        'tokens': numpy.concatenate(tokens_list +
+                                    [numpy.zeros(0, numpy.int32)]),
+        'token_offsets': numpy.cumsum([0] + [len(i) for i in tokens_list],
+                                      dtype=numpy.int64)
+    }
+    os.makedirs(directory, exist_ok=True)
+    for i, j in arrays.items():
+        numpy.save(os.path.join(directory, f'{i}.npy'), j)
+    header = {'version': index_version, 'n': n, 'documents': documents}
+    with open(os.path.join(directory, index_header_name),
+              'w',
+              encoding='utf-8') as f:
+        json.dump(header, f, ensure_ascii=False)
+    return header
+
+
+class similarity_index:
+    # open an index written by build_similarity_index, the arrays are
+    # memory mapped, so only the posting lists and the tokens used by the
+    # queries are read from the disk
+    def __init__(self, directory):
+        numpy = get_backend('numpy')
+        with open(os.path.join(directory, index_header_name),
+                  encoding='utf-8') as f:
+            header = json.load(f)
+        if header['version'] != index_version:
+            raise ValueError(
+                f'unsupported index version {header["version"]}, the current version is {index_version}'
+            )
+        self.n = header['n']
+        self.documents = header['documents']
+        for each in index_arrays:
+            setattr(
+                self, each,
+                numpy.load(os.path.join(directory, f'{each}.npy'),
+                           mmap_mode='r'))
+        # the inverse document frequencies of the keys
+        self.idf = numpy.log(
+            (len(self.documents) + 1) / (numpy.diff(self.offsets) + 1)) + 1
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __repr__(self):
+        return f'[similarity index] {len(self)} tracks, {len(self.keys)} {self.n}-grams'
+
+    def document_tokens(self, ind):
+        return self.tokens[self.token_offsets[ind]:self.token_offsets[ind +
+                                                                      1]]
+
+    def match_phrase(self, tokens, query_keys, ind):
+        # the fraction of the tokens of the phrase that are matched in order
+        # in the part of the tokens of the document with the most n-grams
+        # of the phrase, the part is as long as the phrase
+        numpy = get_backend('numpy')
+        document_tokens = self.document_tokens(ind)
+        size = len(tokens)
+        hits = numpy.isin(ngram_keys(document_tokens, self.n), query_keys)
+        # the number of n-grams of the phrase
+        window = max(size - self.n + 1, 1)
+        if len(hits) > window:
+            window_hits = numpy.convolve(hits, numpy.ones(window), 'valid')
+            start = int(window_hits.argmax())
+        else:
+            start = 0
+        matcher = SequenceMatcher(None,
+                                  tokens.tolist(),
+                                  document_tokens[start:start +
+                                                  size].tolist(),
+                                  autojunk=False)
+        return sum(i.size for i in matcher.get_matching_blocks()) / size
+
+    def scores(self, tokens):
+        # the sums of the idf weights of the n-grams of the tokens that
+        # each document contains, the n-grams repeated in the tokens count
+        # at most as many times as they are in the document
+        numpy = get_backend('numpy')
+        query_keys, query_counts = numpy.unique(ngram_keys(tokens, self.n),
+                                                return_counts=True)
+        result = numpy.zeros(len(self.documents))
+        if len(query_keys) == 0 or len(self.keys) == 0:
+            return result, 0, query_keys
+        inds = numpy.searchsorted(self.keys, query_keys)
+        inds[inds == len(self.keys)] = 0
+        found = self.keys[inds] == query_keys
+        total = float((self.idf[inds[found]] * query_counts[found]).sum())
+        for ind, query_count in zip(inds[found], query_counts[found]):
+            start, end = self.offsets[ind], self.offsets[ind + 1]
+            result[self.postings[start:end]] += self.idf[ind] * numpy.minimum(
+                self.counts[start:end], query_count)
+        return result, total, query_keys
+
+    def query(self, phrase, k=10, candidates=100):
+        # the k tracks that best contain the phrase (a chord or the tokens
+        # of a melody) as a list of [score, name, track number], the
+        # candidates with the most shared n-grams are re-ranked by
+        # match_phrase
+        numpy = get_backend('numpy')
+        tokens = chord_tokens(phrase) if type(phrase) == chord else \
+            numpy.asarray(phrase, dtype=numpy.int32)
+        scores, total, query_keys = self.scores(tokens)
+        if total == 0:
+            return []
+        candidates = max(candidates, k)
+        inds = numpy.flatnonzero(scores)
+        if len(inds) > candidates:
+            inds = inds[numpy.argpartition(-scores[inds],
+                                           candidates - 1)[:candidates]]
+        result = [[
+            self.match_phrase(tokens, query_keys, ind), scores[ind] / total,
+            *self.documents[ind]
+        ] for ind in inds.tolist()]
+        result.sort(key=lambda s: (-s[0], -s[1], s[2], s[3]))
+        return [[i[0], i[2], i[3]] for i in result[:k]]
+
+
+def query_similarity_index(directory, phrase, k=10, candidates=100):
+    return similarity_index(directory).query(phrase, k, candidates)
@@ -1,8 +1,11 @@
 from copy import deepcopy as copy
 from fractions import Fraction
 from ast import literal_eval
+from bisect import bisect_right
+from collections import Counter
 
 from musicode.music.database import *
+from musicode.music.degree_tables import scale_degrees
 import musicode.music as mp
 
 
@@ -319,9 +322,11 @@ class chord:
                  return_inds=False,
                  normalize_tempo=False):
         if normalize_tempo:
-            temp = copy(self)
-            temp.normalize_tempo(bpm)
-            return temp.cut_time(bpm, time1, time2, start_time, return_inds)
+            current_tempo_map = self.get_tempo_map(bpm)
+            get_seconds = lambda bar: current_tempo_map.bar_to_seconds(bar +
+                                                                       1)
+        else:
+            get_seconds = lambda bar: (60 / bpm) * bar * 4
         time1 -= start_time
         if time1 < 0:
             return chord([]) if not return_inds else (0, 0)
@@ -342,12 +347,12 @@ class chord:
             current_note = notes[i]
             if type(current_note) == note:
                 current_bar += intervals[i]
-                if (not find_start) and (60 / bpm) * current_bar * 4 >= time1:
+                if (not find_start) and get_seconds(current_bar) >= time1:
                     start_ind = i + 1
                     find_start = True
                     if time2 is None:
                         break
-                elif time2 and (60 / bpm) * current_bar * 4 >= time2:
+                elif time2 and get_seconds(current_bar) >= time2:
                     to_ind = i + 1
                     break
         if not find_start:
@@ -413,32 +418,34 @@ class chord:
                 each.name = standard_dict[each.name]
         return temp
 
-    def most_appear(self, choices=None, mode='name', as_standard=False):
-        test_obj = self
+    def name_counts(self, as_standard=False):
+        # count the names of the notes in a single pass
+        names = self.names()
         if as_standard:
-            test_obj = self.standard_notation()
+            names = [standard_dict.get(i, i) for i in names]
+        return Counter(names)
+
+    def most_appear(self, choices=None, mode='name', as_standard=False):
+        if mode == 'note' and choices:
+            test_obj = self.standard_notation() if as_standard else self
+            choices = [toNote(i) if type(i) == str else i for i in choices]
+            return max(choices, key=lambda s: test_obj.count(s, mode='note'))
+        counts = self.name_counts(as_standard)
         if not choices:
-            return max([i for i in standard2], key=lambda s: test_obj.count(s))
+            return max([i for i in standard2], key=lambda s: counts[s])
         else:
             choices = [toNote(i) if type(i) == str else i for i in choices]
-            if mode == 'name':
-                return max([i.name for i in choices],
-                           key=lambda s: test_obj.count(s))
-            elif mode == 'note':
-                return max(choices,
-                           key=lambda s: test_obj.count(s, mode='note'))
+            return max([i.name for i in choices], key=lambda s: counts[s])
 
     def count_appear(self, choices=None, as_standard=True, sort=False):
-        test_obj = self
-        if as_standard:
-            test_obj = self.standard_notation()
+        counts = self.name_counts(as_standard)
         if not choices:
             choices = copy(standard2) if as_standard else copy(standard)
         else:
             choices = [
-                toNote(i).anme if type(i) == str else i.name for i in choices
+                toNote(i).name if type(i) == str else i.name for i in choices
             ]
-        result = {i: test_obj.count(i) for i in choices}
+        result = {i: counts[i] for i in choices}
         if sort:
             result = [[i, result[i]] for i in result]
             result.sort(key=lambda s: s[1], reverse=True)
@@ -452,22 +459,20 @@ class chord:
                   start_time=0,
                   normalize_tempo=False,
                   audio_mode=0):
-        if normalize_tempo:
-            temp = copy(self)
-            temp.normalize_tempo(bpm)
-            return temp.eval_time(bpm,
-                                  ind1,
-                                  ind2,
-                                  start_time,
-                                  mode=mode,
-                                  audio_mode=audio_mode)
         if ind1 is None:
-            whole_bars = self.bars(start_time, audio_mode=audio_mode)
+            ind1 = 0
+            ind2 = self.bars(start_time, audio_mode=audio_mode)
+        elif ind2 is None:
+            ind2 = self.bars(start_time, audio_mode=audio_mode)
+        if normalize_tempo:
+            # the tempo changes are applied with a tempo map instead of
+            # normalizing the tempo of a copy of the whole chord, the map
+            # starts at the start of the chord, while ind1 and ind2 also
+            # count the bars before it
+            result = self.get_tempo_map(bpm).seconds_between(
+                ind1 + 1 - start_time, ind2 + 1 - start_time)
         else:
-            if ind2 is None:
-                ind2 = self.bars(start_time, audio_mode=audio_mode)
-            whole_bars = ind2 - ind1
-        result = (60 / bpm) * whole_bars * 4
+            result = (60 / bpm) * (ind2 - ind1) * 4
         if mode == 'seconds':
             result = round(result, 3)
             return f'{result}s'
@@ -1473,6 +1478,15 @@ class chord:
     def chord_analysis(self, *args, **kwargs):
         return mp.chord_analysis(self, *args, **kwargs)
 
+    def harmonic_timeline(self, *args, **kwargs):
+        return mp.harmonic_timeline(self, *args, **kwargs)
+
+    def find_motifs(self, *args, **kwargs):
+        return mp.find_motifs(self, *args, **kwargs)
+
+    def encode_motifs(self, *args, **kwargs):
+        return mp.motif_encoding(self, *args, **kwargs)
+
     def clear_at(self, duration=0, interval=None, volume=None):
         temp = copy(self)
         i = 1
@@ -1578,37 +1592,12 @@ class chord:
             self.other_messages = temp2.other_messages
             return result
         else:
-            tempo_changes_no_time = [
-                k for k in tempo_changes if self.notes[k].start_time is None
-            ]
-            for each in tempo_changes_no_time:
-                current_time = self[:each + 1].bars(mode=0) + 1
-                current_tempo = self.notes[each]
-                current_tempo.start_time = current_time
-            tempo_changes = [self.notes[j] for j in tempo_changes]
-            tempo_changes.insert(0, tempo(bpm, 1))
+            current_tempo_map = self.get_tempo_map(bpm)
             self.clear_tempo()
-            tempo_changes.sort(key=lambda s: s.start_time)
-            new_tempo_changes = [tempo_changes[0]]
-            for i in range(len(tempo_changes) - 1):
-                current_tempo = tempo_changes[i]
-                next_tempo = tempo_changes[i + 1]
-                if next_tempo.start_time == current_tempo.start_time:
-                    new_tempo_changes[-1] = next_tempo
-                else:
-                    new_tempo_changes.append(next_tempo)
-            tempo_changes_ranges = [
-                (new_tempo_changes[i].start_time,
-                 new_tempo_changes[i + 1].start_time, new_tempo_changes[i].bpm)
-                for i in range(len(new_tempo_changes) - 1)
-            ]
-            tempo_changes_ranges.append(
-                (new_tempo_changes[-1].start_time, 1 + self.bars(mode=0),
-                 new_tempo_changes[-1].bpm))
             pitch_bend_msg = self.split(pitch_bend, get_time=True)
             self.clear_pitch_bend('all')
 
-            process_normalize_tempo(self, tempo_changes_ranges, bpm)
+            process_normalize_tempo(self, current_tempo_map, bpm)
 
             for each in self.other_messages:
                 each.start_time = each.time / 4 + 1
@@ -1627,7 +1616,7 @@ class chord:
             other_types_chord = chord(other_types,
                                       interval=other_types_interval)
             process_normalize_tempo(other_types_chord,
-                                    tempo_changes_ranges,
+                                    current_tempo_map,
                                     bpm,
                                     mode=1)
             new_pitch_bends = []
@@ -1660,6 +1649,23 @@ class chord:
                 result += [new_pan, new_volume]
             return result
 
+    def get_tempo_map(self, bpm, start_time=0):
+        # the tempo changes without start time start at the position
+        # of them in the chord, the start time of the chord is bar 1
+        tempo_changes = []
+        current_time = 1
+        for i in range(len(self.notes)):
+            each = self.notes[i]
+            if type(each) == tempo:
+                if each.start_time is None:
+                    tempo_changes.append(tempo(each.bpm, current_time))
+                else:
+                    tempo_changes.append(
+                        tempo(each.bpm, max(each.start_time - start_time,
+                                            1)))
+            current_time += self.interval[i]
+        return tempo_map(bpm, tempo_changes)
+
     def place_shift(self, time=0, pan_msg=None, volume_msg=None):
         temp = copy(self)
         for i in temp.notes:
@@ -2188,8 +2194,10 @@ class scale:
             return self.names()
 
     def __contains__(self, note1):
-        names = self.names()
-        names = [standard_dict[i] if i in standard_dict else i for i in names]
+        names = {
+            standard_dict[i] if i in standard_dict else i
+            for i in self.names()
+        }
         if type(note1) == chord:
             chord_names = note1.names()
             chord_names = [
@@ -2255,6 +2263,13 @@ class scale:
                     result.append(degree_to_note(count))
                 return chord(result, duration=durations, interval=intervals)
         else:
+            degrees = None
+            if self.interval is None:
+                degrees = scale_degrees(self.start.degree, self.mode.lower())
+            if degrees is not None:
+                result = [self.start
+                          ] + [degree_to_note(i) for i in degrees[1:]]
+                return chord(result, duration=durations, interval=intervals)
             result = [self.start]
             count = self.start.degree
             interval1 = self.getInterval()
@@ -2287,12 +2302,12 @@ class scale:
         if degree1 == 8:
             degree1 = 1
             high = True
-        temp = copy(self)
-        scale_notes = temp.notes[:-1]
+        # only copy the picked notes instead of the whole scale
+        scale_notes = self.notes[:-1]
         for i in range(degree1, degree1 + step * num, step):
-            result.append(scale_notes[(i % 7) - 1])
+            result.append(copy(scale_notes[(i % 7) - 1]))
         resultchord = chord(result,
-                            rootpitch=temp.pitch,
+                            rootpitch=self.pitch,
                             interval=interval,
                             duration=duration).standardize()
         if high:
@@ -2555,7 +2570,8 @@ class scale:
                           intervals=0,
                           volumes=None,
                           chords_interval=None,
-                          merge=True):
+                          merge=True,
+                          **kwargs):
         current_keys = list(roman_numerals_dict.keys())
         current_keys.sort(key=lambda s: len(s[0]), reverse=True)
         for k in range(len(chords)):
@@ -2588,7 +2604,7 @@ class scale:
                 if not found:
                     return f'{current_chord} is not a valid roman numerals chord representation'
         return mp.chord_progression(chords, durations, intervals, volumes,
-                                    chords_interval, merge)
+                                    chords_interval, merge, **kwargs)
 
     def reset_octave(self, num):
         return scale(self.start.reset_octave(num), self.mode, self.interval)
@@ -3141,6 +3157,23 @@ class piece:
         tempo_changes.sort(key=lambda s: s.start_time)
         return chord(tempo_changes)
 
+    def get_tempo_map(self, bpm=None):
+        if bpm is None:
+            bpm = self.bpm
+        tempo_changes = []
+        for k in range(len(self.tracks)):
+            each = self.tracks[k]
+            current_time = 1 + self.start_times[k]
+            for i in range(len(each.notes)):
+                current = each.notes[i]
+                if type(current) == tempo:
+                    tempo_changes.append(
+                        tempo(current.bpm, current_time) if current.
+                        start_time is None else current)
+                current_time += each.interval[i]
+        tempo_changes.sort(key=lambda s: s.start_time)
+        return tempo_map(bpm, tempo_changes)
+
     def get_pitch_bend(self, ind=1, **args):
         if ind == 'all':
             return mp.concat(
@@ -3365,13 +3398,12 @@ class piece:
         temp_bpm, merged_result, start_time = self.merge()
         if bpm is not None:
             temp_bpm = bpm
-        if normalize_tempo:
-            merged_result.normalize_tempo(temp_bpm, start_time=start_time)
         return merged_result.eval_time(temp_bpm,
                                        ind1,
                                        ind2,
                                        mode,
                                        start_time=start_time,
+                                       normalize_tempo=normalize_tempo,
                                        audio_mode=audio_mode)
 
     def cut(self, ind1=1, ind2=None, correct=False):
@@ -3423,16 +3455,14 @@ class piece:
         return temp
 
     def cut_time(self, time1=0, time2=None, bpm=None, start_time=0, **args):
-        temp = copy(self)
-        temp.normalize_tempo()
-        if bpm is not None:
-            temp_bpm = bpm
-        else:
-            temp_bpm = temp.bpm
-        bar_left = time1 / ((60 / temp_bpm) * 4)
-        bar_right = time2 / (
-            (60 / temp_bpm) * 4) if time2 is not None else temp.bars(**args)
-        result = temp.cut(1 + bar_left, 1 + bar_right)
+        # convert the times to bars with the tempo map of the piece,
+        # if bpm is given, then use it as a constant tempo
+        current_tempo_map = self.get_tempo_map(
+        ) if bpm is None else tempo_map(bpm)
+        bar_left = current_tempo_map.seconds_to_bar(time1)
+        bar_right = current_tempo_map.seconds_to_bar(
+            time2) if time2 is not None else 1 + self.bars(**args)
+        result = self.cut(bar_left, bar_right)
         return result
 
     def get_bar(self, n):
@@ -3465,6 +3495,9 @@ class piece:
     def count_appear(self, choices=None, as_standard=True, sort=False):
         return self.merge()[1].count_appear(choices, as_standard, sort)
 
+    def harmonic_timeline(self, *args, **kwargs):
+        return mp.harmonic_timeline(self, *args, **kwargs)
+
     def apply_start_time_to_changes(self,
                                     start_time,
                                     msg=False,
@@ -3771,6 +3804,72 @@ class tempo:
         return temp
 
 
+class tempo_map:
+    # a map of the tempo changes of a piece of music, which converts
+    # between the positions in bars and the time in seconds in O(log n)
+    # with binary search on the start times of the tempo changes,
+    # the positions are in bars starting from 1 as the start time of tempo
+    def __init__(self, bpm, tempo_changes=None):
+        # tempo_changes is a list of tempo with start times, if there are
+        # several tempo changes at the same start time, the last one is used
+        self.bpm = bpm
+        if tempo_changes is None:
+            tempo_changes = []
+        tempo_changes = [(1, bpm)] + [(i.start_time, i.bpm)
+                                      for i in tempo_changes]
+        tempo_changes.sort(key=lambda s: s[0])
+        self.start_times = []
+        self.bpms = []
+        for current_start_time, current_bpm in tempo_changes:
+            if self.start_times and self.start_times[-1] == current_start_time:
+                self.bpms[-1] = current_bpm
+            else:
+                self.start_times.append(current_start_time)
+                self.bpms.append(current_bpm)
+        # the time in seconds at the start of each tempo change
+        self.seconds = [0]
+        for i in range(1, len(self.start_times)):
+            self.seconds.append(
+                self.seconds[-1] +
+                (self.start_times[i] - self.start_times[i - 1]) * 240 /
+                self.bpms[i - 1])
+        self.offset = 0
+        self.offset = self.bar_to_seconds(1)
+
+    def __repr__(self):
+        return f'[tempo map] {list(zip(self.start_times, self.bpms))}'
+
+    def __len__(self):
+        return len(self.start_times)
+
+    def find_ind(self, bar):
+        ind = bisect_right(self.start_times, bar) - 1
+        return ind if ind > 0 else 0
+
+    def bpm_at(self, bar):
+        return self.bpms[self.find_ind(bar)]
+
+    def bar_to_seconds(self, bar):
+        ind = self.find_ind(bar)
+        return self.seconds[ind] + (bar - self.start_times[ind]
+                                    ) * 240 / self.bpms[ind] - self.offset
+
+    def seconds_to_bar(self, seconds):
+        seconds += self.offset
+        ind = bisect_right(self.seconds, seconds) - 1
+        if ind < 0:
+            ind = 0
+        return self.start_times[ind] + (seconds -
+                                        self.seconds[ind]) * self.bpms[ind] / 240
+
+    def seconds_between(self, bar1, bar2):
+        return self.bar_to_seconds(bar2) - self.bar_to_seconds(bar1)
+
+    def normalize_length(self, bar1, bar2, bpm):
+        # the length in bars between two positions when played in the bpm
+        return self.seconds_between(bar1, bar2) * bpm / 240
+
+
 class pitch_bend:
     def __init__(self,
                  value,
@@ -4823,41 +4922,23 @@ def relative_note(a, b):
         return b.name + 'bb'
 
 
-def process_normalize_tempo(obj, tempo_changes_ranges, bpm, mode=0):
+def process_normalize_tempo(obj, current_tempo_map, bpm, mode=0):
     whole_notes = obj.notes
     intervals = obj.interval
     count_length = 1
+    current_seconds = current_tempo_map.bar_to_seconds(count_length)
+    unit = bpm / 240
     for k in range(len(obj)):
-        current_note = whole_notes[k]
         current_interval = intervals[k]
+        next_seconds = current_tempo_map.bar_to_seconds(count_length +
+                                                        current_interval)
         if mode == 0:
-            current_note_left, current_note_right = count_length, count_length + current_note.duration
-            new_note_duration = 0
-        current_interval_left, current_interval_right = count_length, count_length + current_interval
-        new_interval_duration = 0
-        for each in tempo_changes_ranges:
-            each_left, each_right, each_tempo = each
-            if mode == 0:
-                if not (current_note_left >= each_right
-                        or current_note_right <= each_left):
-                    valid_length = min(current_note_right, each_right) - max(
-                        current_note_left, each_left)
-                    current_ratio = each_tempo / bpm
-                    valid_length /= current_ratio
-                    new_note_duration += valid_length
-
-            if not (current_interval_left >= each_right
-                    or current_interval_right <= each_left):
-                valid_length = min(current_interval_right, each_right) - max(
-                    current_interval_left, each_left)
-                current_ratio = each_tempo / bpm
-                valid_length /= current_ratio
-                new_interval_duration += valid_length
-        if mode == 0:
-            current_note.duration = new_note_duration
-        obj.interval[k] = new_interval_duration
-
+            current_note = whole_notes[k]
+            current_note.duration = (current_tempo_map.bar_to_seconds(
+                count_length + current_note.duration) - current_seconds) * unit
+        intervals[k] = (next_seconds - current_seconds) * unit
         count_length += current_interval
+        current_seconds = next_seconds
 
 
 def piece_process_normalize_tempo(self, bpm):
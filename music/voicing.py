@@ -0,0 +1,201 @@
+import itertools
+
+from .database import standard
+from .structures import note, chord, toNote, degree_to_note
+from .backends import get_backend
+
+# voice a whole chord progression at once, the candidate voicings of each
+# chord in the given range are enumerated, and the voicings with the least
+# total voice movement over the whole progression are found with dynamic
+# programming (viterbi), keeping only the best voicings of each chord (the
+# beam) as the states of the next step, the voice movement between two
+# voicings is measured as in chord.near_voicing, the root moves to the root,
+# and each of the other notes moves to the nearest of the other notes of
+# the previous voicing, but with the actual pitches instead of the pitch
+# classes, so that the progression does not drift in register
+
+# the pitch of the padding of the voicings with less notes, which is too
+# far from any note to be the nearest one
+padding_degree = 10**6
+
+
+def chord_pitch_classes(current_chord):
+    # the pitch classes of the notes of the chord in order without repeats,
+    # with the note of each pitch class to keep its duration and volume
+    pitch_classes = []
+    pitch_class_notes = {}
+    for each in current_chord.notes:
+        if type(each) != note:
+            continue
+        current_pitch_class = standard[each.name] % 12
+        if current_pitch_class not in pitch_class_notes:
+            pitch_classes.append(current_pitch_class)
+            pitch_class_notes[current_pitch_class] = each
+    return pitch_classes, pitch_class_notes
+
+
+def voicing_candidates(pitch_classes,
+                       low,
+                       high,
+                       keep_root=True,
+                       max_span=24,
+                       max_candidates=128):
+    # all of the voicings of the pitch classes in the range of degrees
+    # [low, high] as sorted tuples of degrees, the bass note is the first
+    # pitch class if keep_root is True, otherwise it could be any of them,
+    # the other notes are at most max_span semitones above the bass note,
+    # if there are more than max_candidates voicings, only the voicings
+    # nearest to the middle of the range are kept
+    if keep_root:
+        bass_pitch_classes = pitch_classes[:1]
+    else:
+        bass_pitch_classes = pitch_classes
+    result = set()
+    for bass_pitch_class in bass_pitch_classes:
+        upper_pitch_classes = [
+            i for i in pitch_classes if i != bass_pitch_class
+        ]
+        first_bass = low + (bass_pitch_class - low) % 12
+        for bass in range(first_bass, high + 1, 12):
+            upper_high = min(bass + max_span, high)
+            options = [[
+                i for i in range(bass + 1 + (each - bass - 1) % 12,
+                                 upper_high + 1, 12)
+            ] for each in upper_pitch_classes]
+            for each in itertools.product(*options):
+                result.add((bass, ) + tuple(sorted(each)))
+    result = sorted(result)
+    if len(result) > max_candidates:
+        center = (low + high) / 2
+        result.sort(key=lambda s: abs(sum(s) / len(s) - center))
+        result = sorted(result[:max_candidates])
+    return result
+
+
+def voicing_arrays(candidates):
+    # the bass notes and the other notes of the voicings as arrays, the
+    # other notes are padded to the same length, for the voicings without
+    # other notes, the bass note is used as the other note to move to
+    numpy = get_backend('numpy')
+    bass = numpy.array([i[0] for i in candidates], dtype=float)
+    size = max(len(i) for i in candidates) - 1
+    upper = numpy.full((len(candidates), max(size, 1)), padding_degree,
+                       dtype=float)
+    targets = numpy.full((len(candidates), max(size, 1)),
+                         padding_degree,
+                         dtype=float)
+    for i, each in enumerate(candidates):
+        if len(each) > 1:
+            upper[i, :len(each) - 1] = each[1:]
+            targets[i, :len(each) - 1] = each[1:]
+        else:
+            targets[i, 0] = each[0]
+    upper_mask = upper != padding_degree
+    return bass, upper, upper_mask, targets
+
+
+def movement_costs(previous, current):
+    # the voice movement from each of the previous voicings to each of the
+    # current voicings as an array of shape (previous, current)
+    numpy = get_backend('numpy')
+    previous_bass, previous_upper, previous_mask, previous_targets = previous
+    current_bass, current_upper, current_mask, current_targets = current
+    bass_costs = numpy.abs(previous_bass[:, None] - current_bass[None, :])
+    distances = numpy.abs(current_upper[None, :, :, None] -
+                          previous_targets[:, None, None, :]).min(axis=3)
+    upper_costs = (distances * current_mask[None, :, :]).sum(axis=2)
+    return bass_costs + upper_costs
+
+
+def voice_progression(chords,
+                      low='C3',
+                      high='C6',
+                      keep_root=True,
+                      max_span=24,
+                      beam=32,
+                      register_weight=0.5,
+                      max_candidates=128):
+    # voice the chords of a progression with the least total voice movement,
+    # low and high are the range of the notes as note names or degrees,
+    # register_weight is the cost of each semitone that the average pitch
+    # of a voicing is away from the middle of the range, which keeps the
+    # voicings in the range when the chords move a lot, returns a list of
+    # the voiced chords with the durations, volumes and intervals of the
+    # notes of the original chords
+    numpy = get_backend('numpy')
+    if type(low) == str:
+        low = toNote(low).degree
+    if type(high) == str:
+        high = toNote(high).degree
+    if low > high:
+        raise ValueError('the lowest note of the range is above the highest')
+    if not chords:
+        return []
+    center = (low + high) / 2
+    pitch_classes_list = []
+    candidates_list = []
+    for current_chord in chords:
+        pitch_classes, pitch_class_notes = chord_pitch_classes(current_chord)
+        if not pitch_classes:
+            raise ValueError('each chord of the progression needs notes')
+        candidates = voicing_candidates(pitch_classes, low, high, keep_root,
+                                        max_span, max_candidates)
+        if not candidates:
+            # the range is too small for the chord, use the chord as it is
+            candidates = [
+                tuple(
+                    sorted(pitch_class_notes[i].degree
+                           for i in pitch_classes))
+            ]
+        pitch_classes_list.append(pitch_class_notes)
+        candidates_list.append(candidates)
+    # the viterbi algorithm with a beam, states are the kept candidates
+    # of the current chord, back_pointers[k][i] is the index of the state
+    # of the previous chord leading to the state i of the chord k
+    candidates = candidates_list[0]
+    costs = register_weight * numpy.abs(
+        numpy.array([sum(i) / len(i) for i in candidates]) - center)
+    states = numpy.arange(len(candidates))
+    back_pointers = [None]
+    previous = voicing_arrays(candidates)
+    for k in range(1, len(chords)):
+        if len(states) > beam:
+            kept = numpy.argpartition(costs, beam - 1)[:beam]
+            states = states[kept]
+            costs = costs[kept]
+            previous = tuple(i[kept] for i in previous)
+        candidates = candidates_list[k]
+        current = voicing_arrays(candidates)
+        register_costs = register_weight * numpy.abs(
+            numpy.array([sum(i) / len(i) for i in candidates]) - center)
+        total_costs = costs[:, None] + movement_costs(previous, current)
+        best = total_costs.argmin(axis=0)
+        costs = total_costs[best, numpy.arange(len(candidates))] + \
+            register_costs
+        back_pointers.append(states[best])
+        states = numpy.arange(len(candidates))
+        previous = current
+    state = int(states[costs.argmin()])
+    path = [state]
+    for k in range(len(chords) - 1, 0, -1):
+        state = int(back_pointers[k][state])
+        path.append(state)
+    path.reverse()
+    result = []
+    for k, current_chord in enumerate(chords):
+        voicing = candidates_list[k][path[k]]
+        pitch_class_notes = pitch_classes_list[k]
+        new_notes = []
+        for degree in voicing:
+            original_note = pitch_class_notes[degree % 12]
+            new_notes.append(
+                degree_to_note(degree, original_note.duration,
+                               original_note.volume, original_note.channel))
+        current_intervals = current_chord.interval
+        if len(current_intervals) != len(new_notes):
+            current_intervals = [0 for i in range(len(new_notes))]
+        result.append(
+            chord(new_notes,
+                  interval=list(current_intervals),
+                  start_time=current_chord.start_time))
+    return result
@@ -0,0 +1,205 @@
+"""Objects for rendering the outputs of play() and score() expressions."""
+
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from io import BytesIO
+
+from musicode.errors import error_collector, CompilerError
+from musicode.music import music
+
+
+class OutputSink:
+    """Queue of the outputs of play() and score() expressions.
+
+    The outputs are rendered in the background while the rest of the
+    program is evaluated. MIDI files are written by background threads,
+    and scores are rendered by a pool of renderer processes. Each output
+    gets a unique file name, the first MIDI file is temp.mid and the next
+    ones are temp_2.mid, temp_3.mid, etc.
+
+    name (str) - Prefix of the output file names.
+    workers (int) - Number of background threads that write MIDI files.
+    render_jobs (int) - Number of renderer processes run at the same time.
+    renderer (str) - Renderer command, LilyPond by default.
+    render_timeout (float) - Seconds to wait for each renderer process.
+    chunk_bars (int) - If given, scores are rendered as separate scores of
+    this number of bars, named temp-1.pdf, temp-2.pdf, etc.
+    score_format (str) - "pdf" to render scores with the renderer, or
+    "musicxml" to write them as MusicXML files by the background threads.
+    emit (str) - Outputs to make: "all" of them, only the MIDI files of
+    play() with "midi", only the LilyPond sources of score() with "ly", or
+    none of them with "none".
+    """
+
+    def __init__(self, name="temp", workers=1, render_jobs=1, renderer=None,
+                 render_timeout=None, chunk_bars=None, score_format="pdf",
+                 emit="all"):
+        """Initialize OutputSink."""
+        self.name = name
+        self.workers = workers
+        self.render_jobs = render_jobs
+        self.renderer = renderer
+        self.render_timeout = render_timeout
+        self.chunk_bars = chunk_bars
+        self.score_format = score_format
+        self.emit = emit
+        self.executor = None
+        self.pool = None
+        self.pending = []
+        self.pending_scores = []
+        self.counts = {}
+
+    def output_name(self, ext):
+        """Return an unused output file name with the given extension."""
+        count = self.counts.get(ext, 0) + 1
+        self.counts[ext] = count
+        suffix = "" if count == 1 else f"_{count}"
+        return f"{self.name}{suffix}.{ext}"
+
+    def submit(self, func, value, ext, range):
+        """Queue func(value, name) to be run in the background.
+
+        The value is copied, so that it is not changed by the rest of the
+        program before it is rendered. Returns the output file name.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        name = self.output_name(ext)
+        future = self.executor.submit(func, deepcopy(value), name)
+        self.pending.append((future, name, range))
+        return name
+
+    def play(self, value, range=None):
+        """Queue writing the value of a play() expression to a MIDI file.
+
+        Returns the output file name, or None if MIDI files are not emitted.
+        """
+        if self.emit not in ("all", "midi"):
+            return None
+        return self.submit(lambda value, name: music.write(value, name=name),
+                           value, "mid", range)
+
+    def score(self, value, range=None):
+        """Queue rendering the value of a score() expression.
+
+        The LilyPond source is made right away, which is fast, and the
+        rendering is queued to the render pool. If the score format is
+        MusicXML, writing the MusicXML file is queued to the background
+        threads instead. If only LilyPond sources are emitted, writing the
+        source is queued to the background threads and nothing is rendered.
+        Returns the output file name, or None if scores are not emitted.
+        """
+        if self.emit == "ly":
+            return self.submit(
+                lambda value, name: music.gen_score_ly(value, name),
+                value, "ly", range)
+        if self.emit != "all":
+            return None
+        if self.score_format == "musicxml":
+            return self.submit(
+                lambda value, name: music.write_musicxml(value, name),
+                value, "musicxml", range)
+        if self.pool is None:
+            self.pool = music.render_pool(self.render_jobs,
+                                          self.render_timeout,
+                                          self.renderer)
+        name = self.output_name("pdf")
+        if self.chunk_bars and isinstance(value, music.piece):
+            base = name[:-len(".pdf")]
+            chunks = music.piece_chunks(value, self.chunk_bars)
+            for i, (start_bar, chunk) in enumerate(chunks):
+                self.submit_score(chunk, f"{base}-{i + 1}.pdf", range)
+        else:
+            self.submit_score(value, name, range)
+        return name
+
+    def submit_score(self, value, name, range):
+        """Queue rendering a score to the render pool."""
+        try:
+            index = music.gen_score(value, name, pool=self.pool)
+        except Exception as e:
+            err = f"could not render '{name}': {e}"
+            error_collector.add(CompilerError(err, range))
+            return
+        self.pending_scores.append((index, range))
+
+    def join(self):
+        """Wait for all of the queued outputs to be rendered.
+
+        The outputs which could not be rendered are reported to the error
+        collector. Returns the names of the rendered output files.
+        """
+        names = []
+        for future, name, range in self.pending:
+            try:
+                future.result()
+                names.append(name)
+            except Exception as e:
+                err = f"could not render '{name}': {e}"
+                error_collector.add(CompilerError(err, range))
+        self.pending = []
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.pool is not None:
+            results = self.pool.results()
+            for index, range in self.pending_scores:
+                name, outputs, error = results[index]
+                if error is None:
+                    names.append(name)
+                else:
+                    err = f"could not render '{name}': {error}"
+                    error_collector.add(CompilerError(err, range))
+            self.pending_scores = []
+            self.pool.close()
+            self.pool = None
+        return names
+
+
+class MemorySink:
+    """Outputs of play() and score() expressions kept in memory.
+
+    The outputs are made right away in the thread of the compile, and
+    nothing is written to files.
+
+    outputs (Set[str]) - "midi" to keep the MIDI files of play(), "ly" to
+    keep the LilyPond sources of score(), and "musicxml" to keep the
+    MusicXML files of score().
+    """
+
+    kinds = {"midi", "ly", "musicxml"}
+
+    def __init__(self, outputs=("midi",)):
+        """Initialize MemorySink."""
+        self.outputs = set(outputs)
+        self.midi = []
+        self.ly = []
+        self.musicxml = []
+
+    def play(self, value, range=None):
+        """Keep the MIDI file of the value of a play() expression."""
+        if "midi" not in self.outputs:
+            return None
+        try:
+            self.midi.append(
+                music.write(value, save_as_file=False).getvalue())
+        except Exception as e:
+            err = f"could not write MIDI: {e}"
+            error_collector.add(CompilerError(err, range))
+
+    def score(self, value, range=None):
+        """Keep the score of the value of a score() expression."""
+        try:
+            if "ly" in self.outputs:
+                self.ly.append(music.gen_score_ly(value))
+            if "musicxml" in self.outputs:
+                current_io = BytesIO()
+                music.write_musicxml(value, current_io)
+                self.musicxml.append(current_io.getvalue())
+        except Exception as e:
+            err = f"could not make score: {e}"
+            error_collector.add(CompilerError(err, range))
+
+    def join(self):
+        """Return no output file names, since no files are written."""
+        return []
@@ -0,0 +1,321 @@
+"""Objects for the warm compile daemon run by musicode serve.
+
+The daemon keeps one interpreter with everything imported, recompiles the
+.mc files of a directory when they change, and compiles the files sent to
+it over a Unix socket. Each compile has its own error collector, so the
+errors of one file are never reported for another one.
+"""
+
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+from musicode.errors import collect_errors, CompilerError
+
+
+def mc_files(directory):
+    """Yield the paths of the .mc files under a directory."""
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [i for i in dirs if not i.startswith(".")]
+        for name in files:
+            if name.endswith(".mc"):
+                yield os.path.join(root, name)
+
+
+class PollingWatcher:
+    """Watch the .mc files of a directory by polling their modification times.
+
+    directory (str) - Directory to watch, with its subdirectories.
+    interval (float) - Seconds between two scans of the directory.
+    """
+
+    def __init__(self, directory, interval=0.5):
+        """Initialize PollingWatcher with the current state of the files."""
+        self.directory = directory
+        self.interval = interval
+        self.files = self.scan()
+
+    def scan(self):
+        """Return {path: (modification time, size)} of the .mc files."""
+        result = {}
+        for path in mc_files(self.directory):
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            result[path] = (info.st_mtime_ns, info.st_size)
+        return result
+
+    def changes(self, timeout=None):
+        """Wait for the next scan and return the changed or new files."""
+        time.sleep(self.interval if timeout is None else
+                   min(self.interval, timeout))
+        files = self.scan()
+        changed = sorted(i for i, j in files.items()
+                         if self.files.get(i) != j)
+        self.files = files
+        return changed
+
+    def close(self):
+        """Stop watching."""
+
+
+class InotifyWatcher:
+    """Watch the .mc files of a directory with inotify, on Linux only.
+
+    The files are reported when they are closed after writing or moved
+    into the directory, which is how editors save files. The events that
+    come within settle seconds of each other are reported together, so a
+    file saved in several steps is compiled once.
+    """
+
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    event_header = struct.Struct("iIII")
+
+    def __init__(self, directory, settle=0.05):
+        """Initialize InotifyWatcher, which raises OSError if it can't."""
+        self.directory = directory
+        self.settle = settle
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.watches = {}
+        try:
+            self.add_tree(directory)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def add_watch(self, path):
+        """Watch one directory."""
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self.watches[wd] = path
+
+    def add_tree(self, directory):
+        """Watch a directory and its subdirectories."""
+        self.add_watch(directory)
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [i for i in dirs if not i.startswith(".")]
+            for name in dirs:
+                self.add_watch(os.path.join(root, name))
+
+    def read_events(self, changed):
+        """Read the pending events and add the changed files to changed."""
+        data = os.read(self.fd, 65536)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.event_header.unpack_from(
+                data, offset)
+            offset += self.event_header.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches:
+                continue
+            path = os.path.join(self.watches[wd], os.fsdecode(name))
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and \
+                        not os.path.basename(path).startswith("."):
+                    try:
+                        self.add_tree(path)
+                    except OSError:
+                        pass
+                    # the files written before the watch is added
+                    changed.update(mc_files(path))
+            elif path.endswith(".mc") and mask & (self.IN_CLOSE_WRITE |
+                                                  self.IN_MOVED_TO):
+                changed.add(path)
+
+    def changes(self, timeout=None):
+        """Wait up to timeout seconds and return the changed files."""
+        changed = set()
+        ready = select.select([self.fd], [], [], timeout)[0]
+        while ready:
+            self.read_events(changed)
+            ready = select.select([self.fd], [], [], self.settle)[0]
+        return sorted(changed)
+
+    def close(self):
+        """Stop watching."""
+        os.close(self.fd)
+
+
+def make_watcher(directory, interval=0.5, polling=False):
+    """Return an InotifyWatcher, or a PollingWatcher if inotify is not
+    available or polling is asked for.
+    """
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError, TypeError):
+            pass
+    return PollingWatcher(directory, interval)
+
+
+def diagnostic(issue):
+    """Return a CompilerError as a dict which can be written as JSON."""
+    result = {"message": issue.descrip,
+              "severity": "warning" if issue.warning else "error"}
+    if issue.range:
+        result["file"] = issue.range.start.file
+        result["line"] = issue.range.start.line
+        result["column"] = issue.range.start.col
+        result["end_line"] = issue.range.end.line
+        result["end_column"] = issue.range.end.col
+    return result
+
+
+class CompileServer:
+    """Compile .mc files in a warm interpreter.
+
+    compile_file (function) - compile_file(path, emit) compiles one file
+    and writes its outputs, and returns whether it is compiled.
+    directory (str) - Directory of the watched files, which is also the
+    base of the relative paths of the requests.
+    socket_path (str) - Path of the Unix socket for compile requests, or
+    None to only watch the directory.
+
+    A request is a line of JSON such as {"file": "song.mc"}, with an
+    optional "emit" to choose the outputs as musicode --emit does, and the
+    reply is a line of JSON with "file", "ok", "diagnostics" and "time_ms".
+    """
+
+    def __init__(self, compile_file, directory, socket_path=None):
+        """Initialize CompileServer."""
+        self.compile_file = compile_file
+        self.directory = directory
+        self.socket_path = socket_path
+        # the outputs of the same file are written by one compile at a time
+        self.lock = threading.Lock()
+        self.server = None
+
+    def run(self, file, emit=None):
+        """Compile one file.
+
+        Returns the path of the file, whether it is compiled, its errors and
+        warnings, and the milliseconds taken.
+        """
+        if not os.path.isabs(file):
+            file = os.path.join(self.directory, file)
+        start = time.perf_counter()
+        with self.lock, collect_errors() as collector:
+            try:
+                ok = bool(self.compile_file(file, emit))
+            except Exception as e:
+                # an internal error of one compile does not stop the daemon
+                collector.add(CompilerError(f"internal error: {e!r}"))
+                ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        return file, ok, collector.issues, elapsed
+
+    def compile(self, file, emit=None):
+        """Compile one file and return the reply of a request for it."""
+        file, ok, issues, elapsed = self.run(file, emit)
+        return {"file": file,
+                "ok": ok,
+                "diagnostics": [diagnostic(i) for i in issues],
+                "time_ms": elapsed}
+
+    def start_socket(self):
+        """Listen for compile requests on the socket in a thread."""
+        if self.socket_path is None:
+            return
+        remove_stale_socket(self.socket_path)
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    try:
+                        request = json.loads(line)
+                        reply = server.compile(request["file"],
+                                               request.get("emit"))
+                    except (ValueError, KeyError, TypeError) as e:
+                        reply = {"ok": False,
+                                 "error": f"bad request: {e!r}"}
+                    self.wfile.write(json.dumps(reply).encode() + b"\n")
+                    self.wfile.flush()
+
+        self.server = socketserver.ThreadingUnixStreamServer(
+            self.socket_path, Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def watch(self, watcher, report):
+        """Compile the files reported by the watcher until interrupted.
+
+        report (function) - report(file, ok, issues, milliseconds) is
+        called after each compile.
+        """
+        while True:
+            for file in watcher.changes(1.0):
+                report(*self.run(file))
+
+    def close(self):
+        """Stop listening on the socket and remove it."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
+
+def remove_stale_socket(path):
+    """Remove the socket file of a daemon which is no longer running.
+
+    Raises OSError if another daemon is listening on the socket.
+    """
+    if not os.path.exists(path):
+        return
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:
+        os.remove(path)
+        return
+    finally:
+        client.close()
+    raise OSError(f"another daemon is listening on '{path}'")
+
+
+def request(socket_path, file, emit=None):
+    """Send a compile request to a daemon and return its reply."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        message = {"file": file}
+        if emit is not None:
+            message["emit"] = emit
+        client.sendall(json.dumps(message).encode() + b"\n")
+        with client.makefile("rb") as f:
+            return json.loads(f.readline())
+    finally:
+        client.close()
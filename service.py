@@ -0,0 +1,448 @@
+"""HTTP render service run by musicode http.
+
+The service compiles the .mc source sent to it into MIDI, LilyPond and
+MusicXML with a pool of warm worker processes. Requests with the same
+source and outputs as a request which is still being compiled wait for
+the same job instead of compiling it again. It only uses asyncio and the
+standard library, and it is meant to listen on localhost or an internal
+network.
+
+Endpoints:
+
+    POST /compile - The body is JSON with "source", and optional "filename"
+    and "outputs" (a list of "midi", "ly" and "musicxml", default to
+    ["midi"]). The reply is JSON with "ok", "diagnostics", "outputs" (the
+    MIDI and MusicXML files are in base64), "time_ms" and "coalesced".
+    POST /render?format=midi|ly|musicxml&index=0 - The body is the source,
+    and the reply is the output file with the index, or JSON with the
+    diagnostics and status 422 if the source could not be compiled.
+    GET /metrics - JSON with the queue depth and the latencies.
+    GET /health - "ok".
+"""
+
+import asyncio
+import base64
+import collections
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import time
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+
+from musicode.serve import diagnostic
+
+
+output_kinds = ("midi", "ly", "musicxml")
+endpoints = ("/compile", "/render", "/metrics", "/health")
+content_types = {
+    "midi": "audio/midi",
+    "ly": "text/x-lilypond; charset=utf-8",
+    "musicxml": "application/vnd.recordare.musicxml+xml",
+}
+
+
+def warm_worker():
+    """Import the compiler in a new worker process.
+
+    Ctrl-C is ignored by the workers, which are stopped by the service.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import musicode.compiler  # noqa: F401
+
+
+def make_workers(jobs):
+    """Return a pool of worker processes.
+
+    The workers are forked by a fork server where it is available, so the
+    workers which replace a broken pool do not inherit the sockets of the
+    open connections, which would then never be closed for the clients.
+    """
+    context = None
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+    return concurrent.futures.ProcessPoolExecutor(
+        jobs, mp_context=context, initializer=warm_worker)
+
+
+def compile_job(source, filename, outputs):
+    """Compile a source in a worker process, and return its results."""
+    from musicode.compiler import compile_source
+    start = time.perf_counter()
+    result = compile_source(source, filename=filename, outputs=outputs)
+    return {"diagnostics": result.diagnostics,
+            "ok": result.ok,
+            "midi": result.midi,
+            "ly": result.ly,
+            "musicxml": result.musicxml,
+            "time_ms": (time.perf_counter() - start) * 1000}
+
+
+def job_key(source, filename, outputs):
+    """Return the hash of a job, which is the same for identical requests."""
+    current_hash = hashlib.blake2b(digest_size=20)
+    for each in (filename, ",".join(sorted(outputs)), source):
+        current_hash.update(each.encode("utf-8"))
+        current_hash.update(b"\0")
+    return current_hash.hexdigest()
+
+
+class HTTPError(Exception):
+    """An error with the HTTP status of its response."""
+
+    def __init__(self, status, descrip):
+        """Initialize HTTPError."""
+        super().__init__(descrip)
+        self.status = status
+        self.descrip = descrip
+
+
+class LatencyWindow:
+    """Latencies of the recent requests, in milliseconds.
+
+    size (int) - Number of the recent latencies kept for the percentiles.
+    """
+
+    def __init__(self, size=1024):
+        """Initialize LatencyWindow."""
+        self.recent = collections.deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, milliseconds):
+        """Add the latency of a request."""
+        self.recent.append(milliseconds)
+        self.count += 1
+        self.total += milliseconds
+
+    def summary(self):
+        """Return the count, mean, percentiles and maximum as a dict."""
+        result = {"count": self.count,
+                  "mean": self.total / self.count if self.count else 0.0}
+        recent = sorted(self.recent)
+        for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+            result[name] = (recent[min(len(recent) - 1,
+                                       int(fraction * len(recent)))]
+                            if recent else 0.0)
+        result["max"] = recent[-1] if recent else 0.0
+        return result
+
+
+class RenderService:
+    """HTTP server which compiles sources with a pool of worker processes.
+
+    jobs (int) - Number of worker processes, default to the number of CPUs.
+    timeout (float) - Seconds a request waits for its job, or None.
+    max_body (int) - Largest request body in bytes.
+    """
+
+    def __init__(self, jobs=None, timeout=None, max_body=2**20):
+        """Initialize RenderService."""
+        self.jobs = jobs or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_body = max_body
+        self.executor = None
+        self.server = None
+        # the running jobs by their keys, for coalescing the requests, with
+        # the pools of worker processes they are submitted to
+        self.in_flight = {}
+        self.requests = 0
+        self.coalesced = 0
+        self.jobs_done = 0
+        self.statuses = collections.Counter()
+        self.latency = collections.defaultdict(LatencyWindow)
+        self.job_latency = LatencyWindow()
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start the worker processes and listen on the host and port.
+
+        Port 0 picks a free port, which is then in self.port.
+        """
+        self.executor = make_workers(self.jobs)
+        loop = asyncio.get_running_loop()
+        # start all of the workers now instead of on the first requests
+        await asyncio.gather(*(loop.run_in_executor(self.executor, time.sleep,
+                                                    0.01)
+                               for _ in range(self.jobs)))
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.host, self.port = self.server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        """Serve until cancelled."""
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        """Stop listening and stop the worker processes."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def metrics(self):
+        """Return the metrics of the service as a dict."""
+        return {
+            "workers": self.jobs,
+            "in_flight": len(self.in_flight),
+            "queue_depth": max(0, len(self.in_flight) - self.jobs),
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "jobs": self.jobs_done,
+            "statuses": {str(i): j for i, j in sorted(self.statuses.items())},
+            "latency_ms": {i: j.summary()
+                           for i, j in sorted(self.latency.items())},
+            "job_latency_ms": self.job_latency.summary(),
+        }
+
+    async def run_job(self, source, filename, outputs):
+        """Return the results of a job and whether it is coalesced.
+
+        A job with the same key as a running one waits for that one.
+        """
+        key = job_key(source, filename, outputs)
+        coalesced = key in self.in_flight
+        if coalesced:
+            self.coalesced += 1
+            future, executor = self.in_flight[key]
+        else:
+            loop = asyncio.get_running_loop()
+            executor = self.executor
+            try:
+                future = loop.run_in_executor(executor, compile_job,
+                                              source, filename,
+                                              sorted(outputs))
+            except concurrent.futures.process.BrokenProcessPool:
+                self.restart_workers(executor)
+                raise HTTPError(503, "the worker processes were restarted")
+            self.in_flight[key] = future, executor
+            future.add_done_callback(lambda f: self.job_done(key, f))
+        try:
+            # a request which times out or is cancelled does not cancel the
+            # job for the other requests waiting for it
+            result = await asyncio.wait_for(asyncio.shield(future),
+                                            self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(504, f"the job took longer than "
+                            f"{self.timeout} seconds")
+        except concurrent.futures.process.BrokenProcessPool:
+            self.restart_workers(executor)
+            raise HTTPError(500, "a worker process stopped unexpectedly")
+        except asyncio.CancelledError:
+            # the job is cancelled when its pool is shut down, which is not
+            # a cancellation of the request
+            if not future.cancelled():
+                raise
+            raise HTTPError(503, "the worker processes were restarted")
+        return result, coalesced
+
+    def job_done(self, key, future):
+        """Remove a finished job from the running ones."""
+        self.in_flight.pop(key, None)
+        self.jobs_done += 1
+        if not future.cancelled() and future.exception() is None:
+            self.job_latency.add(future.result()["time_ms"])
+
+    def restart_workers(self, executor):
+        """Replace a broken pool of worker processes.
+
+        The pool is only replaced once, by the first of the jobs submitted
+        to it which finds it broken.
+        """
+        if executor is not self.executor:
+            return
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = make_workers(self.jobs)
+
+    async def handle(self, reader, writer):
+        """Serve the requests of one connection."""
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except HTTPError as e:
+                    self.write_response(writer, *error_response(e), False)
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+                start = time.perf_counter()
+                path = urlsplit(target).path
+                if path not in endpoints:
+                    path = "other"
+                self.requests += 1
+                try:
+                    response = await self.route(method, target, body)
+                except HTTPError as e:
+                    response = error_response(e)
+                except Exception as e:
+                    # such as an unexpected exception of the compiler
+                    response = error_response(
+                        HTTPError(500, f"internal error: {e!r}"))
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self.statuses[response[0]] += 1
+                self.latency[path].add((time.perf_counter() - start) * 1000)
+                self.write_response(writer, *response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        """Return the method, target, headers and body of a request.
+
+        Returns None at the end of the connection.
+        """
+        line = await self.read_line(reader, 400, "the request line is too "
+                                    "long")
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(400, "bad request line")
+        headers = {}
+        while True:
+            line = await self.read_line(reader, 431, "a header is too long")
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "bad content length")
+        if length < 0:
+            raise HTTPError(400, "bad content length")
+        if length > self.max_body:
+            raise HTTPError(413, f"the body is longer than {self.max_body} "
+                            "bytes")
+        body = await reader.readexactly(length)
+        return method, target, headers, body
+
+    async def read_line(self, reader, status, message):
+        """Return a line of a request, or raise HTTPError with the status
+        if it is longer than the limit of the stream.
+        """
+        try:
+            return await reader.readline()
+        except ValueError:
+            raise HTTPError(status, message)
+
+    def write_response(self, writer, status, content_type, body,
+                       keep_alive=True):
+        """Write a response."""
+        head = (f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                "\r\n")
+        writer.write(head.encode("latin-1") + body)
+
+    async def route(self, method, target, body):
+        """Return the status, content type and body of a response."""
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if url.path == "/health" and method == "GET":
+            return 200, "text/plain; charset=utf-8", b"ok\n"
+        if url.path == "/metrics" and method == "GET":
+            return json_response(200, self.metrics())
+        if url.path == "/compile" and method == "POST":
+            return await self.compile_endpoint(body)
+        if url.path == "/render" and method == "POST":
+            return await self.render_endpoint(query, body)
+        if url.path in endpoints:
+            raise HTTPError(405, f"{method} is not allowed for {url.path}")
+        raise HTTPError(404, f"no such endpoint: {url.path}")
+
+    async def compile_endpoint(self, body):
+        """Compile the source of a JSON request."""
+        try:
+            request = json.loads(body)
+            source = request["source"]
+            filename = request.get("filename") or "<source>"
+            outputs = request.get("outputs", ["midi"])
+            if not isinstance(source, str) or not isinstance(filename, str):
+                raise TypeError("source and filename must be strings")
+        except (ValueError, KeyError, TypeError) as e:
+            raise HTTPError(400, f"bad request: {e}")
+        check_outputs(outputs)
+        result, coalesced = await self.run_job(source, filename, outputs)
+        files = {}
+        for kind in outputs:
+            files[kind] = [each if kind == "ly" else
+                           base64.b64encode(each).decode("ascii")
+                           for each in result[kind]]
+        return json_response(200, {
+            "ok": result["ok"],
+            "diagnostics": [diagnostic(i) for i in result["diagnostics"]],
+            "outputs": files,
+            "time_ms": result["time_ms"],
+            "coalesced": coalesced})
+
+    async def render_endpoint(self, query, body):
+        """Compile a source and return one of its output files."""
+        kind = query.get("format", ["midi"])[0]
+        filename = query.get("filename", ["<source>"])[0]
+        check_outputs([kind])
+        try:
+            index = int(query.get("index", ["0"])[0])
+            source = body.decode("utf-8")
+        except ValueError as e:
+            raise HTTPError(400, f"bad request: {e}")
+        result, coalesced = await self.run_job(source, filename, [kind])
+        if not result["ok"]:
+            return json_response(422, {
+                "ok": False,
+                "diagnostics": [diagnostic(i)
+                                for i in result["diagnostics"]]})
+        files = result[kind]
+        if not 0 <= index < len(files):
+            raise HTTPError(404, f"the source has {len(files)} {kind} "
+                            "outputs")
+        output = files[index]
+        if kind == "ly":
+            output = output.encode("utf-8")
+        return 200, content_types[kind], output
+
+
+def check_outputs(outputs):
+    """Raise HTTPError if the outputs are not a list of known kinds."""
+    if not isinstance(outputs, list) or not outputs or \
+            any(i not in output_kinds for i in outputs):
+        raise HTTPError(400, "outputs must be a list of "
+                        f"{', '.join(output_kinds)}")
+
+
+def json_response(status, value):
+    """Return a JSON response."""
+    return status, "application/json", json.dumps(value).encode("utf-8")
+
+
+def error_response(error):
+    """Return the JSON response of an HTTPError."""
+    return json_response(error.status, {"error": error.descrip})
+
+
+async def run_service(host, port, jobs=None, timeout=None, max_body=2**20,
+                      ready=None):
+    """Run a RenderService until cancelled.
+
+    ready (function) - ready(service) is called once it is listening.
+    """
+    service = RenderService(jobs, timeout, max_body)
+    await service.start(host, port)
+    try:
+        if ready is not None:
+            ready(service)
+        await service.serve_forever()
+    finally:
+        await service.close()
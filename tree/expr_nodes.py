@@ -821,7 +821,10 @@ class PlayExpr(_RExprNode):
 
         dummy_il_code = il_code.copy()
         expr = self.expr.make_il_raw(dummy_il_code, symbol_table, c)
-        music.write(expr.py_value)
+        if c.output_sink:
+            c.output_sink.play(expr.py_value, self.r)
+        else:
+            music.write(expr.py_value)
         return expr
 
 
@@ -839,7 +842,10 @@ class ScoreExpr(_RExprNode):
 
         dummy_il_code = il_code.copy()
         expr = self.expr.make_il_raw(dummy_il_code, symbol_table, c)
-        music.gen_score(expr.py_value)
+        if c.output_sink:
+            c.output_sink.score(expr.py_value, self.r)
+        else:
+            music.gen_score(expr.py_value)
         return expr
 
 